@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio interface for unlocking, generating, loading and synchronizing.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from password_generator import CtSesam
+import asyncio
+import os
+
+
+class AsyncSesam(object):
+    """
+    Wraps a KgkManager and a PasswordSettingsManager for use in an event loop. Key derivation and AES run in a
+    pool of worker threads (hashlib and pycryptodome release the GIL) and network requests run in a separate
+    pool so slow servers do not occupy the workers for the CPU bound jobs. Operations which change the settings
+    are serialized.
+
+    :param kgk_manager: a kgk manager with a preference manager
+    :type kgk_manager: KgkManager
+    :param settings_manager: a settings manager
+    :type settings_manager: PasswordSettingsManager
+    :param max_workers: number of worker threads for the CPU bound jobs (defaults to the number of CPUs)
+    :type max_workers: int
+    """
+    def __init__(self, kgk_manager, settings_manager, max_workers=None):
+        self.kgk_manager = kgk_manager
+        self.settings_manager = settings_manager
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.cpu_executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.io_executor = ThreadPoolExecutor(max_workers=4)
+        self.lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shuts the worker pools down.
+        """
+        self.cpu_executor.shutdown(wait=False)
+        self.io_executor.shutdown(wait=False)
+
+    def get_lock(self):
+        """
+        Returns the lock which serializes changes of the settings.
+
+        :return: the lock
+        :rtype: asyncio.Lock
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    async def run_cpu_bound(self, function, *args):
+        """
+        Runs a function in the pool for CPU bound jobs.
+
+        :param function: the function
+        :return: the result of the function
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, function, *args)
+
+    async def run_io_bound(self, function, *args):
+        """
+        Runs a function in the pool for network requests.
+
+        :param function: the function
+        :return: the result of the function
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, function, *args)
+
+    async def unlock(self, password):
+        """
+        Decrypts the local kgk with the masterpassword.
+
+        :param password: the masterpassword
+        :type password: str
+        """
+        preference_manager = self.kgk_manager.preference_manager
+        async with self.get_lock():
+            await self.run_cpu_bound(lambda: self.kgk_manager.decrypt_kgk(preference_manager.get_kgk_block(),
+                                                                          password=password.encode('utf-8'),
+                                                                          salt=preference_manager.get_salt()))
+
+    async def generate(self, setting):
+        """
+        Generates the password for a setting.
+
+        :param setting: the setting
+        :type setting: PasswordSetting
+        :return: the password
+        :rtype: str
+        """
+        def generate_password():
+            sesam = CtSesam(setting.get_domain(),
+                            setting.get_username(),
+                            self.kgk_manager.get_kgk(),
+                            setting.get_salt(),
+                            setting.get_iterations(),
+                            self.settings_manager.hash_cache)
+            return sesam.generate(setting)
+        return await self.run_cpu_bound(generate_password)
+
+    async def generate_many(self, settings):
+        """
+        Generates the passwords for many settings concurrently.
+
+        :param settings: the settings
+        :type settings: [PasswordSetting]
+        :return: the passwords in the same order as the settings
+        :rtype: [str]
+        """
+        return list(await asyncio.gather(*[self.generate(setting) for setting in settings]))
+
+    async def pull(self):
+        """
+        Pulls data from the sync server.
+
+        :return: was the pull successful and the pulled base64 data
+        :rtype: (bool, str)
+        """
+        return await self.run_io_bound(self.settings_manager.sync_manager.pull)
+
+    async def push(self, data):
+        """
+        Pushes data to the sync server.
+
+        :param data: base64 data
+        :type data: str
+        """
+        return await self.run_io_bound(self.settings_manager.sync_manager.push, data)
+
+    async def push_delta(self, delta):
+        """
+        Pushes a delta to the sync server.
+
+        :param delta: base64 delta
+        :type delta: str
+        :return: was the push successful?
+        :rtype: bool
+        """
+        return await self.run_io_bound(self.settings_manager.sync_manager.push_delta,
+                                       self.settings_manager.remote_version, delta)
+
+    async def load_settings(self, password, no_sync=False):
+        """
+        Loads the local settings and merges the settings from the sync server. If the sync settings are already
+        known the local settings are decrypted while the pull is waiting for the server. Otherwise the sync settings
+        are read from the local settings first.
+
+        :param password: the masterpassword
+        :type password: str
+        :param no_sync: skip the sync update?
+        :type no_sync: bool
+        """
+        async with self.get_lock():
+            pull = None
+            if not no_sync and self.settings_manager.sync_manager.has_settings():
+                pull = asyncio.ensure_future(self.pull())
+            try:
+                await self.run_cpu_bound(self.settings_manager.load_local_settings, self.kgk_manager)
+            except Exception:
+                if pull is not None:
+                    pull.cancel()
+                raise
+            if pull is None and not no_sync and self.settings_manager.sync_manager.has_settings():
+                pull = asyncio.ensure_future(self.pull())
+            if pull is not None:
+                pull_successful, data = await pull
+                await self.run_cpu_bound(self.settings_manager.update_from_pulled_data,
+                                         self.kgk_manager, password, pull_successful, data)
+
+    async def store_settings(self):
+        """
+        Stores the settings locally and pushes them to the sync server if necessary.
+        """
+        async with self.get_lock():
+            await self.run_cpu_bound(self.settings_manager.store_local_settings, self.kgk_manager)
+            if self.settings_manager.update_remote:
+                delta = None
+                if self.settings_manager.sync_manager.supports_delta():
+                    delta = await self.run_cpu_bound(self.settings_manager.get_delta_export_data, self.kgk_manager)
+                if delta is not None and await self.push_delta(delta):
+                    self.settings_manager.acknowledge_push(delta)
+                else:
+                    data = await self.run_cpu_bound(self.settings_manager.get_export_data, self.kgk_manager)
+                    if await self.push(data):
+                        self.settings_manager.acknowledge_push(data)
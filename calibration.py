@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Measures the speed of PBKDF2 on this machine and recommends iteration counts for a target latency.
+"""
+
+from hashlib import pbkdf2_hmac
+import platform
+import json
+import math
+import time
+import os
+
+CALIBRATION_FILE = os.path.expanduser('~/.config/ct/calibration.json')
+HASH_FUNCTIONS = ['sha512', 'sha384', 'sha256']
+
+
+class IterationCalibrator(object):
+    """
+    Benchmarks pbkdf2_hmac with the hash functions used for password generation (SHA512), kgk encryption (SHA384)
+    and settings encryption (SHA256). The measurements are cached in a file. Measurements of other hosts are
+    ignored.
+
+    :param cache_file: file for the measurements (None disables the cache file)
+    :type cache_file: str
+    :param sample_duration: minimal duration of a measurement in seconds
+    :type sample_duration: float
+    """
+    def __init__(self, cache_file=CALIBRATION_FILE, sample_duration=0.2):
+        self.cache_file = cache_file
+        self.sample_duration = sample_duration
+        self.measurements = {}
+        self.load()
+
+    def load(self):
+        """
+        Loads the cached measurements for this host.
+        """
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+            if type(data) != dict or data.get('host') != platform.node() or type(data.get('measurements')) != dict:
+                return
+            measurements = {hash_name: float(rate) for hash_name, rate in data['measurements'].items()
+                            if hash_name in HASH_FUNCTIONS}
+        except (OSError, ValueError, TypeError):
+            return
+        self.measurements = {hash_name: rate for hash_name, rate in measurements.items()
+                             if math.isfinite(rate) and rate > 0}
+
+    def save(self):
+        """
+        Writes the measurements to the cache file.
+        """
+        if not self.cache_file:
+            return
+        if not os.path.exists(os.path.dirname(self.cache_file)):
+            os.makedirs(os.path.dirname(self.cache_file))
+        with open(self.cache_file, 'w') as f:
+            json.dump({'host': platform.node(), 'measurements': self.measurements}, f)
+
+    def measure(self, hash_name):
+        """
+        Measures how many iterations per second pbkdf2_hmac computes with the given hash function. The iteration
+        count is doubled until a run takes at least sample_duration seconds.
+
+        :param hash_name: 'sha512', 'sha384' or 'sha256'
+        :type hash_name: str
+        :return: iterations per second
+        :rtype: float
+        """
+        if hash_name not in HASH_FUNCTIONS:
+            raise ValueError("Unknown hash function: " + str(hash_name))
+        iterations = 1024
+        while True:
+            start = time.perf_counter()
+            pbkdf2_hmac(hash_name, b'calibration', b'pepper', iterations)
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.sample_duration:
+                break
+            iterations *= 2
+        self.measurements[hash_name] = iterations / elapsed
+        return self.measurements[hash_name]
+
+    def calibrate(self):
+        """
+        Measures all hash functions and saves the results.
+
+        :return: iterations per second for each hash function
+        :rtype: dict
+        """
+        for hash_name in HASH_FUNCTIONS:
+            self.measure(hash_name)
+        self.save()
+        return dict(self.measurements)
+
+    def get_rate(self, hash_name):
+        """
+        Returns the iterations per second. The hash function is measured if there is no cached measurement.
+
+        :param hash_name: 'sha512', 'sha384' or 'sha256'
+        :type hash_name: str
+        :return: iterations per second
+        :rtype: float
+        """
+        if hash_name not in self.measurements:
+            self.measure(hash_name)
+            self.save()
+        return self.measurements[hash_name]
+
+    def recommend_iterations(self, target_latency, hash_name='sha512', minimum=1):
+        """
+        Returns the iteration count which takes about target_latency seconds on this machine.
+
+        :param target_latency: the desired duration of one key derivation in seconds
+        :type target_latency: float
+        :param hash_name: 'sha512', 'sha384' or 'sha256'
+        :type hash_name: str
+        :param minimum: the recommendation is never lower than this
+        :type minimum: int
+        :return: iteration count
+        :rtype: int
+        """
+        if target_latency <= 0:
+            raise ValueError("The target latency has to be positive.")
+        return max(minimum, int(self.get_rate(hash_name) * target_latency))
+
+    def estimate_latency(self, iterations, hash_name='sha512'):
+        """
+        Returns the estimated duration of a key derivation with the given iteration count in seconds.
+
+        :param iterations: iteration count
+        :type iterations: int
+        :param hash_name: 'sha512', 'sha384' or 'sha256'
+        :type hash_name: str
+        :return: duration in seconds
+        :rtype: float
+        """
+        return iterations / self.get_rate(hash_name)
@@ -6,13 +6,22 @@ Encryption and decryption module.
 
 from Crypto.Cipher import AES
 from hashlib import pbkdf2_hmac
+from threading import Lock
+import hmac
 import os
 
+KEY_CHECK_VALUE_LENGTH = 8
+AUTHENTICATION_TAG_LENGTH = 16
+BLOCK_SIZE = 16
+
 
 class Crypter(object):
     """
     Encrypt and decrypt with AES in CBC mode with PKCS7 padding. The constructor calculates the key from the given
     password and salt with PBKDF2 using HMAC with SHA512 and 32768 iterations.
+
+    For the authenticated format AES is used in GCM mode and the ciphertext is preceded by a key check value and
+    the authentication tag.
     """
     def __init__(self, key_iv):
         if len(key_iv) == 48:
@@ -22,7 +31,7 @@ class Crypter(object):
             raise ValueError("Wrong key_iv length.")
 
     @staticmethod
-    def create_key(password, salt, iterations=1024):
+    def create_key(password, salt, iterations=1024, cache=None):
         """
         Creates a key for encrypting/decrypting settings.
 
@@ -32,13 +41,17 @@ class Crypter(object):
         :type salt: bytes
         :param iterations: an iteration count
         :type iterations: int
+        :param cache: an optional cache for derived keys
+        :type cache: KeyDerivationCache
         :return: a key
         :rtype: bytes
         """
+        if cache is not None:
+            return cache.derive('sha256', password, salt, iterations)
         return pbkdf2_hmac('sha256', password, salt, iterations)
 
     @staticmethod
-    def createIvKey(password, salt, iterations=32768):
+    def createIvKey(password, salt, iterations=32768, cache=None):
         """
         Creates a key for encrypting/decrypting kgk blocks.
 
@@ -48,9 +61,13 @@ class Crypter(object):
         :type salt: bytes
         :param iterations: an iteration count
         :type iterations: int
+        :param cache: an optional cache for derived keys
+        :type cache: KeyDerivationCache
         :return: a key
         :rtype: bytes
         """
+        if cache is not None:
+            return cache.derive('sha384', password, salt, iterations)
         return pbkdf2_hmac('sha384', password, salt, iterations)
 
     @staticmethod
@@ -130,6 +147,122 @@ class Crypter(object):
         aes_object = AES.new(self.key, AES.MODE_CBC, self.iv)
         return self.remove_pkcs7_padding(aes_object.decrypt(encrypted_data))
 
+    def get_encryptor(self):
+        """
+        Returns an object for encrypting data chunk by chunk with AES in CBC mode with PKCS7 padding. The result
+        is the same as the one of encrypt.
+
+        :return: an encryptor
+        :rtype: StreamEncryptor
+        """
+        return StreamEncryptor(self.key, self.iv)
+
+    def get_decryptor(self):
+        """
+        Returns an object for decrypting data chunk by chunk which was encrypted with AES in CBC mode with PKCS7
+        padding.
+
+        :return: a decryptor
+        :rtype: StreamDecryptor
+        """
+        return StreamDecryptor(self.key, self.iv)
+
+    def get_key_check_value(self):
+        """
+        Returns a short value derived from the key with HMAC-SHA256. A mismatch shows that the key is wrong without
+        decrypting anything.
+
+        :return: key check value
+        :rtype: bytes
+        """
+        return hmac.new(self.key, b'ctSESAM key check', 'sha256').digest()[:KEY_CHECK_VALUE_LENGTH]
+
+    def encrypt_authenticated(self, data, associated_data=b''):
+        """
+        Encrypts with AES in GCM mode. The iv is used as nonce so never encrypt twice with the same key and iv.
+        The result starts with the key check value followed by the authentication tag and the ciphertext.
+
+        :param bytes data: data for encryption
+        :param bytes associated_data: data which is authenticated but not encrypted
+        :return: key check value, tag and encrypted data
+        :rtype: bytes
+        """
+        aes_object = AES.new(self.key, AES.MODE_GCM, nonce=self.iv, mac_len=AUTHENTICATION_TAG_LENGTH)
+        aes_object.update(associated_data)
+        ciphertext, tag = aes_object.encrypt_and_digest(data)
+        return self.get_key_check_value() + tag + ciphertext
+
+    def decrypt_authenticated(self, encrypted_data, associated_data=b''):
+        """
+        Decrypts data created by encrypt_authenticated. A wrong key is rejected by the key check value before
+        anything is decrypted. Manipulated or corrupt data is rejected by the authentication tag.
+
+        :param bytes encrypted_data: key check value, tag and encrypted data
+        :param bytes associated_data: data which was authenticated but not encrypted
+        :return: decrypted data
+        :rtype: bytes
+        """
+        header_length = KEY_CHECK_VALUE_LENGTH + AUTHENTICATION_TAG_LENGTH
+        aes_object = self.create_authenticated_decryption(encrypted_data, associated_data)
+        try:
+            return aes_object.decrypt_and_verify(encrypted_data[header_length:],
+                                                 encrypted_data[KEY_CHECK_VALUE_LENGTH:header_length])
+        except ValueError:
+            raise ValueError("The encrypted data is corrupt: The authentication failed.")
+
+    def decrypt_authenticated_into(self, encrypted_data, output, associated_data=b''):
+        """
+        Decrypts data created by encrypt_authenticated directly into a writable buffer. The content of the buffer
+        must not be used if this raises a ValueError.
+
+        :param bytes encrypted_data: key check value, tag and encrypted data
+        :param output: a writable buffer with at least len(encrypted_data) - 24 bytes
+        :type output: bytearray or memoryview
+        :param bytes associated_data: data which was authenticated but not encrypted
+        :return: number of bytes written
+        :rtype: int
+        """
+        header_length = KEY_CHECK_VALUE_LENGTH + AUTHENTICATION_TAG_LENGTH
+        aes_object = self.create_authenticated_decryption(encrypted_data, associated_data)
+        encrypted_data = memoryview(encrypted_data).cast('B')
+        length = len(encrypted_data) - header_length
+        aes_object.decrypt(encrypted_data[header_length:], output=memoryview(output).cast('B')[:length])
+        try:
+            aes_object.verify(encrypted_data[KEY_CHECK_VALUE_LENGTH:header_length])
+        except ValueError:
+            raise ValueError("The encrypted data is corrupt: The authentication failed.")
+        return length
+
+    def create_authenticated_decryption(self, encrypted_data, associated_data):
+        """
+        Checks the length and the key check value and creates the AES object for decrypting authenticated data.
+
+        :param bytes encrypted_data: key check value, tag and encrypted data
+        :param bytes associated_data: data which was authenticated but not encrypted
+        :return: AES object in GCM mode
+        """
+        if len(encrypted_data) < KEY_CHECK_VALUE_LENGTH + AUTHENTICATION_TAG_LENGTH:
+            raise ValueError("The encrypted data is too short.")
+        if not hmac.compare_digest(bytes(encrypted_data[:KEY_CHECK_VALUE_LENGTH]), self.get_key_check_value()):
+            raise ValueError("Wrong key: The key check value does not match.")
+        aes_object = AES.new(self.key, AES.MODE_GCM, nonce=self.iv, mac_len=AUTHENTICATION_TAG_LENGTH)
+        aes_object.update(associated_data)
+        return aes_object
+
+    def decrypt_into(self, encrypted_data, output):
+        """
+        Decrypts with AES in CBC mode with PKCS7 padding directly into a writable buffer. The padding is checked.
+
+        :param bytes encrypted_data: encrypted data
+        :param output: a writable buffer with at least len(encrypted_data) bytes
+        :type output: bytearray or memoryview
+        :return: number of bytes written without the padding
+        :rtype: int
+        """
+        decryptor = self.get_decryptor()
+        written = decryptor.update_into(encrypted_data, output)
+        return written + decryptor.finalize_into(memoryview(output).cast('B')[written:])
+
     def decrypt_unpadded(self, encrypted_data):
         """
         Decrypts with AES in CBC mode without padding. The data has to fit into blocks of 16 bytes.
@@ -140,3 +273,269 @@ class Crypter(object):
         """
         aes_object = AES.new(self.key, AES.MODE_CBC, self.iv)
         return aes_object.decrypt(encrypted_data)
+
+
+class StreamEncryptor(object):
+    """
+    Encrypts chunks with AES in CBC mode. Incomplete blocks are kept until the next chunk arrives. finalize adds
+    the PKCS7 padding to the last block.
+
+    :param key: the key
+    :type key: bytes
+    :param iv: the iv
+    :type iv: bytes
+    """
+    def __init__(self, key, iv):
+        self.aes_object = AES.new(key, AES.MODE_CBC, iv)
+        self.pending = bytearray()
+        self.finalized = False
+
+    def get_update_size(self, length):
+        """
+        Returns the number of bytes update produces for a chunk of the given length.
+
+        :param length: length of the chunk
+        :type length: int
+        :return: number of bytes
+        :rtype: int
+        """
+        return (len(self.pending) + length) // BLOCK_SIZE * BLOCK_SIZE
+
+    def update_into(self, data, output):
+        """
+        Encrypts a chunk and writes the encrypted full blocks into output.
+
+        :param data: a chunk of plain data
+        :type data: bytes-like
+        :param output: a writable buffer with at least get_update_size(len(data)) bytes
+        :type output: bytearray or memoryview
+        :return: number of bytes written
+        :rtype: int
+        """
+        if self.finalized:
+            raise ValueError("The encryptor was already finalized.")
+        data = memoryview(data).cast('B')
+        output = memoryview(output).cast('B')
+        size = self.get_update_size(len(data))
+        if len(output) < size:
+            raise ValueError("The output buffer is too small.")
+        written = 0
+        if len(self.pending) > 0:
+            missing = BLOCK_SIZE - len(self.pending)
+            if len(data) < missing:
+                self.pending += data
+                return 0
+            self.pending += data[:missing]
+            data = data[missing:]
+            self.aes_object.encrypt(self.pending, output=output[:BLOCK_SIZE])
+            self.pending = bytearray()
+            written = BLOCK_SIZE
+        full_length = len(data) // BLOCK_SIZE * BLOCK_SIZE
+        if full_length > 0:
+            self.aes_object.encrypt(data[:full_length], output=output[written:written + full_length])
+            written += full_length
+        self.pending += data[full_length:]
+        return written
+
+    def update(self, data):
+        """
+        Encrypts a chunk and returns the encrypted full blocks.
+
+        :param data: a chunk of plain data
+        :type data: bytes-like
+        :return: encrypted data
+        :rtype: bytes
+        """
+        output = bytearray(self.get_update_size(len(memoryview(data).cast('B'))))
+        self.update_into(data, output)
+        return bytes(output)
+
+    def finalize_into(self, output):
+        """
+        Pads and encrypts the last block and writes it into output.
+
+        :param output: a writable buffer with at least 16 bytes
+        :type output: bytearray or memoryview
+        :return: number of bytes written
+        :rtype: int
+        """
+        if self.finalized:
+            raise ValueError("The encryptor was already finalized.")
+        output = memoryview(output).cast('B')
+        if len(output) < BLOCK_SIZE:
+            raise ValueError("The output buffer is too small.")
+        length = BLOCK_SIZE - len(self.pending)
+        self.pending += bytes([length])*length
+        self.aes_object.encrypt(self.pending, output=output[:BLOCK_SIZE])
+        self.pending = bytearray()
+        self.finalized = True
+        return BLOCK_SIZE
+
+    def finalize(self):
+        """
+        Pads and encrypts the last block.
+
+        :return: the last encrypted block
+        :rtype: bytes
+        """
+        output = bytearray(BLOCK_SIZE)
+        self.finalize_into(output)
+        return bytes(output)
+
+
+class StreamDecryptor(object):
+    """
+    Decrypts chunks with AES in CBC mode. The last block is held back until finalize because it contains the
+    PKCS7 padding.
+
+    :param key: the key
+    :type key: bytes
+    :param iv: the iv
+    :type iv: bytes
+    """
+    def __init__(self, key, iv):
+        self.aes_object = AES.new(key, AES.MODE_CBC, iv)
+        self.pending = bytearray()
+        self.finalized = False
+
+    def get_update_size(self, length):
+        """
+        Returns the number of bytes update produces for a chunk of the given length.
+
+        :param length: length of the chunk
+        :type length: int
+        :return: number of bytes
+        :rtype: int
+        """
+        available = len(self.pending) + length
+        if available <= 0:
+            return 0
+        return (available - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+    def update_into(self, data, output):
+        """
+        Decrypts a chunk and writes the decrypted blocks into output. The last block is kept back.
+
+        :param data: a chunk of encrypted data
+        :type data: bytes-like
+        :param output: a writable buffer with at least get_update_size(len(data)) bytes
+        :type output: bytearray or memoryview
+        :return: number of bytes written
+        :rtype: int
+        """
+        if self.finalized:
+            raise ValueError("The decryptor was already finalized.")
+        data = memoryview(data).cast('B')
+        output = memoryview(output).cast('B')
+        size = self.get_update_size(len(data))
+        if len(output) < size:
+            raise ValueError("The output buffer is too small.")
+        if size <= 0:
+            self.pending += data
+            return 0
+        written = 0
+        if len(self.pending) > 0:
+            missing = BLOCK_SIZE - len(self.pending)
+            self.pending += data[:missing]
+            data = data[missing:]
+            self.aes_object.decrypt(self.pending, output=output[:BLOCK_SIZE])
+            self.pending = bytearray()
+            written = BLOCK_SIZE
+        direct_length = size - written
+        if direct_length > 0:
+            self.aes_object.decrypt(data[:direct_length], output=output[written:size])
+        self.pending += data[direct_length:]
+        return size
+
+    def update(self, data):
+        """
+        Decrypts a chunk and returns the decrypted blocks. The last block is kept back.
+
+        :param data: a chunk of encrypted data
+        :type data: bytes-like
+        :return: decrypted data
+        :rtype: bytes
+        """
+        output = bytearray(self.get_update_size(len(memoryview(data).cast('B'))))
+        self.update_into(data, output)
+        return bytes(output)
+
+    def finalize_into(self, output):
+        """
+        Decrypts the last block, removes the padding and writes the rest into output.
+
+        :param output: a writable buffer with at least 16 bytes
+        :type output: bytearray or memoryview
+        :return: number of bytes written
+        :rtype: int
+        """
+        if self.finalized:
+            raise ValueError("The decryptor was already finalized.")
+        if len(self.pending) != BLOCK_SIZE:
+            raise ValueError("The encrypted data does not fit into blocks of 16 bytes.")
+        output = memoryview(output).cast('B')
+        block = bytearray(BLOCK_SIZE)
+        self.aes_object.decrypt(self.pending, output=block)
+        self.pending = bytearray()
+        self.finalized = True
+        length = block[-1]
+        if not 1 <= length <= BLOCK_SIZE or block[-length:] != bytes([length])*length:
+            raise ValueError("The padding is wrong.")
+        if len(output) < BLOCK_SIZE - length:
+            raise ValueError("The output buffer is too small.")
+        output[:BLOCK_SIZE - length] = block[:BLOCK_SIZE - length]
+        return BLOCK_SIZE - length
+
+    def finalize(self):
+        """
+        Decrypts the last block and removes the padding.
+
+        :return: the rest of the decrypted data
+        :rtype: bytes
+        """
+        output = bytearray(BLOCK_SIZE)
+        return bytes(output[:self.finalize_into(output)])
+
+
+class KeyDerivationCache(object):
+    """
+    Remembers the keys derived during one unlock session so identical derivations (same password, salt, iteration
+    count and hash function) run only once. Call clear at the end of the session.
+    """
+    def __init__(self):
+        self.keys = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def derive(self, hash_name, password, salt, iterations):
+        """
+        Returns the key derived with PBKDF2. The key is calculated only if it is not in the cache.
+
+        :param hash_name: name of the hash function
+        :type hash_name: str
+        :param password: the password
+        :type password: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :param iterations: an iteration count
+        :type iterations: int
+        :return: a key
+        :rtype: bytes
+        """
+        cache_key = (hash_name, bytes(password), bytes(salt), iterations)
+        with self.lock:
+            if cache_key in self.keys:
+                return self.keys[cache_key]
+        key = pbkdf2_hmac(hash_name, password, salt, iterations)
+        with self.lock:
+            self.keys[cache_key] = key
+        return key
+
+    def clear(self):
+        """
+        Forgets all derived keys.
+        """
+        with self.lock:
+            self.keys.clear()
@@ -7,7 +7,11 @@ Main file for c't SESAM.
 from password_generator import CtSesam
 from preference_manager import PreferenceManager
 from kgk_manager import KgkManager
+from crypter import KeyDerivationCache
 from password_settings_manager import PasswordSettingsManager
+from sqlite_store import SqliteSettingsStore, SQLITE_SETTINGS_FILE
+from generator_daemon import GeneratorDaemon, DaemonClient
+from calibration import IterationCalibrator, HASH_FUNCTIONS
 from base64 import b64decode
 import argparse
 import getpass
@@ -23,8 +27,20 @@ def create_settings_manager(kgk_mng):
     return PasswordSettingsManager(preference_mng), preference_mng
 
 
+def create_settings_store(kgk_mng, database_file):
+    settings_store = SqliteSettingsStore(database_file)
+    kgk_mng.set_preference_manager(settings_store)
+    kgk_mng.decrypt_kgk(settings_store.get_kgk_block(),
+                        password=master_password.encode('utf-8'),
+                        salt=settings_store.get_salt())
+    if len(settings_store.get_kgk_block()) != 112:
+        kgk_mng.store_local_kgk_block()
+    settings_store.unlock(kgk_mng)
+    return settings_store
+
+
 def decrypt_remote_settings(kgk_mng, settings_mng):
-    remote_kgk_manager = KgkManager()
+    remote_kgk_manager = KgkManager(kgk_mng.key_cache)
     remote_kgk_manager.update_from_blob(master_password.encode('utf-8'), b64decode(data))
     kgk_exists = len(settings_manager.preference_manager.get_kgk_block()) == 112
     if kgk_exists and remote_kgk_manager.has_kgk() and kgk_mng.has_kgk() and \
@@ -35,7 +51,7 @@ def decrypt_remote_settings(kgk_mng, settings_mng):
             kgk_mng = remote_kgk_manager
             kgk_mng.set_preference_manager(preference_manager)
             kgk_mng.store_local_kgk_block()
-        settings_mng.update_from_export_data(remote_kgk_manager, b64decode(data))
+        settings_mng.update_from_export_data(remote_kgk_manager, b64decode(data), kgk_mng)
         print("Verbindung erfolgreich getestet.")
     return kgk_mng, settings_mng
 
@@ -49,19 +65,18 @@ def get_domain(cmd_opt_domain):
         print('Bitte gib eine Domain an, für die das Passwort generiert werden soll.')
         domain = input('Domain: ')
     password_setting_found = False
-    if domain in [dom[:len(domain)] for dom in settings_manager.get_domain_list()]:
-        if domain in settings_manager.get_domain_list():
-            password_setting_found = True
-            if not args.quiet:
-                print("Die Einstellungen für " + domain + " wurden geladen.")
-        else:
-            for dom in settings_manager.get_domain_list():
-                if dom[:len(domain)] == domain:
-                    print("Für die Domain '" + dom + "' wurden Einstellungen gefunden.")
-                    answer = input("Sollen sie geladen werden [J/n]? ")
-                    if answer not in ["n", "N", "Nein", "nein", "NEIN", "NO", "No", "no", "nay", "not", "Not", "NOT"]:
-                        domain = dom
-                        password_setting_found = True
+    if settings_manager.has_setting(domain):
+        password_setting_found = True
+        if not args.quiet:
+            print("Die Einstellungen für " + domain + " wurden geladen.")
+    else:
+        for dom in settings_manager.complete(domain):
+            print("Für die Domain '" + dom + "' wurden Einstellungen gefunden.")
+            answer = input("Sollen sie geladen werden [J/n]? ")
+            if answer not in ["n", "N", "Nein", "nein", "NEIN", "NO", "No", "no", "nay", "not", "Not", "NOT"]:
+                domain = dom
+                password_setting_found = True
+                break
     return settings_manager.get_setting(domain), password_setting_found
 
 
@@ -72,12 +87,44 @@ def print_legacy_password(password_setting, quiet):
         print("klassisches Passwort: " + password_setting.get_legacy_password())
 
 
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("'" + value + "' ist keine ganze Zahl.")
+    if number <= 0:
+        raise argparse.ArgumentTypeError("Die Zahl muss größer als 0 sein.")
+    return number
+
+
+def print_calibration(target_latency):
+    calibrator = IterationCalibrator()
+    calibrator.calibrate()
+    print("Empfohlene Iterationszahlen für " + str(int(target_latency*1000)) + " ms:")
+    for hash_name in HASH_FUNCTIONS:
+        print("  " + hash_name + ": " + str(calibrator.recommend_iterations(target_latency, hash_name)))
+
+
+def print_daemon_password(response, quiet):
+    if response['legacy']:
+        prefix = "klassisches Passwort: "
+    else:
+        prefix = "Passwort: "
+    if quiet:
+        print(response['password'])
+    else:
+        if len(response['username']) > 0:
+            print("Benutzername: " + response['username'])
+        print(prefix + response['password'])
+
+
 def print_generated_password(password_setting, kgk, quiet):
     sesam = CtSesam(password_setting.get_domain(),
                     password_setting.get_username(),
                     kgk,
                     password_setting.get_salt(),
-                    password_setting.get_iterations())
+                    password_setting.get_iterations(),
+                    settings_manager.hash_cache)
     password = sesam.generate(password_setting)
     if quiet:
         print(password)
@@ -98,33 +145,77 @@ if __name__ == "__main__":
     parser.add_argument('-q', '--quiet',
                         action='store_const', const=True,
                         help="Display only prompts (if necessary) and the plain password")
+    parser.add_argument('--daemon',
+                        action='store_const', const=True,
+                        help="Unlock once and serve passwords over a local socket until interrupted.")
+    parser.add_argument('--sqlite', nargs='?', const=SQLITE_SETTINGS_FILE, metavar='DATABASE',
+                        help="Use the settings in a SQLite database (default: " + SQLITE_SETTINGS_FILE + ") " +
+                             "instead of the settings file. There is no synchronization with this option.")
+    parser.add_argument('--target-latency', type=positive_int, metavar='MILLISECONDS',
+                        help="Suggest iteration counts for new settings which take this long on this machine.")
+    parser.add_argument('--calibrate',
+                        action='store_const', const=True,
+                        help="Measure the speed of this machine and print recommended iteration counts.")
     args = parser.parse_args()
+    if args.calibrate:
+        print_calibration((args.target_latency or 100) / 1000)
+        sys.exit(0)
+    if args.domain and not args.daemon and not args.update_sync_settings:
+        daemon_client = DaemonClient()
+        if daemon_client.is_running():
+            daemon_response = daemon_client.generate(args.domain)
+            if daemon_response:
+                print_daemon_password(daemon_response, args.quiet)
+                sys.exit(0)
     if args.master_password:
         master_password = args.master_password
     else:
         master_password = getpass.getpass(prompt='Masterpasswort: ')
-    kgk_manager = KgkManager()
-    settings_manager, preference_manager = create_settings_manager(kgk_manager)
-    try:
-        settings_manager.load_settings(kgk_manager, master_password, args.no_sync)
-        if not args.no_sync and (args.update_sync_settings or not settings_manager.sync_manager.has_settings()):
-            settings_manager.sync_manager.ask_for_sync_settings()
-            print("Teste die Verbindung...")
-            pull_successful, data = settings_manager.sync_manager.pull()
-            if pull_successful and len(data) > 0:
-                kgk_manager, settings_manager = decrypt_remote_settings(kgk_manager, settings_manager)
-            else:
-                print("Es konnte keine Verbindung aufgebaut werden.")
-    except ValueError:
-        print("Falsches Masterpasswort. Es wurden keine Einstellungen geladen.")
-        sys.exit(1)
+    kgk_manager = KgkManager(KeyDerivationCache())
+    if args.sqlite:
+        try:
+            settings_manager = create_settings_store(kgk_manager, args.sqlite)
+        except (ValueError, PermissionError):
+            print("Falsches Masterpasswort. Es wurden keine Einstellungen geladen.")
+            sys.exit(1)
+        finally:
+            kgk_manager.key_cache.clear()
+    else:
+        settings_manager, preference_manager = create_settings_manager(kgk_manager)
+        try:
+            settings_manager.load_settings(kgk_manager, master_password, args.no_sync)
+            if not args.no_sync and (args.update_sync_settings or not settings_manager.sync_manager.has_settings()):
+                settings_manager.sync_manager.ask_for_sync_settings()
+                print("Teste die Verbindung...")
+                pull_successful, data = settings_manager.sync_manager.pull()
+                if pull_successful and len(data) > 0:
+                    kgk_manager, settings_manager = decrypt_remote_settings(kgk_manager, settings_manager)
+                else:
+                    print("Es konnte keine Verbindung aufgebaut werden.")
+        except ValueError:
+            print("Falsches Masterpasswort. Es wurden keine Einstellungen geladen.")
+            sys.exit(1)
+        finally:
+            kgk_manager.key_cache.clear()
+    if args.daemon:
+        if not args.quiet:
+            print("Der Daemon läuft. Beenden mit Strg+C.")
+        try:
+            GeneratorDaemon(kgk_manager, settings_manager).serve_forever()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
     setting, setting_found = get_domain(args.domain)
     if not setting_found:
-        setting.ask_for_input()
+        if args.target_latency:
+            setting.ask_for_input(IterationCalibrator(), args.target_latency / 1000)
+        else:
+            setting.ask_for_input()
     if setting_found and setting.has_username() and not args.quiet:
         print("Benutzername: " + setting.get_username())
     settings_manager.set_setting(setting)
-    settings_manager.store_settings(kgk_manager)
+    if not args.sqlite:
+        settings_manager.store_settings(kgk_manager)
     if setting_found and setting.has_legacy_password():
         print_legacy_password(setting, args.quiet)
     else:
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+A sorted index of domains for completion.
+"""
+
+from bisect import bisect_left
+
+
+class DomainIndex(object):
+    """
+    Keeps the domains in a sorted list. All domains with a prefix are next to each other in the list so a
+    completion is a binary search followed by reading the matches. Domains which are added out of order are
+    appended and the list is sorted before the next search. Loading many settings therefore costs a single sort.
+
+    :param domains: initial domains
+    :type domains: [str]
+    """
+    def __init__(self, domains=()):
+        self.domains = sorted(domains)
+        self.sorted = True
+
+    def __len__(self):
+        return len(self.domains)
+
+    def sort(self):
+        """
+        Sorts the domains which were added out of order.
+        """
+        if not self.sorted:
+            self.domains.sort()
+            self.sorted = True
+
+    def add(self, domain):
+        """
+        Adds a domain. The domain must not be in the index.
+
+        :param domain: the domain
+        :type domain: str
+        """
+        if self.sorted and len(self.domains) > 0 and domain < self.domains[-1]:
+            self.sorted = False
+        self.domains.append(domain)
+
+    def remove(self, domain):
+        """
+        Removes a domain if it is in the index.
+
+        :param domain: the domain
+        :type domain: str
+        """
+        self.sort()
+        i = bisect_left(self.domains, domain)
+        if i < len(self.domains) and self.domains[i] == domain:
+            del self.domains[i]
+
+    def clear(self):
+        """
+        Removes all domains.
+        """
+        self.domains = []
+        self.sorted = True
+
+    def complete(self, prefix, limit=None):
+        """
+        Returns the domains which start with the prefix in alphabetical order.
+
+        :param prefix: the beginning of the domains
+        :type prefix: str
+        :param limit: maximum number of domains (None for all)
+        :type limit: int
+        :return: domains
+        :rtype: [str]
+        """
+        self.sort()
+        completions = []
+        i = bisect_left(self.domains, prefix)
+        while i < len(self.domains) and self.domains[i].startswith(prefix) and \
+                (limit is None or len(completions) < limit):
+            completions.append(self.domains[i])
+            i += 1
+        return completions
@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+A daemon which keeps the decrypted kgk and settings in memory and answers requests over a local unix socket.
+"""
+
+from password_generator import CtSesam
+import socketserver
+import threading
+import socket
+import json
+import os
+
+DAEMON_SOCKET = os.path.expanduser('~/.config/ct/ctSESAM.sock')
+REQUEST_TIMEOUT = 10.0
+
+
+class GeneratorDaemon(object):
+    """
+    Serves password requests over an AF_UNIX socket. The daemon is started after the kgk was unlocked and the
+    settings were loaded so every request is answered without key derivation for the kgk.
+
+    Requests and responses are JSON objects, one per line. Supported commands are ``ping``, ``domains``,
+    ``lookup`` and ``generate``. Every connection is served in its own thread and closed if the client sends
+    nothing for timeout seconds. The requests themselves are answered one after the other. Settings which another
+    process saved to the settings file are merged before each request.
+
+    :param kgk_manager: an unlocked kgk manager
+    :type kgk_manager: KgkManager
+    :param settings_manager: a settings manager with loaded settings or an unlocked settings store
+    :type settings_manager: PasswordSettingsManager or SqliteSettingsStore
+    :param socket_path: path of the unix socket
+    :type socket_path: str
+    :param timeout: seconds a connection may stay idle
+    :type timeout: float
+    """
+    def __init__(self, kgk_manager, settings_manager, socket_path=DAEMON_SOCKET, timeout=REQUEST_TIMEOUT):
+        self.kgk_manager = kgk_manager
+        self.settings_manager = settings_manager
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.server = None
+
+    def find_setting(self, domain):
+        """
+        Returns the setting for the domain or None if there is none. Unlike PasswordSettingsManager.get_setting
+        this does not create new settings.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the setting or None
+        :rtype: PasswordSetting
+        """
+        return self.settings_manager.find_setting(domain)
+
+    def refresh_settings(self):
+        """
+        Merges the settings file if another process saved it since it was read. A SqliteSettingsStore reads every
+        setting from the database so there is nothing to refresh.
+        """
+        preference_manager = getattr(self.settings_manager, 'preference_manager', None)
+        if preference_manager is None:
+            return
+        with preference_manager.lock():
+            if preference_manager.reload_if_changed():
+                self.settings_manager.merge_changed_file(self.kgk_manager)
+
+    def handle_request(self, request):
+        """
+        Answers a single request.
+
+        :param request: the request
+        :type request: dict
+        :return: the response
+        :rtype: dict
+        """
+        if type(request) != dict or 'command' not in request:
+            return {'status': 'error', 'message': "Malformed request."}
+        with self.lock:
+            try:
+                self.refresh_settings()
+            except (ValueError, PermissionError) as e:
+                return {'status': 'error', 'message': "The settings file could not be read: " + str(e)}
+            return self.answer_request(request)
+
+    def answer_request(self, request):
+        """
+        Answers a well-formed request with the settings in memory.
+
+        :param request: the request
+        :type request: dict
+        :return: the response
+        :rtype: dict
+        """
+        command = request['command']
+        if command == 'ping':
+            return {'status': 'ok'}
+        if command == 'domains':
+            return {'status': 'ok', 'domains': self.settings_manager.get_domain_list()}
+        if command in ['lookup', 'generate']:
+            if 'domain' not in request:
+                return {'status': 'error', 'message': "No domain given."}
+            setting = self.find_setting(request['domain'])
+            if setting is None:
+                return {'status': 'not found'}
+            if command == 'lookup':
+                return {'status': 'ok', 'setting': setting.to_dict()}
+            if setting.has_legacy_password():
+                return {'status': 'ok', 'password': setting.get_legacy_password(), 'legacy': True,
+                        'username': setting.get_username()}
+            sesam = CtSesam(setting.get_domain(),
+                            setting.get_username(),
+                            self.kgk_manager.get_kgk(),
+                            setting.get_salt(),
+                            setting.get_iterations(),
+                            self.settings_manager.hash_cache)
+            return {'status': 'ok', 'password': sesam.generate(setting), 'legacy': False,
+                    'username': setting.get_username()}
+        return {'status': 'error', 'message': "Unknown command: " + str(command)}
+
+    def create_server(self):
+        """
+        Binds the socket. A stale socket file of a daemon which is not running anymore is removed. The socket is only
+        accessible by the current user.
+
+        :return: the server
+        :rtype: socketserver.ThreadingUnixStreamServer
+        """
+        socket_dir = os.path.dirname(self.socket_path)
+        if socket_dir and not os.path.exists(socket_dir):
+            os.makedirs(socket_dir, mode=0o700)
+        if os.path.exists(self.socket_path):
+            if DaemonClient(self.socket_path).is_running():
+                raise RuntimeError("A daemon is already running on " + self.socket_path)
+            os.remove(self.socket_path)
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            timeout = self.timeout
+
+            def handle(self):
+                try:
+                    for line in self.rfile:
+                        try:
+                            response = daemon.handle_request(json.loads(str(line, encoding='utf-8')))
+                        except ValueError:
+                            response = {'status': 'error', 'message': "Malformed request."}
+                        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                except socket.timeout:
+                    pass
+
+        old_umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+            self.server.daemon_threads = True
+        finally:
+            os.umask(old_umask)
+        return self.server
+
+    def serve_forever(self):
+        """
+        Serves requests until shutdown is called or the process is interrupted.
+        """
+        if self.server is None:
+            self.create_server()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def shutdown(self):
+        """
+        Stops serve_forever. Call this from another thread.
+        """
+        if self.server:
+            self.server.shutdown()
+
+
+class DaemonClient(object):
+    """
+    Talks to a running GeneratorDaemon.
+
+    :param socket_path: path of the unix socket
+    :type socket_path: str
+    :param timeout: socket timeout in seconds
+    :type timeout: float
+    """
+    def __init__(self, socket_path=DAEMON_SOCKET, timeout=5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, request):
+        """
+        Sends a request to the daemon and returns the response.
+
+        :param request: the request
+        :type request: dict
+        :return: the response
+        :rtype: dict
+        """
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(self.socket_path)
+            connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            with connection.makefile('rb') as f:
+                return json.loads(str(f.readline(), encoding='utf-8'))
+        finally:
+            connection.close()
+
+    def is_running(self):
+        """
+        Returns True if a daemon answers on the socket.
+
+        :return: is a daemon running?
+        :rtype: bool
+        """
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(self.socket_path):
+            return False
+        try:
+            return self.request({'command': 'ping'}).get('status') == 'ok'
+        except (OSError, ValueError):
+            return False
+
+    def lookup(self, domain):
+        """
+        Returns the settings for a domain as a dict or None if the daemon does not know the domain.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the setting as dict
+        :rtype: dict
+        """
+        response = self.request({'command': 'lookup', 'domain': domain})
+        if response.get('status') == 'ok':
+            return response['setting']
+        return None
+
+    def generate(self, domain):
+        """
+        Asks the daemon for the password of a domain. Returns None if the daemon does not know the domain.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the response with password, username and legacy flag
+        :rtype: dict
+        """
+        response = self.request({'command': 'generate', 'domain': domain})
+        if response.get('status') == 'ok':
+            return response
+        return None
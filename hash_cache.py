@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+In-memory cache for the hashes which are derived from the kgk for each domain.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class HashCache(object):
+    """
+    Bounded LRU cache of derived domain hashes. Entries expire after ``ttl`` seconds. The cache remembers the kgk
+    it was filled with and wipes itself if a different kgk is used.
+
+    :param max_size: maximum number of cached hashes
+    :type max_size: int
+    :param ttl: time to live of an entry in seconds (None means entries do not expire)
+    :type ttl: float
+    """
+    def __init__(self, max_size=128, ttl=300):
+        if max_size <= 0:
+            raise ValueError("The cache size has to be at least 1.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.kgk = None
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def create_key(domain, username, salt, iterations):
+        """
+        Creates the cache key for the inputs of a hash calculation.
+
+        :param domain: the domain
+        :type domain: str
+        :param username: the username
+        :type username: str
+        :param salt: the salt
+        :type salt: bytes
+        :param iterations: iteration count
+        :type iterations: int
+        :return: a cache key
+        :rtype: tuple
+        """
+        return domain, username, salt, iterations
+
+    def check_kgk(self, kgk):
+        """
+        Wipes the cache if it was filled with a different kgk.
+
+        :param kgk: the kgk
+        :type kgk: bytes
+        """
+        if self.kgk != kgk:
+            self.entries.clear()
+            self.kgk = kgk
+
+    def get(self, key, kgk):
+        """
+        Returns the cached hash or None if there is no valid entry.
+
+        :param key: a key created by create_key
+        :type key: tuple
+        :param kgk: the kgk
+        :type kgk: bytes
+        :return: the hash value or None
+        :rtype: bytes
+        """
+        with self.lock:
+            self.check_kgk(kgk)
+            if key not in self.entries:
+                return None
+            hash_value, expires = self.entries[key]
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return hash_value
+
+    def put(self, key, kgk, hash_value):
+        """
+        Stores a hash. The least recently used entry is evicted if the cache is full.
+
+        :param key: a key created by create_key
+        :type key: tuple
+        :param kgk: the kgk
+        :type kgk: bytes
+        :param hash_value: the derived hash
+        :type hash_value: bytes
+        """
+        with self.lock:
+            self.check_kgk(kgk)
+            expires = time.monotonic() + self.ttl if self.ttl is not None else None
+            self.entries[key] = (hash_value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def wipe(self):
+        """
+        Removes all entries and forgets the kgk. Call this if the kgk changes.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.kgk = None
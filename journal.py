@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Append-only journal of encrypted setting changes which belongs to a snapshot in the settings file.
+"""
+
+from crypter import Crypter
+from hashlib import sha256
+import struct
+import json
+import os
+
+JOURNAL_MAGIC = b'ctSESAMJ\x01'
+JOURNAL_HEADER_LENGTH = len(JOURNAL_MAGIC) + 32 + 32
+JOURNAL_COMPACTION_THRESHOLD = 64 * 1024
+
+
+class Journal(object):
+    """
+    Stores small records of setting changes next to the settings file so a change does not need to re-encrypt
+    the whole vault.
+
+    The file starts with a magic, a salt for the journal key and the id of the snapshot the records apply to. The
+    snapshot id is the SHA256 of the kgk block which changes with every full save. So a journal which was not
+    cleared after a full save is ignored. Every record is a four byte length followed by a fresh iv and the record
+    encrypted with AES-GCM. The header and the number of the record are authenticated so records can not be
+    reordered. A torn record at the end of the file is ignored and overwritten by the next append.
+
+    :param journal_file: path of the journal
+    :type journal_file: str
+    """
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.key = None
+        self.header = None
+        self.end = None
+        self.record_count = 0
+
+    @staticmethod
+    def get_snapshot_id(kgk_block):
+        """
+        Returns the id of the snapshot which was stored with the given kgk block.
+
+        :param kgk_block: the kgk block of the settings file
+        :type kgk_block: bytes-like
+        :return: snapshot id
+        :rtype: bytes
+        """
+        return sha256(kgk_block).digest()
+
+    def get_key(self, kgk, salt):
+        """
+        Derives the journal key. The last key is remembered.
+
+        :param kgk: the kgk
+        :type kgk: bytes
+        :param salt: the salt of the journal
+        :type salt: bytes
+        :return: the key
+        :rtype: bytes
+        """
+        if self.key is None or self.key[0] != kgk or self.key[1] != salt:
+            self.key = (kgk, salt, Crypter.create_key(kgk, salt))
+        return self.key[2]
+
+    def get_size(self):
+        """
+        Returns the size of the journal file in bytes.
+
+        :return: size
+        :rtype: int
+        """
+        if not os.path.isfile(self.journal_file):
+            return 0
+        return os.path.getsize(self.journal_file)
+
+    def read(self, kgk, snapshot_id):
+        """
+        Returns the records which belong to the snapshot.
+
+        :param kgk: the kgk
+        :type kgk: bytes
+        :param snapshot_id: id of the snapshot
+        :type snapshot_id: bytes
+        :return: the records
+        :rtype: [dict]
+        """
+        self.header = None
+        self.end = None
+        self.record_count = 0
+        if not os.path.isfile(self.journal_file):
+            return []
+        with open(self.journal_file, 'rb') as f:
+            data = memoryview(f.read())
+        header = bytes(data[:JOURNAL_HEADER_LENGTH])
+        if len(header) < JOURNAL_HEADER_LENGTH or not header.startswith(JOURNAL_MAGIC) or \
+                header[-32:] != snapshot_id:
+            return []
+        key = self.get_key(kgk, header[len(JOURNAL_MAGIC):len(JOURNAL_MAGIC) + 32])
+        records = []
+        position = JOURNAL_HEADER_LENGTH
+        while position + 4 <= len(data):
+            length = struct.unpack_from('!I', data, position)[0]
+            if position + 4 + length > len(data) or length < 16:
+                break
+            iv = bytes(data[position + 4:position + 20])
+            try:
+                record = Crypter(key + iv).decrypt_authenticated(
+                    data[position + 20:position + 4 + length], header + struct.pack('!Q', len(records)))
+                records.append(json.loads(str(record, encoding='utf-8')))
+            except ValueError:
+                break
+            position += 4 + length
+        self.header = header
+        self.end = position
+        self.record_count = len(records)
+        return records
+
+    def append(self, kgk, snapshot_id, record):
+        """
+        Appends a record and syncs it to the disk. A new journal is started if the journal belongs to another
+        snapshot.
+
+        :param kgk: the kgk
+        :type kgk: bytes
+        :param snapshot_id: id of the current snapshot
+        :type snapshot_id: bytes
+        :param record: the record
+        :type record: dict
+        """
+        if self.header is None or self.header[-32:] != snapshot_id or self.get_size() != self.end:
+            self.read(kgk, snapshot_id)
+        if self.header is None:
+            self.start(snapshot_id)
+        key = self.get_key(kgk, self.header[len(JOURNAL_MAGIC):len(JOURNAL_MAGIC) + 32])
+        iv = Crypter.createIv()
+        encrypted_record = iv + Crypter(key + iv).encrypt_authenticated(
+            json.dumps(record).encode('utf-8'), self.header + struct.pack('!Q', self.record_count))
+        with open(self.journal_file, 'rb+') as f:
+            f.truncate(self.end)
+            f.seek(self.end)
+            f.write(struct.pack('!I', len(encrypted_record)) + encrypted_record)
+            f.flush()
+            os.fsync(f.fileno())
+        self.end += 4 + len(encrypted_record)
+        self.record_count += 1
+
+    def start(self, snapshot_id):
+        """
+        Replaces the journal with an empty journal for the snapshot.
+
+        :param snapshot_id: id of the snapshot
+        :type snapshot_id: bytes
+        """
+        header = JOURNAL_MAGIC + Crypter.createSalt() + snapshot_id
+        temporary_file = self.journal_file + '.tmp'
+        with open(temporary_file, 'wb') as f:
+            f.write(header)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_file, self.journal_file)
+        self.header = header
+        self.end = len(header)
+        self.record_count = 0
+
+    def clear(self):
+        """
+        Removes the journal. Call this after the records were written to a new snapshot.
+        """
+        if os.path.isfile(self.journal_file):
+            os.remove(self.journal_file)
+        self.header = None
+        self.end = None
+        self.record_count = 0
@@ -4,7 +4,6 @@
 The KGK manager stores the kgk and manages storage and encryption of kgk blocks.
 """
 
-from preference_manager import PreferenceManager
 from crypter import Crypter
 from binascii import hexlify
 import os
@@ -13,8 +12,12 @@ import os
 class KgkManager(object):
     """
     New KgkManagers are uninitialized and need either a new kgk or get one by decrypting an existing one.
+
+    :param key_cache: an optional cache for the expensive key derivation which may be shared by several kgk managers
+    :type key_cache: KeyDerivationCache
     """
-    def __init__(self):
+    def __init__(self, key_cache=None):
+        self.key_cache = key_cache
         self.preference_manager = None
         self.kgk = b''
         self.iv2 = None
@@ -33,13 +36,15 @@ class KgkManager(object):
 
     def set_preference_manager(self, preference_manager):
         """
-        Pass a preference manager to load and store settings locally
+        Pass a preference manager to load and store settings locally. Any object with the salt and kgk block
+        methods of the PreferenceManager and a transaction context manager is accepted.
 
         :param preference_manager:
-        :type preference_manager: PreferenceManager
+        :type preference_manager: PreferenceManager or SqliteSettingsStore
         """
-        if type(preference_manager) != PreferenceManager:
-            raise TypeError
+        for method in ['get_salt', 'store_salt', 'get_kgk_block', 'store_kgk_block', 'transaction']:
+            if not callable(getattr(preference_manager, method, None)):
+                raise TypeError
         self.preference_manager = preference_manager
 
     def get_kgk_crypter_salt(self):
@@ -79,7 +84,7 @@ class KgkManager(object):
         :return: a kgk crypter
         :rtype: Crypter
         """
-        self.kgk_crypter = Crypter(Crypter.createIvKey(password=password, salt=salt))
+        self.kgk_crypter = Crypter(Crypter.createIvKey(password=password, salt=salt, cache=self.key_cache))
         self.store_salt(salt=salt)
         return self.kgk_crypter
 
@@ -201,24 +206,25 @@ class KgkManager(object):
         :return: kgk block
         :rtype: bytes
         """
-        self.salt = Crypter.createSalt()
-        self.store_salt(self.salt)
-        if kgk_crypter:
-            self.kgk_crypter = kgk_crypter
-        kgk_block = self.get_fresh_encrypted_kgk()
-        self.preference_manager.store_kgk_block(kgk_block)
+        with self.preference_manager.transaction():
+            self.salt = Crypter.createSalt()
+            self.store_salt(self.salt)
+            if kgk_crypter:
+                self.kgk_crypter = kgk_crypter
+            kgk_block = self.get_fresh_encrypted_kgk()
+            self.preference_manager.store_kgk_block(kgk_block)
         return kgk_block
 
     def update_from_blob(self, password, blob):
         """
-        Updates the kgk from a remote data blob.
+        Updates the kgk from a remote data blob. Blobs of version 1 and 2 share the layout of salt and kgk block.
 
         :param password: the masterpassword
         :type password: bytes
         :param blob: the encrypted data
         :type blob: bytes
         """
-        if blob[0] != 1 or len(blob) < 145:
+        if blob[0] not in [1, 2] or len(blob) < 145:
             raise ValueError("Version error: Wrong data format. Could not import anything.")
         salt = blob[1:33]
         kgk_block = blob[33:145]
@@ -226,14 +232,30 @@ class KgkManager(object):
 
     def store_local_kgk_block(self):
         """
-        Stores the local kgk block.
+        Stores the local kgk block. kgk block and salt are written to the file at once.
         """
-        if self.preference_manager:
-            self.preference_manager.store_kgk_block(self.get_encrypted_kgk())
-        if len(self.salt) == 32:
-            self.store_salt(self.salt)
-        else:
+        if len(self.salt) != 32:
             raise ValueError("The salt has to be 32 bytes.")
+        if self.preference_manager:
+            with self.preference_manager.transaction():
+                self.preference_manager.store_kgk_block(self.get_encrypted_kgk())
+                self.store_salt(self.salt)
+
+    def reload_kgk_block(self):
+        """
+        Decrypts the kgk block from the preference manager again with the known kgk crypter. Call this after another
+        process saved the settings file to get its salt2 and iv2. Without a preference manager there is nothing to
+        reload.
+        """
+        if not self.preference_manager:
+            return
+        if self.preference_manager.get_salt() != self.salt:
+            raise PermissionError("The settings file was saved with a different masterpassword.")
+        kgk = self.kgk
+        self.decrypt_kgk(self.preference_manager.get_kgk_block(), self.kgk_crypter)
+        if self.kgk != kgk:
+            self.kgk = kgk
+            raise PermissionError("The settings file was saved with a different kgk.")
 
     def reset(self):
         """
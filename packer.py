@@ -1,61 +1,554 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 """
-Compression with DEFLATE.
+Compression with DEFLATE or other codecs.
 """
 
 import zlib
 import struct
+from abc import ABC, abstractmethod
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+TAGGED_FORMAT_MARKER = 0xFF
+TAGGED_HEADER_LENGTH = 6
+HEADER_PEEK_LENGTH = TAGGED_HEADER_LENGTH + 6
+MAX_UNCOMPRESSED_LENGTH = 64 * 1024 * 1024
+DECOMPRESSION_CHUNK_SIZE = 64 * 1024
+
+SETTINGS_DICTIONARY = (
+    b'"usedCharacters": "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", "length": '
+    b'"deleted": true, "legacyPassword": "", "notes": "", "synced": [], {"settings": {'
+    b'"www.example.com": {"domain": "www.example.com", "url": "https://www.example.com", "username": "", '
+    b'"iterations": 4096, "salt": "=", "cDate": "2016-01-01T00:00:00.000", "mDate": "2016-01-01T00:00:00.000", '
+    b'"extras": "#!\\"\\u00a7$%&/()[]{}=-_+*<>;:.", "passwordTemplate": "xxxxxxxxxx"}, "')
+PRESET_DICTIONARIES = {zlib.adler32(SETTINGS_DICTIONARY): SETTINGS_DICTIONARY}
+
+
+class Codec(ABC):
+    """
+    A compression algorithm for the Packer. The codec_id is written into the header of the tagged format so it must
+    never change. Compressors need compress and flush, decompressors need decompress and eof.
+    """
+    name = None
+    codec_id = None
+
+    @abstractmethod
+    def create_compressor(self, level, strategy, zdict):
+        """
+        Returns a compress object.
+
+        :param level: compression level from 0 (no compression) to 9 (best compression) or -1 for the default
+        :type level: int
+        :param strategy: a zlib strategy (ignored by other codecs)
+        :type strategy: int
+        :param zdict: a registered preset dictionary (only supported by zlib)
+        :type zdict: bytes
+        :return: a compress object
+        """
+
+    @abstractmethod
+    def create_decompressor(self, head, length):
+        """
+        Returns a decompress object or None if more bytes of the compressed stream are needed to create it. The
+        decompress method of the object has to accept a max_length like zlib, lzma and bz2 do.
+
+        :param head: the first bytes of the compressed stream
+        :type head: bytes
+        :param length: the announced length of the uncompressed data
+        :type length: int
+        :return: a decompress object or None
+        """
+
+
+class NoneCodec(Codec):
+    """
+    Stores the data uncompressed. This is the fastest and smallest choice for tiny payloads.
+    """
+    name = 'none'
+    codec_id = 0
+
+    class Passthrough(object):
+        """
+        Copies the data. The decompressing side counts the bytes to detect the end of the data.
+        """
+        def __init__(self, length=0):
+            self.remaining = length
+            self.eof = length == 0
+            self.unconsumed_tail = b''
+
+        def compress(self, data):
+            return bytes(data)
+
+        def flush(self):
+            return b''
+
+        def decompress(self, data, max_length=-1):
+            data = memoryview(data).cast('B')
+            if max_length >= 0:
+                self.unconsumed_tail = bytes(data[max_length:])
+                data = data[:max_length]
+            self.remaining -= len(data)
+            self.eof = self.remaining <= 0
+            return bytes(data)
+
+    def create_compressor(self, level, strategy, zdict):
+        if zdict is not None:
+            raise ValueError("The codec none does not support dictionaries.")
+        return NoneCodec.Passthrough()
+
+    def create_decompressor(self, head, length):
+        return NoneCodec.Passthrough(length)
+
+
+class ZlibCodec(Codec):
+    """
+    DEFLATE with zlib. This is the codec of the untagged format which all c't SESAM implementations can read. The
+    zlib header announces a preset dictionary which is looked up in PRESET_DICTIONARIES.
+    """
+    name = 'zlib'
+    codec_id = 1
+
+    def create_compressor(self, level, strategy, zdict):
+        if zdict is None:
+            return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, strategy)
+        if PRESET_DICTIONARIES.get(zlib.adler32(zdict)) != zdict:
+            raise ValueError("Please register the dictionary before using it.")
+        return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, strategy, zdict)
+
+    def create_decompressor(self, head, length):
+        if len(head) < 2:
+            return None
+        if not head[1] & 0x20:
+            return zlib.decompressobj()
+        if len(head) < 6:
+            return None
+        dictionary_id = struct.unpack('!I', head[2:6])[0]
+        if dictionary_id not in PRESET_DICTIONARIES:
+            raise ValueError("The compressed data needs an unknown preset dictionary.")
+        return zlib.decompressobj(zlib.MAX_WBITS, PRESET_DICTIONARIES[dictionary_id])
+
+
+class LzmaCodec(Codec):
+    """
+    LZMA in the xz container. Slower than zlib but smaller for big vaults.
+    """
+    name = 'lzma'
+    codec_id = 2
+
+    def create_compressor(self, level, strategy, zdict):
+        if zdict is not None:
+            raise ValueError("The codec lzma does not support dictionaries.")
+        if level == zlib.Z_DEFAULT_COMPRESSION:
+            level = lzma.PRESET_DEFAULT
+        return lzma.LZMACompressor(lzma.FORMAT_XZ, lzma.CHECK_CRC32, level)
+
+    def create_decompressor(self, head, length):
+        return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+
+class Bz2Codec(Codec):
+    """
+    The Burrows-Wheeler compression of bzip2.
+    """
+    name = 'bz2'
+    codec_id = 3
+
+    def create_compressor(self, level, strategy, zdict):
+        if zdict is not None:
+            raise ValueError("The codec bz2 does not support dictionaries.")
+        if level == zlib.Z_DEFAULT_COMPRESSION:
+            level = 9
+        return bz2.BZ2Compressor(max(1, level))
+
+    def create_decompressor(self, head, length):
+        return bz2.BZ2Decompressor()
+
+
+CODECS = {}
 
 
 class Packer(object):
     """
     You do not need to create instances of this class because compress and decompress are both static methods.
+
+    Data may be compressed with a preset dictionary. The zlib stream records the Adler-32 checksum of the dictionary
+    so decompress finds it in PRESET_DICTIONARIES. The dictionary must never change once data was compressed with
+    it. Add new dictionaries with register_dictionary instead. Other c't SESAM implementations do not know the
+    dictionaries so use them only for data which is read by this implementation.
+
+    Without a codec the output has the untagged format: four bytes length and a zlib stream. With a codec the
+    output has the tagged format: the byte 0xFF, the codec_id, four bytes length and the compressed stream. The
+    tagged format can not be confused with the untagged format because that would need a length of more than 4 GB.
+    Both formats are always decompressed. Other c't SESAM implementations only read the untagged format.
     """
 
     @staticmethod
-    def compress(data):
+    def compress(data, level=zlib.Z_BEST_COMPRESSION, strategy=zlib.Z_DEFAULT_STRATEGY, zdict=None, codec=None):
         """
         Compresses the given data with the DEFLATE algorithm. The first four bytes contain the length of the
         uncompressed data.
 
         :param data: uncompressed data
         :type data: bytes or str
+        :param level: compression level from 0 (no compression) to 9 (best compression) or -1 for the zlib default
+        :type level: int
+        :param strategy: a zlib strategy like zlib.Z_DEFAULT_STRATEGY or zlib.Z_FILTERED
+        :type strategy: int
+        :param zdict: a registered preset dictionary like SETTINGS_DICTIONARY
+        :type zdict: bytes
+        :param codec: name of a registered codec for the tagged format (None for the untagged format)
+        :type codec: str
         :return: compressed data
         :rtype: bytes
         """
-        compress_object = zlib.compressobj(
-            zlib.Z_BEST_COMPRESSION,
-            zlib.DEFLATED,
-            zlib.MAX_WBITS,
-            zlib.DEF_MEM_LEVEL,
-            zlib.Z_DEFAULT_STRATEGY)
         if type(data) == str:
-            compressed_data = compress_object.compress(data.encode('utf-8'))
-            compressed_data += compress_object.flush()
-            return struct.pack('!I', len(data.encode('utf-8'))) + compressed_data
-        elif type(data) == bytes:
-            compressed_data = compress_object.compress(data)
-            compressed_data += compress_object.flush()
-            return struct.pack('!I', len(data)) + compressed_data
-        else:
+            data = data.encode('utf-8')
+        elif type(data) not in [bytes, bytearray, memoryview]:
             raise TypeError("Please pass a str or bytes to the packer.")
+        compressor = Packer.get_compressor(memoryview(data).nbytes, level, strategy, zdict, codec)
+        return compressor.compress(data) + compressor.flush()
 
     @staticmethod
-    def decompress(compressed_data):
+    def decompress(compressed_data, max_length=MAX_UNCOMPRESSED_LENGTH):
         """
-        Decompresses the given data. Please be aware that the first four bytes are the length of the uncompressed
-        data.
+        Decompresses the given data in the untagged or tagged format. Please be aware that the length of the
+        uncompressed data is part of the header.
+
+        The announced length is checked against max_length before anything is decompressed and the output buffer
+        is allocated once with that length. Data which decompresses to more than the announced length raises a
+        ValueError as soon as the limit is passed. Shorter data is accepted because the length was never checked
+        by earlier versions.
+
+        The result is the output buffer itself, a bytearray, where earlier versions returned bytes. Converting it would
+        copy the whole uncompressed data once more. Callers which need an immutable value have to call bytes() on it.
 
         :param compressed_data: compressed data
-        :type compressed_data: bytes
+        :type compressed_data: bytes, bytearray or memoryview
+        :param max_length: the maximal accepted length of the uncompressed data
+        :type max_length: int
         :return: uncompressed data
+        :rtype: bytearray
+        """
+        if type(compressed_data) not in [bytes, bytearray, memoryview]:
+            raise TypeError("Please pass bytes to the packer.")
+        decompressor = Packer.get_decompressor(max_length)
+        output = bytearray()
+        position = 0
+        for chunk in decompressor.decompress_chunks(compressed_data):
+            if position == 0:
+                output = bytearray(decompressor.expected_length)
+            output[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        rest = decompressor.flush()
+        if len(output) < decompressor.expected_length:
+            output = bytearray(decompressor.expected_length)
+        output[position:position + len(rest)] = rest
+        position += len(rest)
+        del output[position:]
+        return output
+
+    @staticmethod
+    def register_dictionary(zdict):
+        """
+        Registers a preset dictionary so it can be used for compression and found for decompression.
+
+        :param zdict: the dictionary
+        :type zdict: bytes
+        :return: the dictionary id (Adler-32 checksum) which is stored in the compressed data
+        :rtype: int
+        """
+        dictionary_id = zlib.adler32(zdict)
+        if dictionary_id in PRESET_DICTIONARIES and PRESET_DICTIONARIES[dictionary_id] != zdict:
+            raise ValueError("There is already a different dictionary with the same id.")
+        PRESET_DICTIONARIES[dictionary_id] = zdict
+        return dictionary_id
+
+    @staticmethod
+    def register_codec(codec):
+        """
+        Registers a codec for the tagged format.
+
+        :param codec: the codec
+        :type codec: Codec
+        """
+        for registered_codec in CODECS.values():
+            if registered_codec.codec_id == codec.codec_id and registered_codec.name != codec.name:
+                raise ValueError("There is already a different codec with the same id.")
+        CODECS[codec.name] = codec
+
+    @staticmethod
+    def get_codec(name):
+        """
+        Returns a registered codec.
+
+        :param name: the name like 'zlib' or 'lzma'
+        :type name: str
+        :return: the codec
+        :rtype: Codec
+        """
+        if name not in CODECS:
+            raise ValueError("Unknown codec: " + str(name))
+        return CODECS[name]
+
+    @staticmethod
+    def get_codec_names():
+        """
+        Returns the names of the registered codecs. lzma and bz2 are missing if Python was built without them.
+
+        :return: codec names
+        :rtype: [str]
+        """
+        return sorted(CODECS.keys(), key=lambda name: CODECS[name].codec_id)
+
+    @staticmethod
+    def get_compressor(length, level=zlib.Z_BEST_COMPRESSION, strategy=zlib.Z_DEFAULT_STRATEGY, zdict=None,
+                       codec=None):
+        """
+        Returns an object which compresses data chunk by chunk. The output is the same as the output of compress.
+        The length of the uncompressed data has to be known in advance because it is written first.
+
+        :param length: length of the uncompressed data in bytes
+        :type length: int
+        :param level: compression level from 0 (no compression) to 9 (best compression) or -1 for the zlib default
+        :type level: int
+        :param strategy: a zlib strategy like zlib.Z_DEFAULT_STRATEGY or zlib.Z_FILTERED
+        :type strategy: int
+        :param zdict: a registered preset dictionary like SETTINGS_DICTIONARY
+        :type zdict: bytes
+        :param codec: name of a registered codec for the tagged format (None for the untagged format)
+        :type codec: str
+        :return: a compressor
+        :rtype: StreamCompressor
+        """
+        return StreamCompressor(length, level, strategy, zdict, codec)
+
+    @staticmethod
+    def get_decompressor(max_length=MAX_UNCOMPRESSED_LENGTH):
+        """
+        Returns an object which decompresses data chunk by chunk.
+
+        :param max_length: the maximal accepted length of the uncompressed data
+        :type max_length: int
+        :return: a decompressor
+        :rtype: StreamDecompressor
+        """
+        return StreamDecompressor(max_length)
+
+
+class StreamCompressor(object):
+    """
+    Compresses chunks. The header with the length is emitted with the first output.
+
+    :param length: length of the uncompressed data in bytes
+    :type length: int
+    :param level: compression level
+    :type level: int
+    :param strategy: zlib strategy
+    :type strategy: int
+    :param zdict: a registered preset dictionary
+    :type zdict: bytes
+    :param codec: name of a registered codec for the tagged format (None for the untagged format)
+    :type codec: str
+    """
+    def __init__(self, length, level=zlib.Z_BEST_COMPRESSION, strategy=zlib.Z_DEFAULT_STRATEGY, zdict=None,
+                 codec=None):
+        self.length = length
+        self.consumed = 0
+        if codec is None:
+            self.header = struct.pack('!I', length)
+            self.compress_object = CODECS['zlib'].create_compressor(level, strategy, zdict)
+        else:
+            codec = Packer.get_codec(codec)
+            self.header = struct.pack('!BBI', TAGGED_FORMAT_MARKER, codec.codec_id, length)
+            self.compress_object = codec.create_compressor(level, strategy, zdict)
+
+    def compress(self, data):
+        """
+        Compresses a chunk.
+
+        :param data: a chunk of uncompressed data
+        :type data: bytes-like
+        :return: compressed data (may be empty)
+        :rtype: bytes
+        """
+        self.consumed += memoryview(data).nbytes
+        if self.consumed > self.length:
+            raise ValueError("There is more data than announced.")
+        output = self.header + self.compress_object.compress(data)
+        self.header = b''
+        return output
+
+    def flush(self):
+        """
+        Finishes the compressed stream.
+
+        :return: the rest of the compressed data
+        :rtype: bytes
+        """
+        if self.consumed != self.length:
+            raise ValueError("There is less data than announced.")
+        output = self.header + self.compress_object.flush()
+        self.header = b''
+        return output
+
+
+class StreamDecompressor(object):
+    """
+    Decompresses chunks of data created by compress or a StreamCompressor. The header is read from the first bytes
+    and selects the codec. A ValueError is raised if the announced length is bigger than max_length or if the
+    data decompresses to more than the announced length. The output is produced in bounded pieces so a
+    hostile stream can never allocate more than the announced length.
+
+    :param max_length: the maximal accepted length of the uncompressed data
+    :type max_length: int
+    """
+    def __init__(self, max_length=MAX_UNCOMPRESSED_LENGTH):
+        self.max_length = max_length
+        self.header = b''
+        self.header_length = None
+        self.expected_length = None
+        self.output_length = 0
+        self.codec = None
+        self.decompress_object = None
+
+    def create_decompress_object(self):
+        """
+        Creates the decompress object as soon as the header is complete.
+
+        :return: True if the decompress object exists
+        :rtype: bool
+        """
+        if len(self.header) < 1:
+            return False
+        if self.header[0] == TAGGED_FORMAT_MARKER:
+            if len(self.header) < TAGGED_HEADER_LENGTH:
+                return False
+            codec_ids = {codec.codec_id: codec for codec in CODECS.values()}
+            if self.header[1] not in codec_ids:
+                raise ValueError("The compressed data needs an unknown codec.")
+            codec = codec_ids[self.header[1]]
+            header_length = TAGGED_HEADER_LENGTH
+        else:
+            if len(self.header) < 4:
+                return False
+            codec = CODECS['zlib']
+            header_length = 4
+        expected_length = struct.unpack('!I', self.header[header_length - 4:header_length])[0]
+        if expected_length > self.max_length:
+            raise ValueError("The uncompressed data would be " + str(expected_length) + " bytes long. " +
+                             "Only " + str(self.max_length) + " bytes are allowed.")
+        decompress_object = codec.create_decompressor(self.header[header_length:], expected_length)
+        if decompress_object is None:
+            return False
+        self.codec = codec
+        self.header_length = header_length
+        self.expected_length = expected_length
+        self.decompress_object = decompress_object
+        return True
+
+    def count_output(self, chunk):
+        """
+        Adds a piece of the output to the output length and raises a ValueError if the output gets longer than
+        announced.
+
+        :param chunk: uncompressed data
+        :type chunk: bytes
+        """
+        self.output_length += len(chunk)
+        if self.output_length > self.expected_length:
+            raise ValueError("The compressed data decompresses to more than the announced " +
+                             str(self.expected_length) + " bytes.")
+
+    def decompress_chunks(self, data):
+        """
+        Decompresses a chunk and yields the output in pieces of at most DECOMPRESSION_CHUNK_SIZE bytes. Only the
+        bytes which are needed to read the header are copied. The rest of the chunk is passed to the codec in
+        slices of at most DECOMPRESSION_CHUNK_SIZE bytes so the codec never copies more than one slice.
+
+        :param data: a chunk of compressed data
+        :type data: bytes-like
+        :return: generator of uncompressed pieces
+        """
+        data = memoryview(data).cast('B')
+        if self.decompress_object is None:
+            missing_length = HEADER_PEEK_LENGTH - len(self.header)
+            self.header += bytes(data[:missing_length])
+            data = data[missing_length:]
+            if not self.create_decompress_object():
+                return
+            for chunk in self.decompress_slice(self.header[self.header_length:]):
+                yield chunk
+        for position in range(0, len(data), DECOMPRESSION_CHUNK_SIZE):
+            for chunk in self.decompress_slice(data[position:position + DECOMPRESSION_CHUNK_SIZE]):
+                yield chunk
+
+    def decompress_slice(self, data):
+        """
+        Passes a slice of compressed data to the codec and yields the output in pieces of at most
+        DECOMPRESSION_CHUNK_SIZE bytes.
+
+        :param data: a slice of compressed data
+        :type data: bytes-like
+        :return: generator of uncompressed pieces
+        """
+        while not self.decompress_object.eof:
+            limit = min(DECOMPRESSION_CHUNK_SIZE, self.expected_length - self.output_length + 1)
+            try:
+                chunk = self.decompress_object.decompress(data, limit)
+            except (zlib.error, OSError, EOFError, ValueError):
+                raise ValueError("The compressed data is in a wrong format.")
+            self.count_output(chunk)
+            if chunk:
+                yield chunk
+            if len(chunk) < limit:
+                break
+            data = getattr(self.decompress_object, 'unconsumed_tail', b'')
+
+    def decompress(self, data):
+        """
+        Decompresses a chunk.
+
+        :param data: a chunk of compressed data
+        :type data: bytes-like
+        :return: uncompressed data (may be empty)
         :rtype: bytes
         """
-        if type(compressed_data) == bytes:
+        return b''.join(self.decompress_chunks(data))
+
+    def flush(self):
+        """
+        Returns the rest of the uncompressed data. Raises a ValueError if the compressed stream is incomplete.
+
+        :return: uncompressed data
+        :rtype: bytes
+        """
+        output = b''
+        if self.decompress_object is None:
+            if not self.create_decompress_object():
+                raise ValueError("The compressed data is in a wrong format.")
+            output = self.decompress(self.header[self.header_length:])
+        if hasattr(self.decompress_object, 'flush'):
             try:
-                return zlib.decompress(compressed_data[4:])
+                rest = self.decompress_object.flush()
             except zlib.error:
                 raise ValueError("The compressed data is in a wrong format.")
-        else:
-            raise TypeError("Please pass bytes to the packer.")
+            self.count_output(rest)
+            output += rest
+        if not self.decompress_object.eof:
+            raise ValueError("The compressed data is incomplete.")
+        return output
+
+
+Packer.register_codec(NoneCodec())
+Packer.register_codec(ZlibCodec())
+if lzma is not None:
+    Packer.register_codec(LzmaCodec())
+if bz2 is not None:
+    Packer.register_codec(Bz2Codec())
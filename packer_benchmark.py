@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compares the codecs of the Packer on synthetic vaults. The vaults look like the settings JSON which is saved
+locally and pushed to the sync server.
+"""
+
+from packer import Packer, SETTINGS_DICTIONARY
+from password_setting import PasswordSetting
+from base64 import b64encode
+from datetime import datetime, timedelta
+import argparse
+import random
+import json
+import time
+
+TOP_LEVEL_DOMAINS = ['com', 'de', 'org', 'net', 'io', 'co.uk', 'at', 'ch']
+WORDS = ['mail', 'shop', 'bank', 'cloud', 'news', 'forum', 'games', 'travel', 'music', 'photo', 'work', 'school',
+         'health', 'book', 'stream', 'social', 'market', 'code', 'dev', 'home']
+
+
+def create_vault(setting_count, seed=0):
+    """
+    Creates the settings JSON of a synthetic vault. About a third of the settings have notes or a url and half of
+    them have a username, like in real vaults.
+
+    :param setting_count: number of settings
+    :type setting_count: int
+    :param seed: seed of the random generator
+    :type seed: int
+    :return: the settings JSON
+    :rtype: bytes
+    """
+    rng = random.Random(seed)
+    start = datetime(2016, 1, 1)
+    settings_dict = {'settings': {}, 'synced': []}
+    for i in range(setting_count):
+        domain = rng.choice(WORDS) + rng.choice(WORDS) + str(i) + '.' + rng.choice(TOP_LEVEL_DOMAINS)
+        setting = PasswordSetting(domain)
+        if rng.random() < 0.5:
+            setting.set_username(rng.choice(WORDS) + '.' + rng.choice(WORDS) + '@example.com')
+        if rng.random() < 0.3:
+            setting.set_url('https://www.' + domain + '/login')
+        if rng.random() < 0.3:
+            setting.set_notes(' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 12))))
+        setting.set_salt(bytes(rng.getrandbits(8) for _ in range(32)))
+        creation_date = start + timedelta(seconds=rng.randint(0, 10 ** 8), microseconds=rng.randint(0, 999999))
+        setting.set_creation_date(PasswordSetting.create_ISO_date(creation_date))
+        setting.set_modification_date(PasswordSetting.create_ISO_date(
+            creation_date + timedelta(seconds=rng.randint(0, 10 ** 7))))
+        setting.template = rng.choice(['x', 'a', 'n']) * rng.randint(8, 24)
+        settings_dict['settings'][domain] = setting.to_dict()
+        if rng.random() < 0.8:
+            settings_dict['synced'].append(domain)
+    return json.dumps(settings_dict).encode('utf-8')
+
+
+def measure(function, repetitions):
+    """
+    Returns the shortest duration of some calls of the function in seconds.
+
+    :param function: function without parameters
+    :param repetitions: number of calls
+    :type repetitions: int
+    :return: duration in seconds
+    :rtype: float
+    """
+    best = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark(data, levels, repetitions):
+    """
+    Compresses the data with all codecs and levels.
+
+    :param data: uncompressed data
+    :type data: bytes
+    :param levels: compression levels
+    :type levels: [int]
+    :param repetitions: number of measurements per codec (the fastest counts)
+    :type repetitions: int
+    :return: rows with name, level, compressed size, base64 size, compression and decompression time
+    :rtype: [tuple]
+    """
+    candidates = [('untagged', None, None), ('untagged+dict', None, SETTINGS_DICTIONARY)]
+    candidates += [(codec, codec, None) for codec in Packer.get_codec_names()]
+    rows = []
+    for name, codec, zdict in candidates:
+        for level in levels if codec != 'none' else [0]:
+            compressed_data = Packer.compress(data, level, zdict=zdict, codec=codec)
+            if Packer.decompress(compressed_data) != data:
+                raise RuntimeError("The codec " + name + " does not restore the data.")
+            compression_time = measure(lambda: Packer.compress(data, level, zdict=zdict, codec=codec), repetitions)
+            decompression_time = measure(lambda: Packer.decompress(compressed_data), repetitions)
+            rows.append((name, level, len(compressed_data), len(b64encode(compressed_data)),
+                         compression_time, decompression_time))
+    return rows
+
+
+def print_rows(setting_count, data, rows):
+    print(str(setting_count) + " settings, " + str(len(data)) + " bytes JSON")
+    print("{:<14} {:>5} {:>9} {:>9} {:>7} {:>12} {:>12}".format(
+        "codec", "level", "bytes", "base64", "ratio", "compress ms", "decompress ms"))
+    for name, level, size, base64_size, compression_time, decompression_time in rows:
+        print("{:<14} {:>5} {:>9} {:>9} {:>7.3f} {:>12.3f} {:>12.3f}".format(
+            name, level, size, base64_size, size / len(data), compression_time * 1000, decompression_time * 1000))
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of the Packer codecs on synthetic vaults.")
+    parser.add_argument('-n', '--settings', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help="Number of settings in the vaults.")
+    parser.add_argument('-l', '--levels', type=int, nargs='+', default=[1, 6, 9],
+                        help="Compression levels.")
+    parser.add_argument('-r', '--repetitions', type=int, default=5,
+                        help="Measurements per codec. The fastest counts.")
+    args = parser.parse_args()
+    for count in args.settings:
+        vault = create_vault(count)
+        print_rows(count, vault, benchmark(vault, args.levels, args.repetitions))
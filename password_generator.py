@@ -6,6 +6,8 @@ c't SESAM implementations.
 """
 
 from hashlib import pbkdf2_hmac
+from concurrent.futures import ThreadPoolExecutor
+import os
 
 
 class CtSesam(object):
@@ -23,13 +25,42 @@ class CtSesam(object):
     :type salt: bytes
     :param iterations: iteration count (should be 1 or higher, default is 4096)
     :type iterations: int
+    :param cache: an optional cache for derived hashes
+    :type cache: HashCache
     """
-    def __init__(self, domain, username, kgk, salt="pepper".encode('utf-8'), iterations=4096):
-        start_value = domain.encode('utf-8') + username.encode('utf-8') + kgk
+    def __init__(self, domain, username, kgk, salt="pepper".encode('utf-8'), iterations=4096, cache=None):
         if iterations <= 0:
             print("Iteration count was below 1. Hashing 4096 times instead.")
             iterations = 4096
-        self.hash_value = pbkdf2_hmac('sha512', start_value, salt, iterations)
+        if cache is not None:
+            key = cache.create_key(domain, username, salt, iterations)
+            self.hash_value = cache.get(key, kgk)
+            if self.hash_value is None:
+                self.hash_value = CtSesam.calculate_hash(domain, username, kgk, salt, iterations)
+                cache.put(key, kgk, self.hash_value)
+        else:
+            self.hash_value = CtSesam.calculate_hash(domain, username, kgk, salt, iterations)
+
+    @staticmethod
+    def calculate_hash(domain, username, kgk, salt, iterations):
+        """
+        Calculates the hash value with PBKDF2 using HMAC with SHA512.
+
+        :param domain: the domain str
+        :type domain: str
+        :param username: the username str
+        :type username: str
+        :param kgk: the kgk
+        :type kgk: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :param iterations: iteration count
+        :type iterations: int
+        :return: the hash value
+        :rtype: bytes
+        """
+        start_value = domain.encode('utf-8') + username.encode('utf-8') + kgk
+        return pbkdf2_hmac('sha512', start_value, salt, iterations)
 
     def generate(self, setting):
         """
@@ -41,26 +72,50 @@ class CtSesam(object):
         :rtype: str
         """
         number = int.from_bytes(self.hash_value, byteorder='big')
-        password = ""
-        character_set = setting.get_character_set()
-        digits_set = setting.get_digits_character_set()
-        lower_set = setting.get_lower_case_character_set()
-        upper_set = setting.get_upper_case_character_set()
-        extra_set = setting.get_extra_character_set()
-        template = setting.get_template()
-        for t in template:
-            if number > 0:
-                if t == 'a':
-                    current_set = lower_set
-                elif t == 'A':
-                    current_set = upper_set
-                elif t == 'n':
-                    current_set = digits_set
-                elif t == 'o':
-                    current_set = extra_set
-                else:
-                    current_set = character_set
-                if len(current_set) > 0:
-                    password = password + current_set[number % len(current_set)]
-                    number //= len(current_set)
-        return password
+        password = []
+        plan = setting.get_generation_plan()
+        for character_set, radix in zip(plan.character_sets, plan.radices):
+            if number <= 0:
+                break
+            number, index = divmod(number, radix)
+            password.append(character_set[index])
+        return ''.join(password)
+
+
+def generate_passwords(settings, kgk, max_workers=None, cache=None):
+    """
+    Generates the passwords for many settings at once. The PBKDF2 calculations are spread over a pool of worker
+    threads. hashlib releases the GIL while hashing so the threads really run in parallel. The pool has one worker
+    per CPU if max_workers is not set.
+
+    :param settings: the settings for which passwords should be generated
+    :type settings: [PasswordSetting]
+    :param kgk: the kgk
+    :type kgk: bytes
+    :param max_workers: number of worker threads (defaults to the number of CPUs)
+    :type max_workers: int
+    :param cache: an optional cache for derived hashes
+    :type cache: HashCache
+    :return: the passwords in the same order as the settings
+    :rtype: [str]
+    """
+    settings = list(settings)
+    if len(settings) <= 0:
+        return []
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(settings)))
+
+    def generate_single(setting):
+        sesam = CtSesam(setting.get_domain(),
+                        setting.get_username(),
+                        kgk,
+                        setting.get_salt(),
+                        setting.get_iterations(),
+                        cache)
+        return sesam.generate(setting)
+
+    if max_workers == 1:
+        return [generate_single(setting) for setting in settings]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(generate_single, settings))
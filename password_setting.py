@@ -5,6 +5,7 @@ Sets of password settings for a domain.
 """
 
 from datetime import datetime
+from collections import namedtuple
 import getpass
 import string
 import re
@@ -18,6 +19,8 @@ DEFAULT_CHARACTER_SET_UPPER_CASE = string.ascii_uppercase
 DEFAULT_CHARACTER_SET_DIGITS = string.digits
 DEFAULT_CHARACTER_SET_EXTRA = '#!"§$%&/()[]{}=-_+*<>;:.'
 
+GenerationPlan = namedtuple('GenerationPlan', ['character_sets', 'radices'])
+
 
 class PasswordSetting(object):
     """
@@ -37,6 +40,8 @@ class PasswordSetting(object):
         self.template = 'x'*10
         self.calculate_template(True, True, True, True)
         self.synced = False
+        self.generation_plan = None
+        self.generation_plan_key = None
 
     def __str__(self):
         output = "<" + self.domain + ": ("
@@ -202,6 +207,32 @@ class PasswordSetting(object):
             used_characters += self.get_extra_character_set()
         return used_characters
 
+    def get_generation_plan(self):
+        """
+        Returns the compiled generation plan: the character set for every position of the template and the
+        number of characters in each set. Positions with an empty character set are left out because they do not
+        produce a character. The plan is cached and recompiled if the template or the extra characters change.
+
+        :return: the generation plan
+        :rtype: GenerationPlan
+        """
+        key = (self.template, self.extra_characters)
+        if self.generation_plan is None or self.generation_plan_key != key:
+            sets_by_template_character = {
+                'a': self.get_lower_case_character_set(),
+                'A': self.get_upper_case_character_set(),
+                'n': self.get_digits_character_set(),
+                'o': self.get_extra_character_set(),
+                'x': self.get_character_set()
+            }
+            character_sets = tuple(sets_by_template_character.get(t, sets_by_template_character['x'])
+                                   for t in self.template)
+            character_sets = tuple(character_set for character_set in character_sets if len(character_set) > 0)
+            self.generation_plan = GenerationPlan(character_sets=character_sets,
+                                                  radices=tuple(len(c) for c in character_sets))
+            self.generation_plan_key = key
+        return self.generation_plan
+
     def get_extra_character_set(self):
         """
         Returns the set of special characters.
@@ -608,9 +639,15 @@ class PasswordSetting(object):
             self.set_extra_character_set(loaded_setting["usedCharacters"])
             self.calculate_template(False, False, False, True)
 
-    def ask_for_input(self):
+    def ask_for_input(self, calibrator=None, target_latency=None):
         """
-        Displays some input prompts for the settings properties.
+        Displays some input prompts for the settings properties. If a calibrator and a target latency are passed the
+        suggested iteration count is calculated from the measured speed of this machine.
+
+        :param calibrator: an iteration calibrator
+        :type calibrator: IterationCalibrator
+        :param target_latency: desired duration of the password calculation in seconds
+        :type target_latency: float
         """
         self.set_username(input('Benutzername: '))
         wants_legacy_password = input('Möchten Sie ein Passwort generieren (Alternative: nur speichern)? [J/n] ')
@@ -626,6 +663,8 @@ class PasswordSetting(object):
                 length = self.get_length()
             self.set_template("6;" + "x"*length)
             self.calculate_template(True, True, True, True)
+            if calibrator and target_latency:
+                self.set_iterations(calibrator.recommend_iterations(target_latency, 'sha512'))
             iterations_str = input('Iterationszahl [' + str(self.get_iterations()) + ']: ')
             try:
                 iterations = int(iterations_str)
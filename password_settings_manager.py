@@ -6,13 +6,24 @@ The PasswordSettingsManager handles the settings and manages storage and synchro
 
 import json
 import struct
+import zlib
+import threading
+import atexit
+from contextlib import contextmanager
 from datetime import datetime
 from password_setting import PasswordSetting
+from settings_collection import SettingsCollection
+from settings_merger import SettingsMerger
 from crypter import Crypter
-from packer import Packer
+from packer import Packer, SETTINGS_DICTIONARY, MAX_UNCOMPRESSED_LENGTH, TAGGED_HEADER_LENGTH
 from sync_manager import SyncManager
 from base64 import b64decode, b64encode
 from kgk_manager import KgkManager
+from hash_cache import HashCache
+from hashlib import sha256
+from journal import Journal, JOURNAL_COMPACTION_THRESHOLD
+
+AUTHENTICATED_SETTINGS_MARKER = b'\x02ctSESAM'
 
 
 class PasswordSettingsManager(object):
@@ -26,9 +37,34 @@ class PasswordSettingsManager(object):
     def __init__(self, preference_manager):
         self.preference_manager = preference_manager
         self.remote_data = None
-        self.settings = []
+        self.last_merge = None
+        self.remote_version = None
+        self.deleted_domains = {}
+        self.file_dates = {}
+        self.settings = SettingsCollection()
         self.sync_manager = SyncManager()
         self.update_remote = False
+        self.hash_cache = None
+        self.reuse_settings_key = False
+        self.settings_key = None
+        self.format_version = 1
+        self.compression_level = zlib.Z_DEFAULT_COMPRESSION
+        self.compression_strategy = zlib.Z_DEFAULT_STRATEGY
+        self.compression_dictionary = None
+        self.compression_codec = None
+        self.max_uncompressed_length = MAX_UNCOMPRESSED_LENGTH
+        self.journal = None
+        self.journal_kgk_manager = None
+        self.journal_compaction_threshold = JOURNAL_COMPACTION_THRESHOLD
+        self.pending_changes = False
+        self.batch_depth = 0
+        self.batch_kgk_manager = None
+        self.auto_flush_kgk_manager = None
+        self.auto_flush_delay = 0
+        self.flush_timer = None
+        self.flush_lock = threading.RLock()
+        self.push_lock = threading.Lock()
+        self.changed_during_push = None
 
     @staticmethod
     def get_settings_crypter(kgk_manager):
@@ -42,61 +78,386 @@ class PasswordSettingsManager(object):
         """
         return Crypter(Crypter.create_key(kgk_manager.get_kgk(), kgk_manager.get_salt2()) + kgk_manager.get_iv2())
 
+    def enable_hash_cache(self, max_size=128, ttl=300):
+        """
+        Activates a cache for the hashes derived for the domains. Pass the cache to CtSesam when generating
+        passwords.
+
+        :param max_size: maximum number of cached hashes
+        :type max_size: int
+        :param ttl: time to live of an entry in seconds
+        :type ttl: float
+        :return: the hash cache
+        :rtype: HashCache
+        """
+        self.hash_cache = HashCache(max_size=max_size, ttl=ttl)
+        return self.hash_cache
+
+    def disable_hash_cache(self):
+        """
+        Wipes the hash cache and deactivates it.
+        """
+        self.wipe_hash_cache()
+        self.hash_cache = None
+
+    def wipe_hash_cache(self):
+        """
+        Removes all cached hashes. Call this if the kgk changes.
+        """
+        if self.hash_cache is not None:
+            self.hash_cache.wipe()
+
+    def set_format_version(self, version):
+        """
+        Selects the format for saving and exporting. Version 1 uses AES in CBC mode and is understood by all
+        c't SESAM implementations. Version 2 uses AES in GCM mode with a key check value so a wrong password or
+        corrupt data is rejected before decompression. Both versions can always be read.
+
+        :param version: 1 or 2
+        :type version: int
+        """
+        if version not in [1, 2]:
+            raise ValueError("Unknown format version: " + str(version))
+        self.format_version = version
+
+    def set_compression(self, level=zlib.Z_DEFAULT_COMPRESSION, strategy=zlib.Z_DEFAULT_STRATEGY,
+                        use_preset_dictionary=False, codec=None):
+        """
+        Sets the DEFLATE level and strategy for saving and exporting. The default level is a good trade-off for
+        the small JSON documents of the settings. The result can be read by all c't SESAM implementations
+        regardless of the level.
+
+        With use_preset_dictionary the settings are compressed with SETTINGS_DICTIONARY which already contains
+        the keys of the settings. This saves a lot for a few settings. The id of the dictionary is stored in the
+        zlib header so the data can be read without this option. Other implementations do not know the
+        dictionary so only use this if all your clients use this implementation.
+
+        With a codec like 'lzma' or 'bz2' the settings are packed in the tagged format of the Packer. This is also
+        only readable by this implementation. Use packer_benchmark.py to compare the codecs for your vault.
+
+        :param level: compression level from 0 (no compression) to 9 (best compression) or -1 for the zlib default
+        :type level: int
+        :param strategy: a zlib strategy like zlib.Z_DEFAULT_STRATEGY or zlib.Z_FILTERED
+        :type strategy: int
+        :param use_preset_dictionary: compress with SETTINGS_DICTIONARY?
+        :type use_preset_dictionary: bool
+        :param codec: name of a codec (None for the untagged DEFLATE format)
+        :type codec: str
+        """
+        if level != zlib.Z_DEFAULT_COMPRESSION and not 0 <= level <= 9:
+            raise ValueError("The compression level must be in the range 0 to 9 or -1.")
+        if codec is not None:
+            Packer.get_codec(codec)
+        if use_preset_dictionary and codec not in [None, 'zlib']:
+            raise ValueError("Only zlib supports preset dictionaries.")
+        self.compression_level = level
+        self.compression_strategy = strategy
+        self.compression_dictionary = SETTINGS_DICTIONARY if use_preset_dictionary else None
+        self.compression_codec = codec
+
+    def enable_settings_key_reuse(self):
+        """
+        Derives the settings key only once per session. Consecutive saves keep salt2 and only renew iv2 so they
+        do not need a key derivation.
+        """
+        self.reuse_settings_key = True
+
+    def disable_settings_key_reuse(self):
+        """
+        Forgets the settings key. Every save gets a fresh salt2 and a freshly derived key again.
+        """
+        self.reuse_settings_key = False
+        self.settings_key = None
+
+    def get_session_settings_crypter(self, kgk_manager):
+        """
+        Creates a settings crypter. The key is remembered and reused as long as kgk and salt2 do not change.
+
+        :param kgk_manager: a kgk manager
+        :type kgk_manager: KgkManager
+        :return: Crypter for settings
+        :rtype: Crypter
+        """
+        if not self.has_session_settings_key(kgk_manager):
+            self.settings_key = (kgk_manager.get_kgk(), kgk_manager.get_salt2(),
+                                 Crypter.create_key(kgk_manager.get_kgk(), kgk_manager.get_salt2()))
+        return Crypter(self.settings_key[2] + kgk_manager.get_iv2())
+
+    def has_session_settings_key(self, kgk_manager):
+        """
+        Returns True if there is a remembered settings key for the kgk and salt2 of the kgk manager.
+
+        :param kgk_manager: a kgk manager
+        :type kgk_manager: KgkManager
+        :return: is there a key?
+        :rtype: bool
+        """
+        return self.settings_key is not None and \
+            self.settings_key[0] == kgk_manager.get_kgk() and \
+            self.settings_key[1] == kgk_manager.get_salt2()
+
+    def enable_journal(self, kgk_manager, compaction_threshold=JOURNAL_COMPACTION_THRESHOLD):
+        """
+        Writes changes by set_setting and delete_setting immediately to an encrypted journal next to the settings
+        file instead of waiting for store_local_settings. load_local_settings replays the journal. If the journal
+        grows bigger than compaction_threshold bytes the settings are stored completely and the journal starts
+        over. Enable the journal before loading the settings.
+
+        :param kgk_manager: the kgk manager for the encryption
+        :type kgk_manager: KgkManager
+        :param compaction_threshold: maximal size of the journal in bytes
+        :type compaction_threshold: int
+        """
+        self.journal = Journal(self.preference_manager.settings_file + '.journal')
+        self.journal_kgk_manager = kgk_manager
+        self.journal_compaction_threshold = compaction_threshold
+
+    def disable_journal(self):
+        """
+        Stops writing the journal. An existing journal is still in the file system until the next
+        store_local_settings with an enabled journal.
+        """
+        self.journal = None
+        self.journal_kgk_manager = None
+
+    def get_snapshot_id(self):
+        """
+        Returns the id of the settings in the settings file for the journal or None if there are no settings.
+
+        :return: snapshot id
+        :rtype: bytes
+        """
+        kgk_block = self.preference_manager.get_kgk_block_view()
+        if len(kgk_block) != 112 or len(self.preference_manager.get_settings_data_view()) == 0:
+            return None
+        return Journal.get_snapshot_id(kgk_block)
+
+    def append_to_journal(self, record):
+        """
+        Appends a change to the journal if the journal is enabled and there are stored settings. Changes in a batch
+        are not journaled because the batch stores all settings at its end. Compacts the journal if it is too
+        big. If another process saved the settings file in the meantime all settings are
+        stored instead.
+
+        :param record: the change
+        :type record: dict
+        :return: was the change saved?
+        :rtype: bool
+        """
+        if self.journal is None or self.batch_depth > 0:
+            return False
+        with self.preference_manager.lock():
+            snapshot_id = self.get_snapshot_id()
+            if snapshot_id is None:
+                return False
+            if self.preference_manager.has_changed():
+                self.store_local_settings(self.journal_kgk_manager)
+                return True
+            self.journal.append(self.journal_kgk_manager.get_kgk(), snapshot_id, record)
+            if self.journal.get_size() > self.journal_compaction_threshold:
+                self.store_local_settings(self.journal_kgk_manager)
+        return True
+
+    def replay_journal(self, kgk_manager):
+        """
+        Applies the changes from the journal to the loaded settings.
+
+        :param kgk_manager: the kgk manager for the decryption
+        :type kgk_manager: KgkManager
+        """
+        snapshot_id = self.get_snapshot_id()
+        if self.journal is None or snapshot_id is None:
+            return
+        for record in self.journal.read(kgk_manager.get_kgk(), snapshot_id):
+            self.settings.remove(record['domain'])
+            if not record.get('deleted', False):
+                setting = PasswordSetting(record['domain'])
+                setting.load_from_dict(record['setting'])
+                setting.set_synced(False)
+                self.settings.add(setting)
+                self.update_remote = True
+
     def load_local_settings(self, kgk_manager):
         """
         This loads the saved settings. It is a good idea to call this method the minute you have a kgk manager.
+        Settings in memory which are newer than the saved ones are kept.
 
         :param kgk_manager: kgk manager
         :type kgk_manager: KgkManager
+        :return: the changes of the settings in memory or None if there are no saved settings
+        :rtype: MergeResult
         """
-        encrypted_settings = self.preference_manager.get_settings_data()
+        encrypted_settings = self.preference_manager.get_settings_data_view()
         if len(encrypted_settings) < 40:
-            return
-        settings_crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
-        decrypted_settings = settings_crypter.decrypt(encrypted_settings)
-        sync_settings_len = struct.unpack('!I', decrypted_settings[0:4])[0]
+            return None
+        if self.reuse_settings_key:
+            settings_crypter = self.get_session_settings_crypter(kgk_manager)
+        else:
+            settings_crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
+        marker_length = len(AUTHENTICATED_SETTINGS_MARKER)
+        if encrypted_settings[:marker_length] == AUTHENTICATED_SETTINGS_MARKER:
+            decrypted_settings = PasswordSettingsManager.decrypt_to_buffer(
+                settings_crypter, encrypted_settings[marker_length:], True, AUTHENTICATED_SETTINGS_MARKER)
+        else:
+            decrypted_settings = PasswordSettingsManager.decrypt_to_buffer(settings_crypter, encrypted_settings)
+        del encrypted_settings
+        sync_settings_len = struct.unpack_from('!I', decrypted_settings)[0]
         if sync_settings_len > 0:
             self.sync_manager.load_binary_sync_settings(decrypted_settings[4:4+sync_settings_len])
-        if len(decrypted_settings) < sync_settings_len+44:
+        if len(decrypted_settings) < 4+sync_settings_len+TAGGED_HEADER_LENGTH:
             raise ValueError("The decrypted settings are too short.")
-        decompressed_settings = Packer.decompress(decrypted_settings[4+sync_settings_len:])
+        decompressed_settings = Packer.decompress(decrypted_settings[4+sync_settings_len:],
+                                                  self.max_uncompressed_length)
+        del decrypted_settings
         if len(decompressed_settings) <= 0:
             raise PermissionError("Wrong password: The settings could not decompress.")
-        saved_settings = json.loads(str(decompressed_settings, encoding='utf-8'))
-        for domain_name in saved_settings['settings'].keys():
-            data_set = saved_settings['settings'][domain_name]
-            found = False
-            i = 0
-            while i < len(self.settings):
-                setting = self.settings[i]
-                if setting.get_domain() == domain_name:
-                    found = True
-                    if PasswordSetting.create_ISO_date(data_set['mDate']) > setting.get_m_date():
-                        setting.load_from_dict(data_set)
-                        setting.set_synced(setting.get_domain() in saved_settings['synced'])
-                i += 1
-            if not found:
-                new_setting = PasswordSetting(domain_name)
-                new_setting.load_from_dict(data_set)
-                new_setting.set_synced(new_setting.get_domain() in saved_settings['synced'])
-                self.settings.append(new_setting)
+        saved_settings = PasswordSettingsManager.parse_json(decompressed_settings)
+        del decompressed_settings
+        self.last_merge = self.merge_data_sets(saved_settings['settings'], set(saved_settings['synced']))
+        self.remove_settings_deleted_in_file(saved_settings['settings'], self.last_merge)
+        self.file_dates = PasswordSettingsManager.get_file_dates(saved_settings['settings'])
+        self.replay_journal(kgk_manager)
+        return self.last_merge
+
+    def remove_settings_deleted_in_file(self, data_sets, merge_result):
+        """
+        Removes the settings which were in the settings file at the last load or store but are missing in the file
+        now. Another process deleted them. Settings which were changed locally since then are kept.
+
+        :param data_sets: setting dicts by domain from the settings file
+        :type data_sets: dict
+        :param merge_result: the result of the merge of the data sets which is updated
+        :type merge_result: MergeResult
+        """
+        for domain, file_date in self.file_dates.items():
+            if domain in data_sets:
+                continue
+            setting = self.settings.find(domain)
+            if setting is not None and setting.get_m_date() <= PasswordSetting.convert_ISO_date(file_date):
+                self.settings.remove(domain)
+                merge_result.deleted.append(domain)
+                if domain in merge_result.local_only:
+                    merge_result.local_only.remove(domain)
+
+    @staticmethod
+    def get_file_dates(data_sets):
+        """
+        Returns the modification dates of the setting dicts which are in the settings file.
+
+        :param data_sets: setting dicts by domain
+        :type data_sets: dict
+        :return: ISO dates by domain
+        :rtype: dict
+        """
+        return {domain: data_set['mDate'] if 'mDate' in data_set else data_set['cDate']
+                for domain, data_set in data_sets.items()}
+
+    @staticmethod
+    def decrypt_to_buffer(settings_crypter, encrypted_data, authenticated=False, associated_data=b''):
+        """
+        Decrypts into a freshly allocated buffer and returns a view of the decrypted data. Slices of the view do not
+        copy the data.
+
+        :param settings_crypter: the settings crypter
+        :type settings_crypter: Crypter
+        :param encrypted_data: encrypted data
+        :type encrypted_data: bytes or memoryview
+        :param authenticated: was the data encrypted with encrypt_authenticated?
+        :type authenticated: bool
+        :param associated_data: authenticated but not encrypted data
+        :type associated_data: bytes
+        :return: the decrypted data
+        :rtype: memoryview
+        """
+        buffer = bytearray(len(encrypted_data))
+        if authenticated:
+            length = settings_crypter.decrypt_authenticated_into(encrypted_data, buffer, associated_data)
+        else:
+            length = settings_crypter.decrypt_into(encrypted_data, buffer)
+        return memoryview(buffer)[:length]
+
+    @staticmethod
+    def parse_json(data):
+        """
+        Parses UTF-8 encoded JSON. A bytearray is emptied after it was decoded so its memory is released before the
+        parsed objects are created.
+
+        :param data: UTF-8 encoded JSON
+        :type data: bytes or bytearray
+        :return: the parsed data
+        """
+        text = str(data, encoding='utf-8')
+        if type(data) == bytearray:
+            data.clear()
+        return json.loads(text)
 
     def store_local_settings(self, kgk_manager):
         """
         This actually saves the settings to a file on the disk. The file is encrypted so you need to supply the
-        password.
+        password. Every save gets a fresh iv2. salt2 is renewed too unless the settings key is reused. Settings,
+        kgk block and salt are written in a single atomic write. The settings file is locked while saving. If
+        another process saved the file since it was loaded its settings are merged first so nothing gets lost.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        """
+        with self.preference_manager.lock():
+            if self.preference_manager.reload_if_changed():
+                self.merge_changed_file(kgk_manager)
+            if self.reuse_settings_key:
+                if not self.has_session_settings_key(kgk_manager):
+                    kgk_manager.fresh_salt2()
+                kgk_manager.fresh_iv2()
+                settings_crypter = self.get_session_settings_crypter(kgk_manager)
+            else:
+                kgk_manager.fresh_salt2()
+                kgk_manager.fresh_iv2()
+                settings_crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
+            sync_settings = self.sync_manager.get_binary_sync_settings()
+            settings_dict = self.get_settings_as_dict()
+            settings_data = struct.pack('!I', len(sync_settings)) + sync_settings + \
+                Packer.compress(json.dumps(settings_dict),
+                                self.compression_level, self.compression_strategy, self.compression_dictionary,
+                                self.compression_codec)
+            with self.preference_manager.transaction():
+                if self.format_version == 2:
+                    self.preference_manager.store_settings_data(
+                        AUTHENTICATED_SETTINGS_MARKER +
+                        settings_crypter.encrypt_authenticated(settings_data, AUTHENTICATED_SETTINGS_MARKER))
+                else:
+                    self.preference_manager.store_settings_data(settings_crypter.encrypt(settings_data))
+                kgk_manager.store_local_kgk_block()
+            self.file_dates = PasswordSettingsManager.get_file_dates(settings_dict['settings'])
+            if self.journal is not None:
+                self.journal.clear()
+            self.pending_changes = False
+
+    def merge_changed_file(self, kgk_manager):
+        """
+        Merges the settings which another process saved since the file was loaded. Newer settings win.
 
         :param kgk_manager: kgk manager
         :type kgk_manager: KgkManager
         """
-        kgk_manager.fresh_salt2()
-        kgk_manager.fresh_iv2()
-        settings_crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
-        sync_settings = self.sync_manager.get_binary_sync_settings()
-        self.preference_manager.store_settings_data(settings_crypter.encrypt(
-            struct.pack('!I', len(sync_settings)) + sync_settings +
-            Packer.compress(json.dumps(self.get_settings_as_dict()))))
-        kgk_manager.store_local_kgk_block()
+        kgk_manager.reload_kgk_block()
+        self.load_local_settings(kgk_manager)
+
+    def merge_data_sets(self, data_sets, synced_domains=None):
+        """
+        Merges setting dicts into the settings. Domains which were deleted after the last push stay deleted unless
+        the data set is newer than the deletion.
+
+        :param data_sets: setting dicts by domain
+        :type data_sets: dict
+        :param synced_domains: domains which are marked as synced after the merge (None for all merged settings)
+        :type synced_domains: set
+        :return: the diff
+        :rtype: MergeResult
+        """
+        merge_result = SettingsMerger.merge(self.settings, data_sets, synced_domains, self.deleted_domains)
+        for domain in merge_result.added:
+            self.deleted_domains.pop(domain, None)
+        return merge_result
 
     def load_settings(self, kgk_manager, password, no_sync=False):
         """
@@ -113,14 +474,36 @@ class PasswordSettingsManager(object):
         if not no_sync:
             if self.sync_manager.has_settings():
                 pull_successful, data = self.sync_manager.pull()
-                if pull_successful and len(data) > 0:
-                    remote_kgk_manager = KgkManager()
-                    remote_kgk_manager.update_from_blob(password.encode('utf-8'), b64decode(data))
-                    if remote_kgk_manager.has_kgk() and kgk_manager.get_kgk() != remote_kgk_manager.get_kgk():
-                        raise ValueError("KGK mismatch! This are not your settings!")
-                    self.update_from_export_data(remote_kgk_manager, b64decode(data))
-                else:
-                    print("Sync failed: No connection to the server.")
+                self.update_from_pulled_data(kgk_manager, password, pull_successful, data)
+
+    def update_from_pulled_data(self, kgk_manager, password, pull_successful, data):
+        """
+        Merges the data pulled from the sync server into the settings.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :param password: the masterpassword
+        :type password: str
+        :param pull_successful: was the pull successful?
+        :type pull_successful: bool
+        :param data: the pulled base64 data
+        :type data: str
+        """
+        if pull_successful and len(data) > 0:
+            remote_kgk_manager = KgkManager(kgk_manager.key_cache)
+            remote_kgk_manager.update_from_blob(password.encode('utf-8'), b64decode(data))
+            if remote_kgk_manager.has_kgk() and kgk_manager.get_kgk() != remote_kgk_manager.get_kgk():
+                raise ValueError("KGK mismatch! This are not your settings!")
+            self.update_from_export_data(remote_kgk_manager, b64decode(data), kgk_manager)
+            self.remote_version = PasswordSettingsManager.get_version(data)
+            deltas = self.sync_manager.get_pulled_deltas()
+            if len(deltas) > 0:
+                for delta in deltas:
+                    self.update_from_delta_data(remote_kgk_manager, password, b64decode(delta))
+                    self.remote_version = PasswordSettingsManager.get_version(delta)
+                self.store_local_settings(kgk_manager)
+        else:
+            print("Sync failed: No connection to the server.")
 
     def get_setting(self, domain):
         """
@@ -132,41 +515,173 @@ class PasswordSettingsManager(object):
         :return: a setting object
         :rtype: PasswordSetting
         """
-        for setting in self.settings:
-            if setting.get_domain() == domain:
-                return setting
-        setting = PasswordSetting(domain)
-        self.settings.append(setting)
+        setting = self.settings.find(domain)
+        if setting is None:
+            setting = PasswordSetting(domain)
+            self.settings.add(setting)
         return setting
 
+    def find_setting(self, domain):
+        """
+        Returns the setting for the domain or None if there is none. Unlike get_setting this does not create a
+        setting.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the setting or None
+        :rtype: PasswordSetting
+        """
+        return self.settings.find(domain)
+
+    def has_setting(self, domain):
+        """
+        Checks if there is a setting for the domain.
+
+        :param domain: the domain
+        :type domain: str
+        :return: is there a setting?
+        :rtype: bool
+        """
+        return domain in self.settings
+
     def set_setting(self, setting):
         """
         This saves the supplied setting only in memory. Call save_settings_to_file if you want to have it saved to
-        disk.
+        disk. With an enabled journal the change is appended to the journal. The setting is marked as not synced
+        so it is part of the next delta.
 
         :param PasswordSetting setting: the setting which should be saved
         """
-        for i, existing_setting in enumerate(self.settings):
-            if existing_setting.get_domain() == setting.get_domain():
-                self.settings.pop(i)
-        self.settings.append(setting)
-        self.update_remote = True
+        with self.flush_lock:
+            setting.set_synced(False)
+            self.settings.add(setting)
+            self.deleted_domains.pop(setting.get_domain(), None)
+            self.update_remote = True
+            if self.changed_during_push is not None:
+                self.changed_during_push.add(setting.get_domain())
+            self.append_to_journal({'domain': setting.get_domain(), 'setting': setting.to_dict()})
+            self.mark_changed()
 
     def delete_setting(self, setting):
         """
         This removes the setting from the internal list. Call save_settings_to_file if you want to have the change
-        saved to disk.
+        saved to disk. With an enabled journal the change is appended to the journal.
 
         :param setting: PasswordSetting object
         :type setting: PasswordSetting
         """
-        i = 0
-        while i < len(self.settings):
-            existing_setting = self.settings[i]
-            if existing_setting.get_domain() == setting.get_domain():
-                self.settings.pop(i)
-            else:
-                i += 1
+        with self.flush_lock:
+            if self.settings.remove(setting.get_domain()) is not None:
+                self.deleted_domains[setting.get_domain()] = PasswordSetting.create_ISO_date(datetime.now())
+                self.update_remote = True
+                if self.changed_during_push is not None:
+                    self.changed_during_push.add(setting.get_domain())
+            self.append_to_journal({'domain': setting.get_domain(), 'deleted': True})
+            self.mark_changed()
+
+    def mark_changed(self):
+        """
+        Remembers that the settings in memory changed. With auto flush a store is scheduled unless a batch is
+        running.
+        """
+        self.pending_changes = True
+        if self.batch_depth == 0 and self.auto_flush_kgk_manager is not None:
+            self.schedule_flush()
+
+    @contextmanager
+    def batch(self, kgk_manager=None):
+        """
+        Context manager for many changes at once. Calls of store_settings inside the batch are deferred and the
+        settings are stored and pushed once at the end of the outermost batch. If a kgk manager is passed the
+        changes of the batch are stored even without a call of store_settings. Nothing is stored if the batch ends
+        with an exception but the changes stay in memory.
+
+        :param kgk_manager: the kgk manager for storing at the end (optional)
+        :type kgk_manager: KgkManager
+        """
+        with self.flush_lock:
+            self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.flush_lock:
+                self.batch_depth -= 1
+        batch_kgk_manager = None
+        with self.flush_lock:
+            if self.batch_depth > 0:
+                return
+            if kgk_manager is not None:
+                self.batch_kgk_manager = kgk_manager
+            if self.batch_kgk_manager is not None:
+                if self.pending_changes:
+                    batch_kgk_manager = self.batch_kgk_manager
+                self.batch_kgk_manager = None
+            elif self.pending_changes and self.auto_flush_kgk_manager is not None:
+                self.schedule_flush()
+        if batch_kgk_manager is not None:
+            self.store_settings(batch_kgk_manager)
+
+    def enable_auto_flush(self, kgk_manager, delay=2.0):
+        """
+        Stores and pushes the settings automatically when there were no changes for delay seconds. Many changes in
+        a short time result in a single store. The timer runs in a daemon thread so pending changes are also
+        stored at the normal exit of the interpreter. They are lost if the process is killed.
+
+        :param kgk_manager: the kgk manager for storing
+        :type kgk_manager: KgkManager
+        :param delay: seconds without changes before the settings are stored
+        :type delay: float
+        """
+        with self.flush_lock:
+            if self.auto_flush_kgk_manager is None:
+                atexit.register(self.flush)
+            self.auto_flush_kgk_manager = kgk_manager
+            self.auto_flush_delay = delay
+
+    def disable_auto_flush(self, flush=True):
+        """
+        Stops storing automatically. Pending changes are stored unless flush is False.
+
+        :param flush: store pending changes?
+        :type flush: bool
+        """
+        if flush:
+            self.flush()
+        with self.flush_lock:
+            self.cancel_flush()
+            if self.auto_flush_kgk_manager is not None:
+                atexit.unregister(self.flush)
+            self.auto_flush_kgk_manager = None
+
+    def schedule_flush(self):
+        """
+        Starts the timer for the auto flush again.
+        """
+        self.cancel_flush()
+        self.flush_timer = threading.Timer(self.auto_flush_delay, self.flush)
+        self.flush_timer.daemon = True
+        self.flush_timer.start()
+
+    def cancel_flush(self):
+        """
+        Stops the timer for the auto flush.
+        """
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+
+    def flush(self):
+        """
+        Stores and pushes pending changes with the kgk manager of the auto flush.
+        """
+        with self.flush_lock:
+            if self.batch_depth > 0 or self.auto_flush_kgk_manager is None:
+                return
+            self.cancel_flush()
+            if not self.pending_changes:
+                return
+            kgk_manager = self.auto_flush_kgk_manager
+        self.store_settings(kgk_manager)
 
     def get_domain_list(self):
         """
@@ -175,7 +690,21 @@ class PasswordSettingsManager(object):
         :return: a list of domain names
         :rtype: [str]
         """
-        return [setting.get_domain() for setting in self.settings]
+        return self.settings.get_domains()
+
+    def complete(self, prefix, limit=10):
+        """
+        Returns the saved domains which start with the prefix in alphabetical order. This takes logarithmic time
+        in the number of settings.
+
+        :param prefix: the beginning of the domains
+        :type prefix: str
+        :param limit: maximum number of domains (None for all)
+        :type limit: int
+        :return: domains
+        :rtype: [str]
+        """
+        return self.settings.complete(prefix, limit)
 
     def get_settings_as_dict(self):
         """
@@ -192,120 +721,272 @@ class PasswordSettingsManager(object):
                 settings_dict['synced'].append(setting.get_domain())
         return settings_dict
 
+    @staticmethod
+    def get_version(data):
+        """
+        Returns the version of data on the sync server. Deltas refer to it.
+
+        :param data: base64 data or delta
+        :type data: str or bytes
+        :return: version
+        :rtype: str
+        """
+        if type(data) == str:
+            data = data.encode('utf-8')
+        return sha256(data).hexdigest()
+
+    def get_dirty_domains(self):
+        """
+        Returns the domains of the settings which changed since the last successful sync.
+
+        :return: domains
+        :rtype: [str]
+        """
+        return [setting.get_domain() for setting in self.settings if not setting.is_synced()]
+
+    def get_tombstones(self, include_remote=True):
+        """
+        Returns tombstones for the settings which were deleted locally since the last sync. Tombstones from the
+        sync server and tombstones for settings on the sync server which are missing locally are added unless
+        include_remote is False.
+
+        :param include_remote: add the tombstones for the data on the sync server?
+        :type include_remote: bool
+        :return: tombstones by domain
+        :rtype: dict
+        """
+        tombstones = {}
+        if include_remote and self.remote_data:
+            for domain_name, data_set in self.remote_data.items():
+                if domain_name in self.settings:
+                    continue
+                if data_set.get('deleted', False):
+                    tombstones[domain_name] = data_set
+                else:
+                    tombstones[domain_name] = {
+                        'mDate': PasswordSetting.create_ISO_date(datetime.now()),
+                        'deleted': True
+                    }
+        for domain_name, deletion_date in self.deleted_domains.items():
+            if domain_name not in self.settings:
+                tombstones[domain_name] = {'mDate': deletion_date, 'deleted': True}
+        return tombstones
+
+    def encrypt_export_data(self, kgk_manager, data):
+        """
+        Compresses and encrypts data for the sync server.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :param data: JSON serializable data
+        :type data: dict
+        :return: encrypted blob
+        :rtype: str
+        """
+        kgk_block = kgk_manager.get_fresh_encrypted_kgk()
+        settings_crypter = self.get_settings_crypter(kgk_manager)
+        compressed_settings = Packer.compress(json.dumps(data), self.compression_level,
+                                              self.compression_strategy, self.compression_dictionary,
+                                              self.compression_codec)
+        if self.format_version == 2:
+            header = b'\x02' + kgk_manager.get_kgk_crypter_salt() + kgk_block
+            return b64encode(header + settings_crypter.encrypt_authenticated(compressed_settings, header))
+        return b64encode(b'\x01' + kgk_manager.get_kgk_crypter_salt() + kgk_block +
+                         settings_crypter.encrypt(compressed_settings))
+
+    def decrypt_export_data(self, kgk_manager, blob):
+        """
+        Decrypts and decompresses data from the sync server.
+
+        :param kgk_manager: the kgk manager used for the decryption
+        :type kgk_manager: KgkManager
+        :param blob: the export data
+        :type blob: bytes
+        :return: the data or None if the password is wrong
+        :rtype: dict
+        """
+        settings_crypter = self.get_settings_crypter(kgk_manager)
+        blob = memoryview(blob)
+        if blob[0] == 2:
+            decrypted_settings = PasswordSettingsManager.decrypt_to_buffer(settings_crypter, blob[145:],
+                                                                           True, blob[:145])
+        else:
+            decrypted_settings = PasswordSettingsManager.decrypt_to_buffer(settings_crypter, blob[145:])
+        del blob
+        if len(decrypted_settings) <= 0:
+            return None
+        decompressed_settings = Packer.decompress(decrypted_settings, self.max_uncompressed_length)
+        del decrypted_settings
+        return PasswordSettingsManager.parse_json(decompressed_settings)
+
     def get_export_data(self, kgk_manager):
         """
-        This gives you a base64 encoded string of encrypted settings data (the blob).
+        This gives you a base64 encoded string of encrypted settings data (the blob). It contains all settings and
+        tombstones for deleted settings.
 
         :param kgk_manager: kgk manager
         :type kgk_manager: KgkManager
         :return: encrypted settings blob
         :rtype: str
         """
-        kgk_block = kgk_manager.get_fresh_encrypted_kgk()
         settings_list = self.get_settings_as_dict()['settings']
-        if self.remote_data:
-            for domain_name in self.remote_data.keys():
-                data_set = self.remote_data[domain_name]
-                if 'deleted' in data_set and data_set['deleted']:
-                    for i, setting_dict in enumerate(settings_list):
-                        if setting_dict['domain'] == setting_dict['domain'] and \
-                                PasswordSetting.convert_ISO_date(data_set['mDate']) > \
-                                PasswordSetting.convert_ISO_date(setting_dict['mDate']):
-                            settings_list[i] = data_set
-                if domain_name not in settings_list.keys():
-                    settings_list[domain_name] = {
-                        'mDate': datetime.now(),
-                        'deleted': True
-                    }
-        settings_crypter = self.get_settings_crypter(kgk_manager)
-        return b64encode(b'\x01' + kgk_manager.get_kgk_crypter_salt() + kgk_block + settings_crypter.encrypt(
-            Packer.compress(json.dumps(settings_list))))
+        settings_list.update(self.get_tombstones())
+        return self.encrypt_export_data(kgk_manager, settings_list)
 
-    def update_from_export_data(self, kgk_manager, blob):
+    def get_delta_export_data(self, kgk_manager):
         """
-        Call this method to pull settings from the sync server.
+        Returns an encrypted delta with the settings which changed since the last sync and tombstones for the
+        deleted settings. It refers to the version of the data on the sync server. If that version is not known
+        there can be no delta and None is returned.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :return: encrypted delta or None
+        :rtype: str
+        """
+        if self.remote_version is None:
+            return None
+        settings_list = self.get_tombstones(False)
+        for domain_name in self.get_dirty_domains():
+            settings_list[domain_name] = self.settings.find(domain_name).to_dict()
+        return self.encrypt_export_data(kgk_manager, {'base': self.remote_version, 'settings': settings_list})
+
+    def update_from_export_data(self, kgk_manager, blob, local_kgk_manager=None):
+        """
+        Call this method to pull settings from the sync server. The changes are in last_merge afterwards. The
+        sync server needs an update if local settings are newer or missing on the server. The merged settings are
+        stored with the local kgk manager.
 
         :param kgk_manager: the kgk manager used for the decryption
         :type kgk_manager: KgkManager
         :param blob: the export data
         :type blob: bytes
+        :param local_kgk_manager: the kgk manager of the settings file (defaults to kgk_manager)
+        :type local_kgk_manager: KgkManager
         """
-        if not blob[0] == 1:
+        if blob[0] not in [1, 2]:
             print("Version error: Wrong data format. Could not import anything.")
             return True
-        settings_crypter = self.get_settings_crypter(kgk_manager)
-        decrypted_settings = settings_crypter.decrypt(blob[145:])
-        if len(decrypted_settings) <= 0:
+        remote_data = self.decrypt_export_data(kgk_manager, blob)
+        if remote_data is None:
             print("Wrong password.")
             return False
-        self.remote_data = json.loads(str(Packer.decompress(decrypted_settings), encoding='utf-8'))
-        self.update_remote = False
-        for domain_name in self.remote_data.keys():
-            data_set = self.remote_data[domain_name]
-            found = False
-            i = 0
-            while i < len(self.settings):
-                setting = self.settings[i]
-                if setting.get_domain() == domain_name:
-                    found = True
-                    if 'mDate' in data_set:
-                        last_modification_date = data_set['mDate']
-                    else:
-                        last_modification_date = data_set['cDate']
-                    if PasswordSetting.convert_ISO_date(last_modification_date) > setting.get_m_date():
-                        if 'deleted' in data_set and data_set['deleted']:
-                            self.settings.pop(i)
-                        else:
-                            setting.load_from_dict(data_set)
-                            setting.set_synced(True)
-                            self.update_remote = True
-                            i += 1
-                    else:
-                        i += 1
-                else:
-                    i += 1
-            if not found:
-                new_setting = PasswordSetting(domain_name)
-                new_setting.load_from_dict(data_set)
-                new_setting.set_synced(True)
-                self.settings.append(new_setting)
-        for setting in self.settings:
-            found = False
-            for domain_name in self.remote_data.keys():
-                data_set = self.remote_data[domain_name]
-                if setting.get_domain() == domain_name:
-                    found = True
-                    if 'mDate' in data_set:
-                        last_modification_date = data_set['mDate']
-                    else:
-                        last_modification_date = data_set['cDate']
-                    if setting.get_m_date() >= PasswordSetting.convert_ISO_date(last_modification_date):
-                        self.update_remote = True
-            if not found:
-                self.update_remote = True
-        self.store_local_settings(kgk_manager)
+        self.remote_data = remote_data
+        self.last_merge = self.merge_data_sets(self.remote_data)
+        self.update_remote = self.last_merge.has_local_changes()
+        if local_kgk_manager is None:
+            local_kgk_manager = kgk_manager
+        self.store_local_settings(local_kgk_manager)
         return self.update_remote
 
+    def update_from_delta_data(self, kgk_manager, password, blob):
+        """
+        Merges a delta which another client pushed to the sync server. The settings are not stored.
+
+        :param kgk_manager: the kgk manager of the pulled data
+        :type kgk_manager: KgkManager
+        :param password: the masterpassword
+        :type password: str
+        :param blob: the delta
+        :type blob: bytes
+        :return: the changes
+        :rtype: MergeResult
+        """
+        if blob[0] not in [1, 2] or len(blob) < 145:
+            raise ValueError("Version error: Wrong data format. Could not import the delta.")
+        delta_kgk_manager = KgkManager(kgk_manager.key_cache)
+        if kgk_manager.kgk_crypter is not None and bytes(blob[1:33]) == kgk_manager.salt:
+            delta_kgk_manager.decrypt_kgk(blob[33:145], kgk_manager.kgk_crypter)
+        else:
+            delta_kgk_manager.update_from_blob(password.encode('utf-8'), blob)
+        if delta_kgk_manager.get_kgk() != kgk_manager.get_kgk():
+            raise ValueError("KGK mismatch! This are not your settings!")
+        delta = self.decrypt_export_data(delta_kgk_manager, blob)
+        if delta is None:
+            raise PermissionError("Wrong password: The delta could not be decrypted.")
+        if self.remote_data is None:
+            self.remote_data = {}
+        self.remote_data.update(delta['settings'])
+        merge_result = self.merge_data_sets(delta['settings'])
+        merge_result.local_only = []
+        return merge_result
+
     def store_settings(self, kgk_manager):
         """
-        Stores settings locally and remotely.
+        Stores settings locally and remotely. Inside a batch this only happens once at the end of the batch. The
+        push to the sync server does not block changes of the settings.
 
         :param kgk_manager: the kgk manager used for the encryption
         :type kgk_manager: KgkManager
         """
-        self.store_local_settings(kgk_manager)
+        with self.flush_lock:
+            if self.batch_depth > 0:
+                self.batch_kgk_manager = kgk_manager
+                self.pending_changes = True
+                return
+            self.cancel_flush()
+            self.store_local_settings(kgk_manager)
         self.update_sync_server_if_necessary(kgk_manager)
 
     def update_sync_server_if_necessary(self, kgk_manager):
         """
-        Checks if the sync server needs to be updated. If necessary it does a push.
+        Checks if the sync server needs to be updated. If necessary it pushes a delta with the changed settings.
+        If there is no delta or the server does not accept it all settings are pushed. The data is exported with
+        the flush_lock but the request is sent without it. Settings which are changed during the request stay
+        unsynced.
 
         :param kgk_manager: the kgk manager used for the encryption
         :type kgk_manager: KgkManager
         """
-        if self.update_remote:
-            if self.sync_manager.push(self.get_export_data(kgk_manager)):
-                self.set_all_settings_to_synced()
+        with self.push_lock:
+            with self.flush_lock:
+                if not self.update_remote:
+                    return
+                delta = None
+                if self.sync_manager.supports_delta():
+                    delta = self.get_delta_export_data(kgk_manager)
+                base_version = self.remote_version
+                self.changed_during_push = set()
+            try:
+                pushed_data = None
+                if delta is not None and self.sync_manager.push_delta(base_version, delta):
+                    pushed_data = delta
+                else:
+                    with self.flush_lock:
+                        data = self.get_export_data(kgk_manager)
+                        self.changed_during_push = set()
+                    if self.sync_manager.push(data):
+                        pushed_data = data
+                with self.flush_lock:
+                    if pushed_data is not None:
+                        self.acknowledge_push(pushed_data, self.changed_during_push)
+            finally:
+                with self.flush_lock:
+                    self.changed_during_push = None
+
+    def acknowledge_push(self, data, changed_domains=()):
+        """
+        Marks all settings as synced after the sync server accepted data or a delta. The tombstones of the local
+        deletions are on the server now. Settings and deletions of domains which were changed after the data was
+        exported stay unsynced.
+
+        :param data: the pushed data or delta
+        :type data: str or bytes
+        :param changed_domains: domains which were changed after the export
+        :type changed_domains: set
+        """
+        if self.remote_data is None:
+            self.remote_data = {}
+        tombstones = self.get_tombstones(False)
+        self.remote_data.update({domain: tombstones[domain] for domain in tombstones
+                                 if domain not in changed_domains})
+        self.deleted_domains = {domain: self.deleted_domains[domain] for domain in self.deleted_domains
+                                if domain in changed_domains}
+        for setting in self.settings:
+            if setting.get_domain() not in changed_domains:
+                setting.set_synced(True)
+        self.remote_version = PasswordSettingsManager.get_version(data)
+        self.update_remote = len(changed_domains) > 0
 
     def set_all_settings_to_synced(self):
         """
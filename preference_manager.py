@@ -3,30 +3,304 @@
 """
 The preference manager handles the access to the settings file.
 """
+from contextlib import contextmanager
+import tempfile
+import mmap
 import os
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    # noinspection PyUnresolvedReferences
+    import win32con
+    # noinspection PyUnresolvedReferences
+    import win32api
+except ImportError:
+    win32con = None
+    win32api = None
 
 PASSWORD_SETTINGS_FILE = os.path.expanduser('~/.config/ct/ctSESAM.pws')
+SALT, KGK_BLOCK, SETTINGS_DATA = range(3)
+SEGMENT_BOUNDS = [(0, 32), (32, 144), (144, None)]
 
 
 class PreferenceManager(object):
     """
+    Handles the three segments of the settings file: salt (bytes 0 to 31), kgk block (bytes 32 to 143) and
+    settings data (from byte 144). Every store method rewrites the whole file atomically: the segments are written
+    to a temporary file in the same directory, synced to the disk and renamed over the settings file. So a crash
+    leaves either the old or the new file. Nothing is written if no segment changed.
+
+    Group several store calls with transaction to write the file only once.
 
+    Normally the file is read completely when the manager is created. With lazy=True the file is memory-mapped on
+    the first access instead, so tools which only need the salt or the kgk block do not read the settings. The
+    get_*_view methods return memoryviews without copying in both modes. Stored segments replace only their own
+    part, the rest of the file is never copied in memory.
+
+    Processes coordinate with an advisory lock on a lock file next to the settings file (only where fcntl exists).
+    Writes and transactions hold the lock. The manager remembers mtime, size and inode of the file it read or
+    wrote last so has_changed tells if another process wrote the file in the meantime.
 
     :param settings_file: Filename of the settings file. Defaults to PASSWORD_SETTINGS_FILE as defined in the source
     :type settings_file: str
+    :param lazy: map the file on the first access instead of reading it now?
+    :type lazy: bool
     """
-    def __init__(self, settings_file=PASSWORD_SETTINGS_FILE):
-        self.data = b''
+    def __init__(self, settings_file=PASSWORD_SETTINGS_FILE, lazy=False):
         self.settings_file = settings_file
+        self.lazy = lazy
+        self.segments = [b'', b'', b'']
+        self.file_loaded = False
+        self.mapping = None
+        self.changed = False
+        self.transaction_depth = 0
+        self.transaction_state = None
+        self.lock_file = None
+        self.lock_depth = 0
+        self.file_state = None
         self.read_file()
 
     def read_file(self):
         """
-        Read the settings file.
+        Read the settings file. In lazy mode the file is mapped on the next access.
+        """
+        self.close()
+        self.segments = [None, None, None]
+        self.changed = False
+        self.file_loaded = False
+        self.file_state = self.get_file_state()
+        if not self.lazy:
+            self.load_file()
+
+    def get_file_state(self):
+        """
+        Returns mtime, size and inode of the settings file or None if it does not exist.
+
+        :return: the state of the file
+        :rtype: tuple
+        """
+        try:
+            stat = os.stat(self.settings_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def has_changed(self):
+        """
+        Returns True if the settings file was changed since it was read or written by this manager.
+
+        :return: was the file changed?
+        :rtype: bool
+        """
+        return self.get_file_state() != self.file_state
+
+    def reload_if_changed(self):
+        """
+        Reads the settings file again if another process changed it. Unsaved changes are discarded.
+
+        :return: was the file read again?
+        :rtype: bool
         """
+        if not self.has_changed():
+            return False
+        self.read_file()
+        return True
+
+    @contextmanager
+    def lock(self):
+        """
+        Context manager which holds an exclusive advisory lock on the settings file. The lock is reentrant. On
+        systems without fcntl this does nothing.
+        """
+        if fcntl is None:
+            yield self
+            return
+        if self.lock_depth == 0:
+            directory = os.path.dirname(self.settings_file)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            lock_file = open(os.open(self.settings_file + '.lock', os.O_RDWR | os.O_CREAT, 0o600), 'rb+')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                lock_file.close()
+                raise
+            self.lock_file = lock_file
+        self.lock_depth += 1
+        try:
+            yield self
+        finally:
+            self.lock_depth -= 1
+            if self.lock_depth == 0:
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+                self.lock_file.close()
+                self.lock_file = None
+
+    def load_file(self):
+        """
+        Reads or maps the settings file if that was not done yet.
+        """
+        if self.file_loaded:
+            return
+        self.file_loaded = True
+        content = b''
         if os.path.isfile(self.settings_file):
             with open(self.settings_file, 'rb') as f:
-                self.data = f.read()
+                if self.lazy:
+                    try:
+                        self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        content = self.mapping
+                    except ValueError:
+                        pass
+                else:
+                    content = f.read()
+        content = memoryview(content)
+        for i, (start, end) in enumerate(SEGMENT_BOUNDS):
+            if self.segments[i] is None:
+                self.segments[i] = content[start:end]
+
+    def close(self):
+        """
+        Releases the memory map. Segments from the map are mapped again on the next access. The mapping stays open
+        as long as views returned by the get_*_view methods exist.
+        """
+        if self.mapping is None:
+            return
+        for i in range(len(self.segments)):
+            if type(self.segments[i]) == memoryview and self.segments[i].obj is self.mapping:
+                self.segments[i].release()
+                self.segments[i] = None
+        self.file_loaded = False
+        try:
+            self.mapping.close()
+        except BufferError:
+            pass
+        self.mapping = None
+
+    def get_segment(self, index):
+        """
+        Returns a segment of the file without copying it.
+
+        :param index: SALT, KGK_BLOCK or SETTINGS_DATA
+        :type index: int
+        :return: the segment
+        :rtype: memoryview
+        """
+        if self.segments[index] is None:
+            self.load_file()
+        return memoryview(self.segments[index])
+
+    def store_segment(self, index, data):
+        """
+        Replaces a segment and writes the file if the segment changed.
+
+        :param index: SALT, KGK_BLOCK or SETTINGS_DATA
+        :type index: int
+        :param data: the new content
+        :type data: bytes
+        """
+        if self.segments[index] is not None and self.segments[index] == data:
+            return
+        self.segments[index] = data
+        self.changed = True
+        self.write_file()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager which collects all changes and writes the file once at the end. Transactions may be
+        nested. The outermost transaction writes. If an exception is raised nothing is written and the data is
+        restored. The lock is held during the transaction.
+        """
+        with self.lock():
+            if self.transaction_depth == 0:
+                self.transaction_state = (list(self.segments), self.changed)
+            self.transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.transaction_depth -= 1
+                if self.transaction_depth == 0:
+                    self.segments, self.changed = self.transaction_state
+                    self.transaction_state = None
+                raise
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.transaction_state = None
+                self.write_file()
+
+    def get_file_segments(self):
+        """
+        Returns the segments as they are written to the file. Missing header bytes are padded with zeros.
+
+        :return: salt, kgk block and settings data
+        :rtype: [bytes-like]
+        """
+        segments = [self.get_segment(i) for i in range(len(SEGMENT_BOUNDS))]
+        for i, (start, end) in enumerate(SEGMENT_BOUNDS[:-1]):
+            if len(segments[i]) < end - start and any(len(segment) > 0 for segment in segments[i + 1:]):
+                segments[i] = bytes(segments[i]).ljust(end - start, b'\x00')
+        return segments
+
+    def write_file(self):
+        """
+        Writes the segments atomically to the settings file unless a transaction is open or nothing changed.
+        """
+        if self.transaction_depth > 0 or not self.changed:
+            return
+        with self.lock():
+            self.write_segments()
+
+    def write_segments(self):
+        """
+        Writes the segments to a temporary file and renames it over the settings file.
+        """
+        directory = os.path.dirname(self.settings_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        segments = self.get_file_segments()
+        handle, temporary_file = tempfile.mkstemp(prefix='.' + os.path.basename(self.settings_file) + '.',
+                                                  suffix='.tmp', dir=directory or None)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                for segment in segments:
+                    f.write(segment)
+                f.flush()
+                os.fsync(f.fileno())
+            del segments
+            self.close()
+            os.replace(temporary_file, self.settings_file)
+        except BaseException:
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
+            raise
+        self.sync_directory(directory)
+        self.changed = False
+        self.file_state = self.get_file_state()
+        self.set_hidden()
+
+    @staticmethod
+    def sync_directory(directory):
+        """
+        Syncs the directory entry of a renamed file to the disk. This is not possible on all platforms.
+
+        :param directory: the directory
+        :type directory: str
+        """
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        try:
+            handle = os.open(directory or '.', os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return
+        try:
+            os.fsync(handle)
+        except OSError:
+            pass
+        finally:
+            os.close(handle)
 
     def get_salt(self):
         """
@@ -35,7 +309,16 @@ class PreferenceManager(object):
         :return: the salt
         :rtype: bytes
         """
-        return self.data[:32]
+        return bytes(self.get_segment(SALT))
+
+    def get_salt_view(self):
+        """
+        Returns the salt without copying it.
+
+        :return: the salt
+        :rtype: memoryview
+        """
+        return self.get_segment(SALT)
 
     def store_salt(self, salt):
         """
@@ -48,17 +331,7 @@ class PreferenceManager(object):
             raise TypeError("The salt must be bytes.")
         if len(salt) != 32:
             raise ValueError("The salt has to be 32 bytes.")
-        if os.path.isfile(self.settings_file):
-            with open(self.settings_file, 'rb+') as f:
-                f.seek(0)
-                f.write(salt)
-        else:
-            if not os.path.exists(os.path.dirname(self.settings_file)):
-                os.makedirs(os.path.dirname(self.settings_file))
-            with open(self.settings_file, 'wb') as f:
-                f.write(salt)
-        self.data = salt + self.data[32:]
-        self.set_hidden()
+        self.store_segment(SALT, salt)
 
     def get_kgk_block(self):
         """
@@ -67,7 +340,16 @@ class PreferenceManager(object):
         :return: 112 bytes of kgk data
         :rtype: bytes
         """
-        return self.data[32:144]
+        return bytes(self.get_segment(KGK_BLOCK))
+
+    def get_kgk_block_view(self):
+        """
+        Returns the kgk_block without copying it.
+
+        :return: 112 bytes of kgk data
+        :rtype: memoryview
+        """
+        return self.get_segment(KGK_BLOCK)
 
     def store_kgk_block(self, kgk_block):
         """
@@ -80,18 +362,7 @@ class PreferenceManager(object):
             raise TypeError("The kgk_block must be bytes.")
         if len(kgk_block) != 112:
             raise ValueError("The kgk_block has to be 112 bytes.")
-        if os.path.isfile(self.settings_file):
-            with open(self.settings_file, 'rb+') as f:
-                f.seek(32)
-                f.write(kgk_block)
-        else:
-            if not os.path.exists(os.path.dirname(self.settings_file)):
-                os.makedirs(os.path.dirname(self.settings_file))
-            with open(self.settings_file, 'wb') as f:
-                f.write(b'\x00'*32)
-                f.write(kgk_block)
-        self.data = self.data[:32] + kgk_block + self.data[144:]
-        self.set_hidden()
+        self.store_segment(KGK_BLOCK, kgk_block)
 
     def get_settings_data(self):
         """
@@ -100,7 +371,16 @@ class PreferenceManager(object):
         :return: encrypted settings
         :rtype: bytes
         """
-        return self.data[144:]
+        return bytes(self.get_segment(SETTINGS_DATA))
+
+    def get_settings_data_view(self):
+        """
+        Returns the settings data without copying it.
+
+        :return: encrypted settings
+        :rtype: memoryview
+        """
+        return self.get_segment(SETTINGS_DATA)
 
     def store_settings_data(self, settings_data):
         """
@@ -110,29 +390,12 @@ class PreferenceManager(object):
         :type settings_data: bytes
         """
         if type(settings_data) != bytes:
-            raise TypeError("The kgk_block must be bytes.")
-        if os.path.isfile(self.settings_file):
-            with open(self.settings_file, 'rb+') as f:
-                f.seek(144)
-                f.write(settings_data)
-                f.truncate()
-        else:
-            if not os.path.exists(os.path.dirname(self.settings_file)):
-                os.makedirs(os.path.dirname(self.settings_file))
-            with open(self.settings_file, 'wb') as f:
-                f.write(b'\x00'*144)
-                f.write(settings_data)
-        self.data = self.data[:144] + settings_data
-        self.set_hidden()
+            raise TypeError("The settings data must be bytes.")
+        self.store_segment(SETTINGS_DATA, settings_data)
 
-    # noinspection PyUnresolvedReferences
     def set_hidden(self):
         """
         Hides the settings file if possible.
         """
-        try:
-            import win32con
-            import win32api
+        if win32api is not None:
             win32api.SetFileAttributes(self.settings_file, win32con.FILE_ATTRIBUTE_HIDDEN)
-        except ImportError:
-            pass
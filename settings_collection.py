@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+An ordered collection of PasswordSetting objects with constant time access by domain.
+"""
+
+from collections import OrderedDict
+from domain_index import DomainIndex
+
+
+class SettingsCollection(object):
+    """
+    Holds the settings in insertion order like a list but finds, replaces and removes them by their domain in
+    constant time. Iterating yields the PasswordSetting objects. A replaced setting moves to the end like it did
+    in the list of the PasswordSettingsManager. A DomainIndex of the domains is kept up to date for completions.
+
+    :param settings: initial settings
+    :type settings: [PasswordSetting]
+    """
+    def __init__(self, settings=()):
+        self.settings = OrderedDict()
+        self.index = DomainIndex()
+        for setting in settings:
+            self.add(setting)
+
+    def __iter__(self):
+        return iter(list(self.settings.values()))
+
+    def __len__(self):
+        return len(self.settings)
+
+    def __contains__(self, domain):
+        return domain in self.settings
+
+    def find(self, domain):
+        """
+        Returns the setting for the domain or None. This has no side effects.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the setting or None
+        :rtype: PasswordSetting
+        """
+        return self.settings.get(domain)
+
+    def add(self, setting):
+        """
+        Adds the setting at the end. A setting with the same domain is replaced.
+
+        :param setting: the setting
+        :type setting: PasswordSetting
+        """
+        if self.settings.pop(setting.get_domain(), None) is None:
+            self.index.add(setting.get_domain())
+        self.settings[setting.get_domain()] = setting
+
+    def remove(self, domain):
+        """
+        Removes the setting for the domain.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the removed setting or None if there was none
+        :rtype: PasswordSetting
+        """
+        setting = self.settings.pop(domain, None)
+        if setting is not None:
+            self.index.remove(domain)
+        return setting
+
+    def get_domains(self):
+        """
+        Returns the domains in the order of the settings.
+
+        :return: domains
+        :rtype: [str]
+        """
+        return list(self.settings.keys())
+
+    def complete(self, prefix, limit=None):
+        """
+        Returns the domains which start with the prefix in alphabetical order.
+
+        :param prefix: the beginning of the domains
+        :type prefix: str
+        :param limit: maximum number of domains (None for all)
+        :type limit: int
+        :return: domains
+        :rtype: [str]
+        """
+        return self.index.complete(prefix, limit)
+
+    def clear(self):
+        """
+        Removes all settings.
+        """
+        self.settings.clear()
+        self.index.clear()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Merges settings from the settings file or the sync server into a SettingsCollection.
+"""
+
+from password_setting import PasswordSetting
+
+
+class MergeResult(object):
+    """
+    The domains which a merge added, updated or deleted, the domains where the local setting is newer than the
+    merged one (kept) and the domains which are missing in the merged data (local_only).
+    """
+    def __init__(self):
+        self.added = []
+        self.updated = []
+        self.deleted = []
+        self.kept = []
+        self.local_only = []
+
+    def has_changes(self):
+        """
+        Did the merge change the settings?
+
+        :return: changes?
+        :rtype: bool
+        """
+        return len(self.added) > 0 or len(self.updated) > 0 or len(self.deleted) > 0
+
+    def has_local_changes(self):
+        """
+        Are there local settings which are newer than the merged data or missing in it?
+
+        :return: local changes?
+        :rtype: bool
+        """
+        return len(self.kept) > 0 or len(self.local_only) > 0
+
+
+class SettingsMerger(object):
+    """
+    Joins the settings with a dict of setting dicts on the domain. Every setting and every data set is visited once
+    and the date of every data set is parsed once so the merge takes linear time.
+    """
+    @staticmethod
+    def get_modification_date(data_set):
+        """
+        Returns the modification date of a setting dict. Settings which were never modified only have a creation
+        date.
+
+        :param data_set: a setting dict or a tombstone
+        :type data_set: dict
+        :return: the modification date
+        :rtype: datetime
+        """
+        if 'mDate' in data_set:
+            return PasswordSetting.convert_ISO_date(data_set['mDate'])
+        return PasswordSetting.convert_ISO_date(data_set['cDate'])
+
+    @staticmethod
+    def merge(settings, data_sets, synced_domains=None, deleted_domains=None):
+        """
+        Merges the data sets into the settings. Newer data sets replace the settings. Newer tombstones (data sets
+        with 'deleted': True) delete them. Tombstones for unknown domains are skipped. Data sets for domains which
+        were deleted locally are only added if they are newer than the deletion. Otherwise they are reported as
+        kept.
+
+        :param settings: the settings
+        :type settings: SettingsCollection
+        :param data_sets: setting dicts by domain
+        :type data_sets: dict
+        :param synced_domains: domains which are marked as synced after the merge. None marks all merged settings
+                               as synced.
+        :type synced_domains: set
+        :param deleted_domains: deletion dates (ISO format) of locally deleted domains by domain
+        :type deleted_domains: dict
+        :return: the diff
+        :rtype: MergeResult
+        """
+        result = MergeResult()
+        for domain, data_set in data_sets.items():
+            deleted = data_set.get('deleted', False)
+            setting = settings.find(domain)
+            if setting is None:
+                if deleted:
+                    continue
+                if deleted_domains is not None and domain in deleted_domains and \
+                        SettingsMerger.get_modification_date(data_set) <= \
+                        PasswordSetting.convert_ISO_date(deleted_domains[domain]):
+                    result.kept.append(domain)
+                    continue
+                setting = PasswordSetting(domain)
+                setting.load_from_dict(data_set)
+                settings.add(setting)
+                result.added.append(domain)
+            else:
+                modification_date = SettingsMerger.get_modification_date(data_set)
+                if modification_date < setting.get_m_date():
+                    result.kept.append(domain)
+                    continue
+                if modification_date == setting.get_m_date():
+                    continue
+                if deleted:
+                    settings.remove(domain)
+                    result.deleted.append(domain)
+                    continue
+                setting.load_from_dict(data_set)
+                result.updated.append(domain)
+            setting.set_synced(synced_domains is None or domain in synced_domains)
+        result.local_only = [domain for domain in settings.get_domains() if domain not in data_sets]
+        return result
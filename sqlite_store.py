@@ -0,0 +1,424 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+A settings store in a SQLite database which encrypts every setting on its own.
+"""
+
+from contextlib import contextmanager
+from password_setting import PasswordSetting
+from crypter import Crypter
+import sqlite3
+import hmac
+import json
+import os
+
+SQLITE_SETTINGS_FILE = os.path.expanduser('~/.config/ct/ctSESAM.sqlite')
+
+
+class SqliteSettingsStore(object):
+    """
+    Stores the settings in a SQLite database with one row per setting. Every row is encrypted with AES-GCM under
+    the settings key and a fresh iv. The rows are indexed by an HMAC of the domain so a lookup reads and decrypts
+    a single row and a save writes a single row. Nobody without the kgk learns the domains from the index.
+
+    The store also keeps salt and kgk block like the settings file does so a KgkManager can use it instead of a
+    PreferenceManager. The settings key is derived from the kgk and a salt of the store with unlock.
+
+    The store offers the lookup methods of the PasswordSettingsManager (find_setting, get_setting, has_setting,
+    complete, get_domain_list and hash_cache) so the command line tool and the GeneratorDaemon run on it. Changes
+    are written at once with set_setting and delete_setting. Journal, batches and synchronisation need a settings
+    file, move the settings with import_settings and export_settings for them.
+
+    The connection may be used by other threads than the one which opened it. Callers have to serialize the
+    access like the GeneratorDaemon does.
+
+    :param database_file: path of the database (':memory:' for a temporary store)
+    :type database_file: str
+    """
+    def __init__(self, database_file=SQLITE_SETTINGS_FILE):
+        self.database_file = database_file
+        directory = os.path.dirname(database_file)
+        if database_file != ':memory:' and directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(database_file, isolation_level=None, check_same_thread=False)
+        self.transaction_depth = 0
+        self.settings_key = None
+        self.index_key = None
+        self.hash_cache = None
+        with self.transaction():
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS settings " +
+                                    "(domain_hash BLOB PRIMARY KEY, iv BLOB NOT NULL, data BLOB NOT NULL)")
+
+    def close(self):
+        """
+        Closes the database and forgets the keys.
+        """
+        self.lock_store()
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager for a database transaction. Transactions may be nested. The outermost transaction commits
+        or rolls back.
+        """
+        if self.transaction_depth == 0:
+            self.connection.execute("BEGIN IMMEDIATE")
+        self.transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.connection.rollback()
+            raise
+        self.transaction_depth -= 1
+        if self.transaction_depth == 0:
+            self.connection.commit()
+
+    def lock(self):
+        """
+        Same as transaction. SQLite locks the database for the duration of a write transaction.
+        """
+        return self.transaction()
+
+    def get_meta(self, name):
+        """
+        Reads a value from the meta table.
+
+        :param name: name of the value
+        :type name: str
+        :return: the value or b'' if it was never stored
+        :rtype: bytes
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return bytes(row[0]) if row else b''
+
+    def set_meta(self, name, value):
+        """
+        Writes a value to the meta table.
+
+        :param name: name of the value
+        :type name: str
+        :param value: the value
+        :type value: bytes
+        """
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def get_salt(self):
+        """
+        Reads the salt for the kgk block.
+
+        :return: the salt
+        :rtype: bytes
+        """
+        return self.get_meta('salt')
+
+    def store_salt(self, salt):
+        """
+        Stores the salt for the kgk block.
+
+        :param salt: 32 bytes salt
+        :type salt: bytes
+        """
+        if type(salt) != bytes:
+            raise TypeError("The salt must be bytes.")
+        if len(salt) != 32:
+            raise ValueError("The salt has to be 32 bytes.")
+        self.set_meta('salt', salt)
+
+    def get_kgk_block(self):
+        """
+        Reads the kgk_block.
+
+        :return: 112 bytes of kgk data
+        :rtype: bytes
+        """
+        return self.get_meta('kgk_block')
+
+    def store_kgk_block(self, kgk_block):
+        """
+        Stores the kgk_block.
+
+        :param kgk_block: encrypted kgk data
+        :type kgk_block: bytes
+        """
+        if type(kgk_block) != bytes:
+            raise TypeError("The kgk_block must be bytes.")
+        if len(kgk_block) != 112:
+            raise ValueError("The kgk_block has to be 112 bytes.")
+        self.set_meta('kgk_block', kgk_block)
+
+    def unlock(self, kgk_manager):
+        """
+        Derives the settings key and the key for the domain index from the kgk. A wrong kgk is detected with the
+        key check value of the store. This is the only key derivation, it does not depend on the number of
+        settings.
+
+        :param kgk_manager: a kgk manager with a decrypted kgk
+        :type kgk_manager: KgkManager
+        """
+        with self.transaction():
+            settings_salt = self.get_meta('settings_salt')
+            if len(settings_salt) != 32:
+                settings_salt = Crypter.createSalt()
+                self.set_meta('settings_salt', settings_salt)
+            settings_key = Crypter.create_key(kgk_manager.get_kgk(), settings_salt)
+            key_check_value = Crypter(settings_key + bytes(16)).get_key_check_value()
+            stored_key_check_value = self.get_meta('key_check_value')
+            if not stored_key_check_value:
+                self.set_meta('key_check_value', key_check_value)
+            elif not hmac.compare_digest(stored_key_check_value, key_check_value):
+                raise PermissionError("The kgk does not fit to this settings store.")
+        self.settings_key = settings_key
+        self.index_key = hmac.new(settings_key, b'ctSESAM domain index', 'sha256').digest()
+
+    def lock_store(self):
+        """
+        Forgets the keys.
+        """
+        self.settings_key = None
+        self.index_key = None
+
+    def get_domain_hash(self, domain):
+        """
+        Returns the index key of a domain.
+
+        :param domain: the domain
+        :type domain: str
+        :return: HMAC of the domain
+        :rtype: bytes
+        """
+        if self.index_key is None:
+            raise PermissionError("Unlock the settings store first.")
+        return hmac.new(self.index_key, domain.encode('utf-8'), 'sha256').digest()
+
+    def encrypt_record(self, domain_hash, record):
+        """
+        Encrypts a record with a fresh iv. The domain hash is authenticated so a row can not be moved to another
+        domain.
+
+        :param domain_hash: index key of the domain
+        :type domain_hash: bytes
+        :param record: the setting dict and the synced flag
+        :type record: dict
+        :return: iv and encrypted record
+        :rtype: (bytes, bytes)
+        """
+        iv = Crypter.createIv()
+        return iv, Crypter(self.settings_key + iv).encrypt_authenticated(json.dumps(record).encode('utf-8'),
+                                                                          domain_hash)
+
+    def decrypt_record(self, domain_hash, iv, data):
+        """
+        Decrypts a row. A ValueError is raised if the row was modified or belongs to another domain.
+
+        :param domain_hash: index key of the domain
+        :type domain_hash: bytes
+        :param iv: the iv of the row
+        :type iv: bytes
+        :param data: the encrypted record
+        :type data: bytes
+        :return: the record
+        :rtype: dict
+        """
+        record = Crypter(self.settings_key + bytes(iv)).decrypt_authenticated(bytes(data), bytes(domain_hash))
+        return json.loads(str(record, encoding='utf-8'))
+
+    @staticmethod
+    def create_setting(record):
+        """
+        Creates a setting from a decrypted record.
+
+        :param record: the setting dict and the synced flag
+        :type record: dict
+        :return: the setting
+        :rtype: PasswordSetting
+        """
+        setting = PasswordSetting(record['setting']['domain'])
+        setting.load_from_dict(record['setting'])
+        setting.set_synced(record.get('synced', False))
+        return setting
+
+    def find_setting(self, domain):
+        """
+        Returns the setting for the domain or None. Only one row is read and decrypted.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the setting or None
+        :rtype: PasswordSetting
+        """
+        domain_hash = self.get_domain_hash(domain)
+        row = self.connection.execute("SELECT iv, data FROM settings WHERE domain_hash = ?",
+                                      (domain_hash,)).fetchone()
+        if row is None:
+            return None
+        return SqliteSettingsStore.create_setting(self.decrypt_record(domain_hash, row[0], row[1]))
+
+    def get_setting(self, domain):
+        """
+        Always returns a setting. If no setting was stored for the domain a new PasswordSetting is returned. It is
+        stored with set_setting.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the setting
+        :rtype: PasswordSetting
+        """
+        setting = self.find_setting(domain)
+        if setting is None:
+            setting = PasswordSetting(domain)
+        return setting
+
+    def has_setting(self, domain):
+        """
+        Checks if there is a setting for the domain. Only the index is read.
+
+        :param domain: the domain
+        :type domain: str
+        :return: is there a setting?
+        :rtype: bool
+        """
+        return self.connection.execute("SELECT 1 FROM settings WHERE domain_hash = ?",
+                                       (self.get_domain_hash(domain),)).fetchone() is not None
+
+    def set_setting(self, setting):
+        """
+        Encrypts and stores a single setting.
+
+        :param setting: the setting
+        :type setting: PasswordSetting
+        """
+        domain_hash = self.get_domain_hash(setting.get_domain())
+        iv, data = self.encrypt_record(domain_hash, {'setting': setting.to_dict(), 'synced': setting.is_synced()})
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO settings (domain_hash, iv, data) VALUES (?, ?, ?)",
+                                    (domain_hash, iv, data))
+
+    def delete_setting(self, domain):
+        """
+        Deletes the setting of a domain.
+
+        :param domain: the domain
+        :type domain: str
+        :return: was there a setting?
+        :rtype: bool
+        """
+        with self.transaction():
+            cursor = self.connection.execute("DELETE FROM settings WHERE domain_hash = ?",
+                                             (self.get_domain_hash(domain),))
+        return cursor.rowcount > 0
+
+    def get_setting_count(self):
+        """
+        Returns the number of settings without decrypting them.
+
+        :return: number of settings
+        :rtype: int
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM settings").fetchone()[0]
+
+    def iterate_settings(self):
+        """
+        Decrypts all settings one by one.
+
+        :return: generator of settings
+        """
+        for domain_hash, iv, data in self.connection.execute("SELECT domain_hash, iv, data FROM settings"):
+            yield SqliteSettingsStore.create_setting(self.decrypt_record(domain_hash, iv, data))
+
+    def get_domain_list(self):
+        """
+        Returns the domains of all settings. This decrypts all settings.
+
+        :return: domains
+        :rtype: [str]
+        """
+        return [setting.get_domain() for setting in self.iterate_settings()]
+
+    def complete(self, prefix, limit=10):
+        """
+        Returns the saved domains which start with the prefix in alphabetical order. The index only contains
+        hashes so this decrypts all settings.
+
+        :param prefix: the beginning of the domains
+        :type prefix: str
+        :param limit: maximum number of domains (None for all)
+        :type limit: int
+        :return: domains
+        :rtype: [str]
+        """
+        return sorted(domain for domain in self.get_domain_list() if domain.startswith(prefix))[:limit]
+
+    def get_sync_settings(self):
+        """
+        Returns the packed sync settings (see SyncManager.get_binary_sync_settings).
+
+        :return: packed sync settings
+        :rtype: bytes
+        """
+        if self.settings_key is None:
+            raise PermissionError("Unlock the settings store first.")
+        row = self.connection.execute("SELECT value FROM meta WHERE name = 'sync_settings'").fetchone()
+        if row is None:
+            return b''
+        iv = bytes(row[0][:16])
+        return Crypter(self.settings_key + iv).decrypt_authenticated(bytes(row[0][16:]), b'sync_settings')
+
+    def store_sync_settings(self, sync_settings):
+        """
+        Encrypts and stores packed sync settings.
+
+        :param sync_settings: packed sync settings
+        :type sync_settings: bytes
+        """
+        if self.settings_key is None:
+            raise PermissionError("Unlock the settings store first.")
+        iv = Crypter.createIv()
+        self.set_meta('sync_settings', iv + Crypter(self.settings_key + iv).encrypt_authenticated(
+            sync_settings, b'sync_settings'))
+
+    def import_settings(self, settings_manager, kgk_manager):
+        """
+        Imports loaded settings from a PasswordSettingsManager (for example from a .pws file). The kgk block and
+        salt are copied so the store is unlocked with the same masterpassword.
+
+        :param settings_manager: a settings manager with loaded settings
+        :type settings_manager: PasswordSettingsManager
+        :param kgk_manager: the kgk manager of the settings manager
+        :type kgk_manager: KgkManager
+        """
+        with self.transaction():
+            self.store_salt(kgk_manager.get_kgk_crypter_salt())
+            self.store_kgk_block(kgk_manager.get_encrypted_kgk())
+            self.unlock(kgk_manager)
+            for domain in settings_manager.get_domain_list():
+                self.set_setting(settings_manager.get_setting(domain))
+            self.store_sync_settings(settings_manager.sync_manager.get_binary_sync_settings())
+
+    def export_settings(self, settings_manager, kgk_manager):
+        """
+        Copies all settings into a PasswordSettingsManager and stores them in its settings file. The settings file
+        gets the salt and kgk of the store. The kgk manager is lent to the preference manager of the settings
+        manager for the save.
+
+        :param settings_manager: a settings manager
+        :type settings_manager: PasswordSettingsManager
+        :param kgk_manager: the unlocked kgk manager of the store
+        :type kgk_manager: KgkManager
+        """
+        with settings_manager.batch():
+            for setting in self.iterate_settings():
+                settings_manager.set_setting(setting)
+        sync_settings = self.get_sync_settings()
+        if sync_settings:
+            settings_manager.sync_manager.load_binary_sync_settings(sync_settings)
+        kgk_manager.salt = self.get_salt()
+        kgk_manager.set_preference_manager(settings_manager.preference_manager)
+        try:
+            settings_manager.store_local_settings(kgk_manager)
+        finally:
+            kgk_manager.set_preference_manager(self)
@@ -20,6 +20,8 @@ class Sync(object):
         self.username = username
         self.password = password
         self.certificate_filename = cert_filename
+        self.supports_delta = False
+        self.deltas = []
         self.headers = {
             'content-type': 'application/x-www-form-urlencoded',
             'Authorization': 'Basic ' + str(base64.b64encode(
@@ -29,11 +31,14 @@ class Sync(object):
 
     def pull(self):
         """
-        Read the base64 encoded data from the sync server.
+        Read the base64 encoded data from the sync server. Servers which accept deltas send the list of deltas
+        which were pushed after the data (it may be empty). They are in self.deltas afterwards and supports_delta
+        is set.
 
         :return: base64 encoded data
         :rtype: str
         """
+        self.deltas = []
         if self.server_url[-1] == "/":
             url = self.server_url + "ajax/read.php"
         else:
@@ -51,6 +56,9 @@ class Sync(object):
         if request.status_code == requests.codes.ok:
             received_data = json.loads(request.text)
             if 'status' in received_data and received_data['status']:
+                if 'deltas' in received_data:
+                    self.deltas = received_data['deltas']
+                    self.supports_delta = True
                 if 'result' in received_data:
                     return True, received_data['result']
                 else:
@@ -86,3 +94,43 @@ class Sync(object):
             return True
         else:
             return False
+
+    def push_delta(self, base_version, data):
+        """
+        Push a delta to the server. The server only accepts it if base_version is the version of its newest data
+        and it answers with a successful status. Servers without ajax/write_delta.php can not accept deltas. This
+        is remembered in supports_delta so the next changes are pushed completely.
+
+        :param str base_version: version of the data on the server the delta is based on
+        :param str data: base64 encoded delta
+        :return: was the push successful?
+        :rtype: bool
+        """
+        if self.server_url[-1] == "/":
+            url = self.server_url + "ajax/write_delta.php"
+        else:
+            url = self.server_url + "/ajax/write_delta.php"
+        if self.certificate_filename is None:
+            response = requests.post(url,
+                                     data={'base': base_version, 'data': data},
+                                     headers=self.headers)
+        else:
+            response = requests.post(url,
+                                     data={'base': base_version, 'data': data},
+                                     headers=self.headers,
+                                     verify=os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                         self.certificate_filename))
+        if response.status_code == requests.codes.ok:
+            try:
+                received_data = json.loads(response.text)
+            except ValueError:
+                self.supports_delta = False
+                return False
+            if type(received_data) == dict and 'status' in received_data and received_data['status']:
+                self.supports_delta = True
+                return True
+            return False
+        if response.status_code in [requests.codes.not_found, requests.codes.method_not_allowed,
+                                    requests.codes.not_implemented]:
+            self.supports_delta = False
+        return False
@@ -170,9 +170,47 @@ class SyncManager(object):
         pushes data to the sync server. If the push fails an error message is displayed.
 
         :param str data: base64 data
+        :return: was the push successful?
+        :rtype: bool
         """
         if self.sync:
-            if not self.sync.push(data):
-                print("Synchronisation fehlgeschlagen.")
+            if self.sync.push(data):
+                return True
+            print("Synchronisation fehlgeschlagen.")
         else:
             print("Sie haben keine gültigen Einstellungen für den sync server.")
+        return False
+
+    def supports_delta(self):
+        """
+        Returns true if the sync server announced deltas in the last pull or accepted a delta. Until then all
+        changes are pushed completely.
+
+        :return: deltas possible?
+        :rtype: bool
+        """
+        return bool(self.sync) and self.sync.supports_delta
+
+    def push_delta(self, base_version, data):
+        """
+        pushes a delta to the sync server. No message is displayed if this fails because a full push should follow.
+
+        :param str base_version: version of the data on the server
+        :param str data: base64 delta
+        :return: was the push successful?
+        :rtype: bool
+        """
+        if self.supports_delta():
+            return self.sync.push_delta(base_version, data)
+        return False
+
+    def get_pulled_deltas(self):
+        """
+        Returns the deltas of the last pull.
+
+        :return: base64 deltas
+        :rtype: [str]
+        """
+        if self.sync:
+            return self.sync.deltas
+        return []
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import asyncio
+import os
+from async_sesam import AsyncSesam
+from kgk_manager import KgkManager
+from password_generator import CtSesam
+from password_setting import PasswordSetting
+from password_settings_manager import PasswordSettingsManager
+from preference_manager import PreferenceManager
+
+
+class TestAsyncSesam(unittest.TestCase):
+    def setUp(self):
+        self.settings_file = os.path.expanduser('~/.ctSESAM_test_async.pws')
+        self.preference_manager = PreferenceManager(self.settings_file)
+        self.kgk_manager = KgkManager()
+        self.kgk_manager.set_preference_manager(self.preference_manager)
+        self.settings_manager = PasswordSettingsManager(self.preference_manager)
+
+    # noinspection PyUnresolvedReferences
+    def tearDown(self):
+        if os.path.isfile(self.settings_file):
+            try:
+                import win32con
+                import win32api
+                win32api.SetFileAttributes(self.settings_file, win32con.FILE_ATTRIBUTE_NORMAL)
+            except ImportError:
+                pass
+            os.remove(self.settings_file)
+
+    def test_generate_many(self):
+        self.kgk_manager.kgk = 'test'.encode('utf-8')
+        settings = []
+        for i in range(4):
+            setting = PasswordSetting('domain' + str(i))
+            setting.set_iterations(10)
+            settings.append(setting)
+        expected = [CtSesam(setting.get_domain(), '', b'test', setting.get_salt(), 10).generate(setting)
+                    for setting in settings]
+
+        async def run():
+            async with AsyncSesam(self.kgk_manager, self.settings_manager) as sesam:
+                return await sesam.generate_many(settings)
+        self.assertEqual(expected, asyncio.run(run()))
+
+    def test_store_and_load(self):
+        self.kgk_manager.get_kgk_crypter(b'xyz', os.urandom(32))
+        self.kgk_manager.create_new_kgk()
+        setting = PasswordSetting('unit.test')
+        setting.set_notes('async note')
+        self.settings_manager.set_setting(setting)
+        self.settings_manager.update_remote = False
+
+        async def run():
+            async with AsyncSesam(self.kgk_manager, self.settings_manager) as sesam:
+                await sesam.store_settings()
+            kgk_manager = KgkManager()
+            kgk_manager.set_preference_manager(PreferenceManager(self.settings_file))
+            settings_manager = PasswordSettingsManager(kgk_manager.preference_manager)
+            async with AsyncSesam(kgk_manager, settings_manager) as sesam:
+                await sesam.unlock('xyz')
+                await sesam.load_settings('xyz', no_sync=True)
+            return settings_manager
+        loaded_manager = asyncio.run(run())
+        self.assertIn('unit.test', loaded_manager.get_domain_list())
+        self.assertEqual('async note', loaded_manager.get_setting('unit.test').get_notes())
+
+
+if __name__ == '__main__':
+    unittest.main()
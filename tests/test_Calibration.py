@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import json
+import platform
+from unittest.mock import patch
+from calibration import IterationCalibrator
+from password_setting import PasswordSetting
+
+
+class TestIterationCalibrator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, 'calibration.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_measure(self):
+        calibrator = IterationCalibrator(self.cache_file, sample_duration=0.01)
+        self.assertGreater(calibrator.measure('sha512'), 0)
+        self.assertRaises(ValueError, calibrator.measure, 'md5')
+
+    def test_recommend_iterations(self):
+        calibrator = IterationCalibrator(self.cache_file)
+        calibrator.measurements['sha512'] = 100000.0
+        self.assertEqual(50000, calibrator.recommend_iterations(0.5))
+        self.assertEqual(4096, calibrator.recommend_iterations(0.00001, minimum=4096))
+        self.assertAlmostEqual(0.04096, calibrator.estimate_latency(4096))
+        self.assertRaises(ValueError, calibrator.recommend_iterations, 0)
+
+    def test_cache_file(self):
+        calibrator = IterationCalibrator(self.cache_file, sample_duration=0.01)
+        calibrator.calibrate()
+        self.assertTrue(os.path.isfile(self.cache_file))
+        cached = IterationCalibrator(self.cache_file)
+        self.assertEqual(calibrator.measurements, cached.measurements)
+        with patch('calibration.platform.node', return_value='another host'):
+            self.assertEqual({}, IterationCalibrator(self.cache_file).measurements)
+
+    def test_corrupt_cache_file(self):
+        for measurements in ['{"sha512": "fast"}', '{"sha512": null}', '{"sha512": -1}', '[]',
+                             '{"sha512": Infinity}', '{"sha512": NaN}']:
+            with open(self.cache_file, 'w') as f:
+                f.write('{"host": ' + json.dumps(platform.node()) + ', "measurements": ' + measurements + '}')
+            self.assertEqual({}, IterationCalibrator(self.cache_file).measurements)
+
+    def test_ask_for_input(self):
+        calibrator = IterationCalibrator(self.cache_file)
+        calibrator.measurements['sha512'] = 100000.0
+        setting = PasswordSetting('unit.test')
+        with patch('builtins.input', side_effect=['user', '', '12', '']):
+            setting.ask_for_input(calibrator, 0.2)
+        self.assertEqual(20000, setting.get_iterations())
+        self.assertEqual(12, setting.get_length())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import unittest
-from crypter import Crypter
+from crypter import Crypter, KeyDerivationCache
 from base64 import b64encode, b64decode
 
 
@@ -35,5 +35,59 @@ class TestCrypter(unittest.TestCase):
                          b'be encrypted. This long message insures that more than one block is needed.',
                          crypter.decrypt(b64decode(ciphertext)))
 
+    def test_stream_encrypt(self):
+        crypter = Crypter(Crypter.createIvKey(b'secret', b'pepper', iterations=3))
+        message = b'Important information with quite some length. ' + \
+                  b'This message is as long as this because otherwise only one cipher block would be encrypted.'
+        encryptor = crypter.get_encryptor()
+        ciphertext = b''
+        for i in range(0, len(message), 7):
+            ciphertext += encryptor.update(message[i:i + 7])
+        ciphertext += encryptor.finalize()
+        self.assertEqual(crypter.encrypt(message), ciphertext)
+        self.assertRaises(ValueError, encryptor.update, b'more')
+
+    def test_stream_decrypt_into(self):
+        crypter = Crypter(Crypter.createIvKey(b'secret', b'pepper', iterations=3))
+        message = b'Important information with quite some length. ' + \
+                  b'This message is as long as this because otherwise only one cipher block would be encrypted.'
+        ciphertext = crypter.encrypt(message)
+        decryptor = crypter.get_decryptor()
+        output = bytearray(len(ciphertext))
+        written = 0
+        for i in range(0, len(ciphertext), 20):
+            written += decryptor.update_into(ciphertext[i:i + 20], memoryview(output)[written:])
+        written += decryptor.finalize_into(memoryview(output)[written:])
+        self.assertEqual(message, output[:written])
+        wrong_decryptor = Crypter(Crypter.createIvKey(b'wrong', b'pepper', iterations=3)).get_decryptor()
+        wrong_decryptor.update(ciphertext)
+        self.assertRaises(ValueError, wrong_decryptor.finalize)
+
+    def test_authenticated(self):
+        crypter = Crypter(Crypter.createIvKey(b'secret', b'pepper', iterations=3))
+        message = b'Important information with quite some length.'
+        ciphertext = crypter.encrypt_authenticated(message, b'header')
+        self.assertEqual(8 + 16 + len(message), len(ciphertext))
+        self.assertEqual(message, crypter.decrypt_authenticated(ciphertext, b'header'))
+        self.assertRaises(ValueError, crypter.decrypt_authenticated, ciphertext, b'other header')
+        corrupt_ciphertext = ciphertext[:-1] + bytes([ciphertext[-1] ^ 1])
+        self.assertRaises(ValueError, crypter.decrypt_authenticated, corrupt_ciphertext, b'header')
+        wrong_crypter = Crypter(Crypter.createIvKey(b'wrong', b'pepper', iterations=3))
+        with self.assertRaisesRegex(ValueError, "Wrong key"):
+            wrong_crypter.decrypt_authenticated(ciphertext, b'header')
+
+    def test_key_derivation_cache(self):
+        cache = KeyDerivationCache()
+        key = Crypter.createIvKey(b'secret', b'pepper', iterations=3, cache=cache)
+        self.assertEqual(Crypter.createIvKey(b'secret', b'pepper', iterations=3), key)
+        self.assertEqual(1, len(cache))
+        self.assertEqual(key, Crypter.createIvKey(b'secret', b'pepper', iterations=3, cache=cache))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(Crypter.create_key(b'secret', b'pepper', iterations=3),
+                         Crypter.create_key(b'secret', b'pepper', iterations=3, cache=cache))
+        self.assertEqual(2, len(cache))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from domain_index import DomainIndex
+
+
+class TestDomainIndex(unittest.TestCase):
+    def test_complete(self):
+        index = DomainIndex(['example.com', 'abc.de', 'example.org', 'exam.net'])
+        self.assertEqual(['exam.net', 'example.com', 'example.org'], index.complete('exam'))
+        self.assertEqual(['example.com', 'example.org'], index.complete('example'))
+        self.assertEqual(['exam.net'], index.complete('exam', 1))
+        self.assertEqual(['abc.de'], index.complete('abc.de'))
+        self.assertEqual([], index.complete('xyz'))
+        self.assertEqual(4, len(index.complete('')))
+
+    def test_add_and_remove(self):
+        index = DomainIndex()
+        for domain in ['b.de', 'c.de', 'a.de', 'ab.de']:
+            index.add(domain)
+        self.assertFalse(index.sorted)
+        self.assertEqual(['a.de', 'ab.de'], index.complete('a'))
+        index.remove('a.de')
+        index.remove('missing.de')
+        self.assertEqual(['ab.de', 'b.de', 'c.de'], index.complete(''))
+        index.clear()
+        self.assertEqual(0, len(index))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import socket
+import tempfile
+import threading
+from generator_daemon import GeneratorDaemon, DaemonClient
+from kgk_manager import KgkManager
+from password_settings_manager import PasswordSettingsManager
+from password_setting import PasswordSetting
+from preference_manager import PreferenceManager
+from sqlite_store import SqliteSettingsStore
+from crypter import Crypter
+
+
+class TestGeneratorDaemon(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.kgk_manager = KgkManager()
+        self.kgk_manager.kgk = 'reallysafe'.encode('utf-8')
+        self.settings_manager = PasswordSettingsManager(
+            PreferenceManager(os.path.join(self.directory.name, 'ctSESAM.pws')))
+        setting = PasswordSetting('Bank')
+        setting.set_iterations(1)
+        setting.set_extra_character_set("0123456789")
+        setting.set_template("oxxx")
+        setting.set_salt('pepper'.encode('utf-8'))
+        self.settings_manager.set_setting(setting)
+        self.daemon = GeneratorDaemon(self.kgk_manager, self.settings_manager,
+                                      os.path.join(self.directory.name, 'ctSESAM.sock'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_handle_request(self):
+        self.assertEqual({'status': 'ok'}, self.daemon.handle_request({'command': 'ping'}))
+        self.assertEqual(['Bank'], self.daemon.handle_request({'command': 'domains'})['domains'])
+        self.assertEqual('7809', self.daemon.handle_request({'command': 'generate', 'domain': 'Bank'})['password'])
+        self.assertEqual('oxxx',
+                         self.daemon.handle_request({'command': 'lookup', 'domain': 'Bank'})['setting'][
+                             'passwordTemplate'])
+        self.assertEqual('not found', self.daemon.handle_request({'command': 'generate', 'domain': 'x'})['status'])
+        self.assertNotIn('x', self.settings_manager.get_domain_list())
+        self.assertEqual('error', self.daemon.handle_request({'command': 'foo'})['status'])
+        self.assertEqual('error', self.daemon.handle_request([])['status'])
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "unix sockets are not available")
+    def test_socket(self):
+        client = DaemonClient(self.daemon.socket_path)
+        self.assertFalse(client.is_running())
+        self.daemon.create_server()
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.start()
+        try:
+            self.assertTrue(client.is_running())
+            self.assertEqual('7809', client.generate('Bank')['password'])
+            self.assertEqual('Bank', client.lookup('Bank')['domain'])
+            self.assertIsNone(client.generate('unknown.domain'))
+        finally:
+            self.daemon.shutdown()
+            thread.join()
+        self.assertFalse(os.path.exists(self.daemon.socket_path))
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "unix sockets are not available")
+    def test_idle_connection(self):
+        self.daemon.timeout = 0.5
+        self.daemon.create_server()
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.start()
+        idle_connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            idle_connection.connect(self.daemon.socket_path)
+            idle_connection.sendall(b'{"command": ')
+            self.assertEqual('7809', DaemonClient(self.daemon.socket_path, timeout=2.0).generate('Bank')['password'])
+            idle_connection.settimeout(5.0)
+            self.assertEqual(b'', idle_connection.recv(1))
+        finally:
+            idle_connection.close()
+            self.daemon.shutdown()
+            thread.join()
+
+    def test_settings_changed_by_other_process(self):
+        preference_manager = self.settings_manager.preference_manager
+        self.kgk_manager.set_preference_manager(preference_manager)
+        self.kgk_manager.create_new_kgk()
+        self.kgk_manager.get_kgk_crypter(b'xyz', self.kgk_manager.get_kgk_crypter_salt())
+        self.kgk_manager.store_local_kgk_block()
+        self.settings_manager.store_local_settings(self.kgk_manager)
+        self.assertEqual('not found', self.daemon.handle_request({'command': 'lookup', 'domain': 'new.org'})['status'])
+        other_preference_manager = PreferenceManager(preference_manager.settings_file)
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.decrypt_kgk(other_preference_manager.get_kgk_block(), self.kgk_manager.kgk_crypter)
+        other_kgk_manager.salt = other_preference_manager.get_salt()
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.load_local_settings(other_kgk_manager)
+        other_manager.set_setting(PasswordSetting('new.org'))
+        other_manager.delete_setting(other_manager.get_setting('Bank'))
+        other_manager.store_local_settings(other_kgk_manager)
+        self.assertEqual('ok', self.daemon.handle_request({'command': 'lookup', 'domain': 'new.org'})['status'])
+        self.assertEqual(['new.org'], self.daemon.handle_request({'command': 'domains'})['domains'])
+
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "unix sockets are not available")
+    def test_settings_store(self):
+        store = SqliteSettingsStore(os.path.join(self.directory.name, 'ctSESAM.sqlite'))
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(store)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        store.unlock(kgk_manager)
+        store.set_setting(self.settings_manager.get_setting('Bank'))
+        daemon = GeneratorDaemon(kgk_manager, store, self.daemon.socket_path)
+        daemon.create_server()
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            client = DaemonClient(daemon.socket_path)
+            self.assertEqual('oxxx', client.lookup('Bank')['passwordTemplate'])
+            self.assertIsNone(client.lookup('new.org'))
+            store.set_setting(PasswordSetting('new.org'))
+            self.assertEqual('new.org', client.lookup('new.org')['domain'])
+            self.assertEqual(['Bank', 'new.org'], sorted(client.request({'command': 'domains'})['domains']))
+        finally:
+            daemon.shutdown()
+            thread.join()
+            store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from hash_cache import HashCache
+from password_generator import CtSesam
+from password_setting import PasswordSetting
+
+
+class TestHashCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = HashCache()
+        key = HashCache.create_key('some.domain', 'user', b'pepper', 4096)
+        self.assertIsNone(cache.get(key, b'kgk'))
+        cache.put(key, b'kgk', b'hash')
+        self.assertEqual(b'hash', cache.get(key, b'kgk'))
+
+    def test_lru_eviction(self):
+        cache = HashCache(max_size=2)
+        cache.put('a', b'kgk', b'1')
+        cache.put('b', b'kgk', b'2')
+        self.assertEqual(b'1', cache.get('a', b'kgk'))
+        cache.put('c', b'kgk', b'3')
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('b', b'kgk'))
+        self.assertEqual(b'1', cache.get('a', b'kgk'))
+        self.assertEqual(b'3', cache.get('c', b'kgk'))
+
+    def test_ttl(self):
+        cache = HashCache(ttl=-1)
+        cache.put('a', b'kgk', b'1')
+        self.assertIsNone(cache.get('a', b'kgk'))
+        self.assertEqual(0, len(cache))
+
+    def test_kgk_change_wipes(self):
+        cache = HashCache()
+        cache.put('a', b'kgk', b'1')
+        self.assertIsNone(cache.get('a', b'other kgk'))
+        self.assertEqual(0, len(cache))
+
+    def test_wipe(self):
+        cache = HashCache()
+        cache.put('a', b'kgk', b'1')
+        cache.wipe()
+        self.assertIsNone(cache.get('a', b'kgk'))
+
+    def test_ct_sesam_uses_cache(self):
+        setting = PasswordSetting('FooBar')
+        setting.set_iterations(8192)
+        setting.set_template("xxaxxx")
+        setting.set_salt('blahfasel'.encode('utf-8'))
+        cache = HashCache()
+        kgk = 'test'.encode('utf-8')
+        first = CtSesam(setting.get_domain(), setting.get_username(), kgk, setting.get_salt(),
+                        setting.get_iterations(), cache)
+        self.assertEqual(1, len(cache))
+        second = CtSesam(setting.get_domain(), setting.get_username(), kgk, setting.get_salt(),
+                         setting.get_iterations(), cache)
+        self.assertEqual(first.hash_value, second.hash_value)
+        self.assertEqual("baeloh", second.generate(setting))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from journal import Journal
+import tempfile
+import os
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal_file = os.path.join(self.directory.name, 'ctSESAM.pws.journal')
+        self.kgk = os.urandom(64)
+        self.snapshot_id = Journal.get_snapshot_id(os.urandom(112))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_append_and_read(self):
+        journal = Journal(self.journal_file)
+        self.assertEqual([], journal.read(self.kgk, self.snapshot_id))
+        journal.append(self.kgk, self.snapshot_id, {'domain': 'a.de', 'deleted': True})
+        journal.append(self.kgk, self.snapshot_id, {'domain': 'b.de', 'setting': {'iterations': 4096}})
+        self.assertNotIn(b'b.de', open(self.journal_file, 'rb').read())
+        records = Journal(self.journal_file).read(self.kgk, self.snapshot_id)
+        self.assertEqual([{'domain': 'a.de', 'deleted': True},
+                          {'domain': 'b.de', 'setting': {'iterations': 4096}}], records)
+        self.assertEqual([], Journal(self.journal_file).read(self.kgk, Journal.get_snapshot_id(b'other')))
+        self.assertEqual([], Journal(self.journal_file).read(os.urandom(64), self.snapshot_id))
+        journal.clear()
+        self.assertFalse(os.path.exists(self.journal_file))
+        self.assertEqual(0, journal.get_size())
+
+    def test_torn_record(self):
+        journal = Journal(self.journal_file)
+        journal.append(self.kgk, self.snapshot_id, {'domain': 'a.de', 'deleted': True})
+        journal.append(self.kgk, self.snapshot_id, {'domain': 'b.de', 'deleted': True})
+        with open(self.journal_file, 'rb+') as f:
+            f.truncate(journal.get_size() - 3)
+        journal = Journal(self.journal_file)
+        self.assertEqual([{'domain': 'a.de', 'deleted': True}], journal.read(self.kgk, self.snapshot_id))
+        journal.append(self.kgk, self.snapshot_id, {'domain': 'c.de', 'deleted': True})
+        self.assertEqual([{'domain': 'a.de', 'deleted': True}, {'domain': 'c.de', 'deleted': True}],
+                         Journal(self.journal_file).read(self.kgk, self.snapshot_id))
+
+    def test_new_snapshot(self):
+        journal = Journal(self.journal_file)
+        journal.append(self.kgk, self.snapshot_id, {'domain': 'a.de', 'deleted': True})
+        new_snapshot_id = Journal.get_snapshot_id(os.urandom(112))
+        journal.append(self.kgk, new_snapshot_id, {'domain': 'b.de', 'deleted': True})
+        self.assertEqual([{'domain': 'b.de', 'deleted': True}],
+                         Journal(self.journal_file).read(self.kgk, new_snapshot_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,9 @@
 
 import unittest
 from kgk_manager import KgkManager
-from crypter import Crypter
+from crypter import Crypter, KeyDerivationCache
+from unittest.mock import patch
+import os
 
 
 class TestKgkManager(unittest.TestCase):
@@ -58,3 +60,17 @@ class TestKgkManager(unittest.TestCase):
         kgkm.fresh_salt2()
         self.assertNotEqual(b"\x3A"*32, kgkm.get_salt2())
         self.assertEqual(32, len(kgkm.get_salt2()))
+
+    def test_shared_key_cache(self):
+        cache = KeyDerivationCache()
+        local_kgk_manager = KgkManager(cache)
+        salt = os.urandom(32)
+        local_kgk_manager.get_kgk_crypter(b'xyz', salt)
+        local_kgk_manager.create_new_kgk()
+        blob = b'\x01' + salt + local_kgk_manager.get_encrypted_kgk()
+        with patch('crypter.pbkdf2_hmac') as pbkdf2:
+            remote_kgk_manager = KgkManager(cache)
+            remote_kgk_manager.update_from_blob(b'xyz', blob)
+            pbkdf2.assert_not_called()
+        self.assertEqual(local_kgk_manager.get_kgk(), remote_kgk_manager.get_kgk())
+        self.assertEqual(local_kgk_manager.get_salt2(), remote_kgk_manager.get_salt2())
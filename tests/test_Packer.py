@@ -2,8 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import unittest
-from packer import Packer
+from packer import Packer, SETTINGS_DICTIONARY
+from password_setting import PasswordSetting
+import json
+import struct
 from base64 import b64decode, b64encode
+import zlib
+import os
+import tracemalloc
 
 
 class TestPacker(unittest.TestCase):
@@ -16,6 +22,104 @@ class TestPacker(unittest.TestCase):
             b'Some packable information',
             Packer.decompress(b64decode("AAAAGXjaC87PTVUoSEzOTkzKSVXIzEvLL8pNLMnMzwMAedUJrg==")))
 
+    def test_compress_level(self):
+        data = "Some packable information " * 20
+        fast = Packer.compress(data, level=1, strategy=zlib.Z_FILTERED)
+        self.assertEqual(data.encode('utf-8'), Packer.decompress(fast))
+        self.assertEqual(b'\x00\x00\x02\x08', fast[:4])
+
+    def test_stream_compress(self):
+        data = ("Some packable information " * 20).encode('utf-8')
+        compressor = Packer.get_compressor(len(data))
+        compressed_data = b''
+        for i in range(0, len(data), 33):
+            compressed_data += compressor.compress(data[i:i + 33])
+        compressed_data += compressor.flush()
+        self.assertEqual(Packer.compress(data), compressed_data)
+        self.assertRaises(ValueError, Packer.get_compressor(3).compress, b'four')
+        self.assertRaises(ValueError, Packer.get_compressor(5).flush)
+
+    def test_stream_decompress(self):
+        compressed_data = b64decode("AAAAGXjaC87PTVUoSEzOTkzKSVXIzEvLL8pNLMnMzwMAedUJrg==")
+        decompressor = Packer.get_decompressor()
+        data = b''
+        for i in range(0, len(compressed_data), 3):
+            data += decompressor.decompress(compressed_data[i:i + 3])
+        data += decompressor.flush()
+        self.assertEqual(b'Some packable information', data)
+        self.assertEqual(25, decompressor.expected_length)
+        incomplete_decompressor = Packer.get_decompressor()
+        incomplete_decompressor.decompress(compressed_data[:-4])
+        self.assertRaises(ValueError, incomplete_decompressor.flush)
+
+    def test_preset_dictionary(self):
+        data = json.dumps({'abc.de': PasswordSetting('abc.de').to_dict()})
+        compressed_data = Packer.compress(data, zdict=SETTINGS_DICTIONARY)
+        self.assertLess(len(compressed_data), len(Packer.compress(data)))
+        self.assertEqual(data.encode('utf-8'), Packer.decompress(compressed_data))
+        decompressor = Packer.get_decompressor()
+        decompressed_data = b''
+        for i in range(0, len(compressed_data), 3):
+            decompressed_data += decompressor.decompress(compressed_data[i:i + 3])
+        self.assertEqual(data.encode('utf-8'), decompressed_data + decompressor.flush())
+        self.assertRaises(ValueError, Packer.compress, data, zdict=b'unregistered dictionary')
+        Packer.register_dictionary(b'registered dictionary')
+        self.assertEqual(b'registered', Packer.decompress(
+            Packer.compress(b'registered', zdict=b'registered dictionary')))
+        unknown = bytearray(compressed_data)
+        unknown[6:10] = b'\x00\x00\x00\x01'
+        self.assertRaises(ValueError, Packer.decompress, unknown)
+
+    def test_codecs(self):
+        data = json.dumps({'abc.de': PasswordSetting('abc.de').to_dict()}).encode('utf-8')
+        self.assertEqual(['none', 'zlib', 'lzma', 'bz2'], Packer.get_codec_names())
+        for codec in Packer.get_codec_names():
+            compressed_data = Packer.compress(data, codec=codec)
+            self.assertEqual(0xFF, compressed_data[0])
+            self.assertEqual(Packer.get_codec(codec).codec_id, compressed_data[1])
+            self.assertEqual(len(data), struct.unpack('!I', compressed_data[2:6])[0])
+            self.assertEqual(data, Packer.decompress(compressed_data))
+            decompressor = Packer.get_decompressor()
+            decompressed_data = b''
+            for i in range(0, len(compressed_data), 5):
+                decompressed_data += decompressor.decompress(compressed_data[i:i + 5])
+            self.assertEqual(data, decompressed_data + decompressor.flush())
+            self.assertRaises(ValueError, Packer.decompress, compressed_data[:-1])
+        self.assertEqual(b'\xff\x00\x00\x00\x00\x04abcd', Packer.compress(b'abcd', codec='none'))
+        self.assertEqual(data, Packer.decompress(Packer.compress(data, codec='zlib', zdict=SETTINGS_DICTIONARY)))
+        self.assertRaises(ValueError, Packer.compress, data, codec='lzma', zdict=SETTINGS_DICTIONARY)
+        self.assertRaises(ValueError, Packer.compress, data, codec='unknown')
+        self.assertRaises(ValueError, Packer.decompress, b'\xff\x7f\x00\x00\x00\x04abcd')
+
+    def test_bounded_decompress(self):
+        data = b'\x00' * 1000000
+        compressed_data = Packer.compress(data)
+        self.assertEqual(data, Packer.decompress(compressed_data))
+        self.assertEqual(bytearray, type(Packer.decompress(compressed_data)))
+        self.assertRaises(ValueError, Packer.decompress, compressed_data, max_length=999999)
+        lying_header = struct.pack('!I', 1000) + compressed_data[4:]
+        self.assertRaises(ValueError, Packer.decompress, lying_header)
+        self.assertRaises(ValueError, Packer.get_decompressor().decompress, lying_header)
+        for codec in Packer.get_codec_names():
+            compressed_data = bytearray(Packer.compress(data, codec=codec))
+            compressed_data[2:6] = struct.pack('!I', 1000)
+            self.assertRaises(ValueError, Packer.decompress, compressed_data)
+        short_header = struct.pack('!I', 2000000) + Packer.compress(data)[4:]
+        self.assertEqual(data, Packer.decompress(short_header))
+
+
+    def test_decompress_without_input_copies(self):
+        data = os.urandom(1024 * 1024).hex().encode('utf-8')
+        for codec in [None, 'none']:
+            compressed_data = Packer.compress(data, codec=codec)
+            tracemalloc.start()
+            try:
+                decompressed_data = Packer.decompress(compressed_data)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(data, decompressed_data)
+            self.assertLess(peak, 1.25 * len(data))
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,7 +3,7 @@
 Test for CtSESAM class.
 """
 import unittest
-from password_generator import CtSesam
+from password_generator import CtSesam, generate_passwords
 from password_setting import PasswordSetting
 from hashlib import pbkdf2_hmac
 from binascii import unhexlify
@@ -154,3 +154,30 @@ class TestCtSesam(unittest.TestCase):
         self.assertEqual(unhexlify("55b5f5cdd9bf2845e339650b4f6e1398cf7fe9ceed087eb5f5bc059882723579fc8ec27443417" +
                                    "cf33c9763bafac6277fbe991bf27dd0206e78f7d9dfd574167f"), manager.hash_value)
         self.assertEqual("7809", manager.generate(setting))
+
+
+class TestGeneratePasswords(unittest.TestCase):
+    def test_same_as_single_generation(self):
+        settings = []
+        for i in range(12):
+            setting = PasswordSetting('domain' + str(i) + '.com')
+            setting.set_username('user' + str(i))
+            setting.set_iterations(10 + i)
+            settings.append(setting)
+        kgk = 'test'.encode('utf-8')
+        expected = [CtSesam(setting.get_domain(), setting.get_username(), kgk,
+                            setting.get_salt(), setting.get_iterations()).generate(setting)
+                    for setting in settings]
+        self.assertEqual(expected, generate_passwords(settings, kgk))
+        self.assertEqual(expected, generate_passwords(settings, kgk, max_workers=1))
+
+    def test_known_password(self):
+        setting = PasswordSetting('Bank')
+        setting.set_iterations(1)
+        setting.set_extra_character_set("0123456789")
+        setting.set_template("oxxx")
+        setting.set_salt('pepper'.encode('utf-8'))
+        self.assertEqual(["7809"], generate_passwords([setting], 'reallysafe'.encode('utf-8')))
+
+    def test_empty(self):
+        self.assertEqual([], generate_passwords([], b'kgk'))
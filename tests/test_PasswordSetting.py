@@ -138,6 +138,29 @@ class TestPasswordSetting(unittest.TestCase):
         self.assertEqual("xxxxxxoxxxnAxxxa", s.get_template())
         self.assertEqual(16, len(s.get_template()))
 
+    def test_generation_plan(self):
+        s = PasswordSetting("unit.test")
+        s.set_extra_character_set("#!")
+        s.set_template("aAnox")
+        plan = s.get_generation_plan()
+        self.assertEqual(("abcdefghijklmnopqrstuvwxyz",
+                          "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+                          "0123456789",
+                          "#!",
+                          "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ#!"), plan.character_sets)
+        self.assertEqual((26, 26, 10, 2, 64), plan.radices)
+        self.assertIs(plan, s.get_generation_plan())
+
+    def test_generation_plan_invalidation(self):
+        s = PasswordSetting("unit.test")
+        s.set_template("xxxo")
+        plan = s.get_generation_plan()
+        s.set_extra_character_set("abc")
+        self.assertEqual(("abc", "abc", "abc", "abc"), s.get_generation_plan().character_sets)
+        s.set_template("nn")
+        self.assertEqual((10, 10), s.get_generation_plan().radices)
+        self.assertIsNot(plan, s.get_generation_plan())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,6 +5,9 @@ import unittest
 import os
 import json
 import struct
+import tempfile
+import threading
+import tracemalloc
 from kgk_manager import KgkManager
 from preference_manager import PreferenceManager
 from password_settings_manager import PasswordSettingsManager
@@ -12,6 +15,7 @@ from password_setting import PasswordSetting
 from crypter import Crypter
 from packer import Packer
 from base64 import b64encode, b64decode
+from unittest.mock import patch
 
 
 class MockSyncManager(object):
@@ -22,6 +26,10 @@ class MockSyncManager(object):
         self.kgk_manager = KgkManager()
         self.kgk_manager.set_preference_manager(PreferenceManager(os.path.expanduser('~/.ctSESAM_test_extra.pws')))
         self.kgk_manager.kgk = kgk
+        self.deltas = []
+        self.accepts_delta = True
+        self.pushed_data = []
+        self.pushed_deltas = []
 
     def pull(self):
         """
@@ -80,6 +88,59 @@ class MockSyncManager(object):
         """
         return True
 
+    def get_pulled_deltas(self):
+        """
+        :return:
+        :rtype: [str]
+        """
+        return self.deltas
+
+    def supports_delta(self):
+        """
+        :return:
+        :rtype: bool
+        """
+        return self.accepts_delta
+
+    def push(self, data):
+        """
+        :return:
+        :rtype: bool
+        """
+        self.pushed_data.append(data)
+        return True
+
+    def push_delta(self, base_version, data):
+        """
+        :return:
+        :rtype: bool
+        """
+        if not self.accepts_delta:
+            return False
+        self.pushed_deltas.append((base_version, data))
+        return True
+
+
+class ManualTimer(object):
+    """
+    A timer which only runs its function when the test calls fire.
+    """
+    def __init__(self, interval, function):
+        self.interval = interval
+        self.function = function
+        self.daemon = False
+        self.cancelled = False
+
+    def start(self):
+        pass
+
+    def cancel(self):
+        self.cancelled = True
+
+    def fire(self):
+        if not self.cancelled:
+            self.function()
+
 
 class TestPasswordSettingsManager(unittest.TestCase):
     def setUp(self):
@@ -104,6 +165,29 @@ class TestPasswordSettingsManager(unittest.TestCase):
         self.assertEqual('abc.de', setting.get_domain())
         self.assertIn('abc.de', self.manager.get_domain_list())
 
+    def test_find_setting(self):
+        self.assertIsNone(self.manager.find_setting('abc.de'))
+        self.assertFalse(self.manager.has_setting('abc.de'))
+        self.assertEqual([], self.manager.get_domain_list())
+        setting = self.manager.get_setting('abc.de')
+        self.assertIs(setting, self.manager.find_setting('abc.de'))
+        self.assertTrue(self.manager.has_setting('abc.de'))
+        self.manager.set_setting(PasswordSetting('hugo.com'))
+        self.manager.set_setting(PasswordSetting('abc.de'))
+        self.assertEqual(['hugo.com', 'abc.de'], self.manager.get_domain_list())
+        self.manager.delete_setting(setting)
+        self.assertEqual(['hugo.com'], self.manager.get_domain_list())
+
+    def test_complete(self):
+        for domain in ['hugo.com', 'abc.de', 'hugo.de', 'hugh.org']:
+            self.manager.set_setting(PasswordSetting(domain))
+        self.assertEqual(['hugh.org', 'hugo.com', 'hugo.de'], self.manager.complete('hu'))
+        self.assertEqual(['hugo.com'], self.manager.complete('hugo', 1))
+        self.manager.delete_setting(PasswordSetting('hugo.com'))
+        self.assertEqual(['hugo.de'], self.manager.complete('hugo'))
+        self.manager.get_setting('hugo.net')
+        self.assertEqual(['hugo.de', 'hugo.net'], self.manager.complete('hugo'))
+
     def test_store_local_settings(self):
         abc_setting = self.manager.get_setting('abc.de')
         abc_setting.set_template('xAxonaxxxx')
@@ -128,6 +212,203 @@ class TestPasswordSettingsManager(unittest.TestCase):
         self.assertEqual('hugo.com', data['settings']['hugo.com']['domain'])
         self.assertEqual('xonxAxxaxxxx', data['settings']['hugo.com']['passwordTemplate'])
 
+    def test_settings_key_reuse(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.enable_settings_key_reuse()
+        self.manager.set_setting(PasswordSetting('abc.de'))
+        with patch('password_settings_manager.Crypter.create_key', wraps=Crypter.create_key) as create_key:
+            self.manager.store_local_settings(kgk_manager)
+            salt2 = kgk_manager.get_salt2()
+            iv2 = kgk_manager.get_iv2()
+            self.manager.set_setting(PasswordSetting('hugo.com'))
+            self.manager.store_local_settings(kgk_manager)
+            self.assertEqual(1, create_key.call_count)
+        self.assertEqual(salt2, kgk_manager.get_salt2())
+        self.assertNotEqual(iv2, kgk_manager.get_iv2())
+        self.preference_manager.read_file()
+        loaded_manager = PasswordSettingsManager(self.preference_manager)
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual(['abc.de', 'hugo.com'], sorted(loaded_manager.get_domain_list()))
+        self.manager.disable_settings_key_reuse()
+        self.manager.store_local_settings(kgk_manager)
+        self.assertNotEqual(salt2, kgk_manager.get_salt2())
+
+    def test_compression_options(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.set_setting(PasswordSetting('abc.de'))
+        self.manager.store_local_settings(kgk_manager)
+        plain_length = len(self.preference_manager.get_settings_data())
+        self.manager.set_compression(use_preset_dictionary=True)
+        self.manager.store_local_settings(kgk_manager)
+        self.assertLess(len(self.preference_manager.get_settings_data()), plain_length)
+        loaded_manager = PasswordSettingsManager(self.preference_manager)
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual(['abc.de'], loaded_manager.get_domain_list())
+        self.manager.set_compression(codec='lzma')
+        self.manager.store_local_settings(kgk_manager)
+        loaded_manager = PasswordSettingsManager(self.preference_manager)
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual(['abc.de'], loaded_manager.get_domain_list())
+        self.assertRaises(ValueError, self.manager.set_compression, codec='unknown')
+        self.assertRaises(ValueError, self.manager.set_compression, use_preset_dictionary=True, codec='bz2')
+
+    def test_empty_vault_without_compression(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.set_compression(codec='none')
+        self.manager.store_local_settings(kgk_manager)
+        loaded_manager = PasswordSettingsManager(self.preference_manager)
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual([], loaded_manager.get_domain_list())
+
+    def test_journal(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.enable_journal(kgk_manager)
+        self.manager.set_setting(PasswordSetting('abc.de'))
+        self.assertFalse(os.path.exists(self.manager.journal.journal_file))
+        self.manager.store_local_settings(kgk_manager)
+        settings_data = self.preference_manager.get_settings_data()
+        setting = PasswordSetting('hugo.com')
+        setting.set_notes('journaled')
+        self.manager.set_setting(setting)
+        self.manager.delete_setting(PasswordSetting('abc.de'))
+        self.assertEqual(settings_data, self.preference_manager.get_settings_data())
+        self.assertTrue(os.path.exists(self.manager.journal.journal_file))
+        loaded_manager = PasswordSettingsManager(self.preference_manager)
+        loaded_manager.enable_journal(kgk_manager)
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual(['hugo.com'], loaded_manager.get_domain_list())
+        self.assertEqual('journaled', loaded_manager.get_setting('hugo.com').get_notes())
+        self.assertFalse(loaded_manager.get_setting('hugo.com').is_synced())
+        loaded_manager.journal_compaction_threshold = 0
+        loaded_manager.set_setting(PasswordSetting('third.org'))
+        self.assertFalse(os.path.exists(self.manager.journal.journal_file))
+        self.assertNotEqual(settings_data, self.preference_manager.get_settings_data())
+        loaded_manager = PasswordSettingsManager(self.preference_manager)
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual(['hugo.com', 'third.org'], sorted(loaded_manager.get_domain_list()))
+
+    def test_concurrent_store(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.set_setting(PasswordSetting('abc.de'))
+        self.manager.set_setting(PasswordSetting('xyz.org'))
+        self.manager.store_local_settings(kgk_manager)
+        other_preference_manager = PreferenceManager(self.preference_manager.settings_file)
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.decrypt_kgk(other_preference_manager.get_kgk_block(), kgk_manager.kgk_crypter)
+        other_kgk_manager.salt = other_preference_manager.get_salt()
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.load_local_settings(other_kgk_manager)
+        other_manager.set_setting(PasswordSetting('other.com'))
+        other_manager.delete_setting(other_manager.get_setting('xyz.org'))
+        other_manager.store_local_settings(other_kgk_manager)
+        self.manager.set_setting(PasswordSetting('hugo.com'))
+        self.manager.delete_setting(self.manager.get_setting('abc.de'))
+        self.manager.store_local_settings(kgk_manager)
+        self.assertEqual(['hugo.com', 'other.com'], sorted(self.manager.get_domain_list()))
+        loaded_manager = PasswordSettingsManager(PreferenceManager(self.preference_manager.settings_file))
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual(['hugo.com', 'other.com'], sorted(loaded_manager.get_domain_list()))
+
+    def test_concurrent_pull(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.get_kgk_crypter(b'xyz', kgk_manager.get_kgk_crypter_salt())
+        kgk_manager.store_local_kgk_block()
+        self.manager.set_setting(PasswordSetting('local.org'))
+        self.manager.store_local_settings(kgk_manager)
+        other_preference_manager = PreferenceManager(self.preference_manager.settings_file)
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.decrypt_kgk(other_preference_manager.get_kgk_block(), kgk_manager.kgk_crypter)
+        other_kgk_manager.salt = other_preference_manager.get_salt()
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.load_local_settings(other_kgk_manager)
+        other_manager.set_setting(PasswordSetting('other.com'))
+        other_manager.store_local_settings(other_kgk_manager)
+        sync_manager = MockSyncManager(kgk_manager.get_kgk())
+        self.manager.sync_manager = sync_manager
+        pull_successful, data = sync_manager.pull()
+        self.manager.update_from_pulled_data(kgk_manager, 'xyz', pull_successful, data)
+        loaded_preference_manager = PreferenceManager(self.preference_manager.settings_file)
+        loaded_kgk_manager = KgkManager()
+        loaded_kgk_manager.set_preference_manager(loaded_preference_manager)
+        loaded_kgk_manager.decrypt_kgk(loaded_preference_manager.get_kgk_block(), kgk_manager.kgk_crypter)
+        loaded_manager = PasswordSettingsManager(loaded_preference_manager)
+        loaded_manager.load_local_settings(loaded_kgk_manager)
+        self.assertEqual(['local.org', 'other.com', 'some.domain', 'third.domain', 'unit.test'],
+                         sorted(loaded_manager.get_domain_list()))
+
+    def test_load_peak_memory(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        with self.manager.batch():
+            for i in range(2000):
+                setting = PasswordSetting('domain' + str(i) + '.example.com')
+                setting.set_username('user' + str(i))
+                setting.set_notes(os.urandom(30).hex())
+                self.manager.set_setting(setting)
+        self.manager.store_local_settings(kgk_manager)
+        vault_size = len(self.preference_manager.get_settings_data())
+        loaded_manager = PasswordSettingsManager(PreferenceManager(self.preference_manager.settings_file))
+        tracemalloc.start()
+        try:
+            loaded_manager.load_local_settings(kgk_manager)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(2000, len(loaded_manager.get_domain_list()))
+        self.assertLess(peak, 16 * vault_size)
+
+    def test_authenticated_format(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        salt = os.urandom(32)
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', salt, iterations=3)))
+        setting = PasswordSetting('abc.de')
+        setting.set_notes('authenticated')
+        self.manager.set_setting(setting)
+        self.manager.set_format_version(2)
+        self.manager.store_local_settings(kgk_manager)
+        self.assertTrue(self.preference_manager.get_settings_data().startswith(b'\x02ctSESAM'))
+        loaded_manager = PasswordSettingsManager(self.preference_manager)
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual('authenticated', loaded_manager.get_setting('abc.de').get_notes())
+        blob = b64decode(self.manager.get_export_data(kgk_manager))
+        self.assertEqual(2, blob[0])
+        remote_kgk_manager = KgkManager()
+        remote_kgk_manager.set_preference_manager(self.preference_manager)
+        remote_kgk_manager.decrypt_kgk(blob[33:145], kgk_manager.kgk_crypter)
+        remote_kgk_manager.salt = blob[1:33]
+        imported_manager = PasswordSettingsManager(self.preference_manager)
+        imported_manager.update_from_export_data(remote_kgk_manager, blob)
+        self.assertEqual('authenticated', imported_manager.get_setting('abc.de').get_notes())
+        wrong_kgk_manager = KgkManager()
+        wrong_kgk_manager.decrypt_kgk(self.preference_manager.get_kgk_block(),
+                                      Crypter(Crypter.createIvKey(b'wrong', salt, iterations=3)))
+        self.assertRaises(ValueError, PasswordSettingsManager(self.preference_manager).load_local_settings,
+                          wrong_kgk_manager)
+        self.assertRaises(ValueError, self.manager.set_format_version, 3)
+
     def test_load_settings_from_file(self):
         settings = {
             'settings': {
@@ -211,13 +492,13 @@ class TestPasswordSettingsManager(unittest.TestCase):
             'synced': []
         }
         salt = os.urandom(32)
-        f = open(os.path.expanduser('~/.ctSESAM_test.pws'), 'bw')
         data = json.dumps(settings).encode('utf-8')
         kgk_manager = KgkManager()
         kgk_manager.set_preference_manager(self.preference_manager)
         kgk_manager.create_new_kgk()
         kgk_block = kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', salt, iterations=3)))
         crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
+        f = open(os.path.expanduser('~/.ctSESAM_test.pws'), 'bw')
         f.write(salt + kgk_block + crypter.encrypt(struct.pack('!I', 0) + Packer.compress(data)))
         f.close()
         self.preference_manager.read_file()
@@ -280,6 +561,180 @@ class TestPasswordSettingsManager(unittest.TestCase):
             settings['settings'],
             json.loads(str(Packer.decompress(settings_crypter.decrypt(data[145:])), encoding='utf-8')))
 
+    def test_batch(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        sync_manager = MockSyncManager(kgk_manager.get_kgk())
+        self.manager.sync_manager = sync_manager
+        with patch.object(self.manager, 'store_local_settings', wraps=self.manager.store_local_settings) as store:
+            with self.manager.batch():
+                for i in range(50):
+                    self.manager.set_setting(PasswordSetting('domain' + str(i) + '.com'))
+                    self.manager.store_settings(kgk_manager)
+                with self.manager.batch():
+                    self.manager.delete_setting(PasswordSetting('domain7.com'))
+                    self.manager.store_settings(kgk_manager)
+                self.assertEqual(0, store.call_count)
+            self.assertEqual(1, store.call_count)
+            self.assertEqual(1, len(sync_manager.pushed_data))
+            with self.manager.batch(kgk_manager):
+                self.manager.set_setting(PasswordSetting('hugo.com'))
+                self.manager.set_setting(PasswordSetting('other.com'))
+            self.assertEqual(2, store.call_count)
+            with self.assertRaises(RuntimeError):
+                with self.manager.batch(kgk_manager):
+                    self.manager.set_setting(PasswordSetting('failed.com'))
+                    raise RuntimeError()
+            self.assertEqual(2, store.call_count)
+            self.assertTrue(self.manager.pending_changes)
+        loaded_preference_manager = PreferenceManager(self.preference_manager.settings_file)
+        loaded_kgk_manager = KgkManager()
+        loaded_kgk_manager.decrypt_kgk(loaded_preference_manager.get_kgk_block(), kgk_manager.kgk_crypter)
+        loaded_manager = PasswordSettingsManager(loaded_preference_manager)
+        loaded_manager.load_local_settings(loaded_kgk_manager)
+        self.assertEqual(51, len(loaded_manager.get_domain_list()))
+        self.assertNotIn('domain7.com', loaded_manager.get_domain_list())
+
+    def test_auto_flush(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.sync_manager = MockSyncManager(kgk_manager.get_kgk())
+        timers = []
+
+        def create_timer(interval, function):
+            timers.append(ManualTimer(interval, function))
+            return timers[-1]
+        with patch('threading.Timer', side_effect=create_timer), \
+                patch('atexit.register') as register, patch('atexit.unregister') as unregister, \
+                patch.object(self.manager, 'store_local_settings',
+                             wraps=self.manager.store_local_settings) as store_mock:
+            self.manager.enable_auto_flush(kgk_manager, delay=2.0)
+            register.assert_called_once_with(self.manager.flush)
+            for i in range(20):
+                self.manager.set_setting(PasswordSetting('domain' + str(i) + '.com'))
+            self.assertEqual(20, len(timers))
+            self.assertEqual([True] * 19 + [False], [timer.cancelled for timer in timers])
+            self.assertEqual(2.0, timers[-1].interval)
+            self.assertEqual(0, store_mock.call_count)
+            timers[-1].fire()
+            self.assertEqual(1, store_mock.call_count)
+            self.assertFalse(self.manager.pending_changes)
+            self.manager.set_setting(PasswordSetting('hugo.com'))
+            self.manager.disable_auto_flush()
+            self.assertEqual(2, store_mock.call_count)
+            self.assertIsNone(self.manager.flush_timer)
+            unregister.assert_called_once_with(self.manager.flush)
+        self.assertEqual(1, len(self.manager.sync_manager.pushed_data))
+
+    def test_change_during_push(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        sync_manager = MockSyncManager(kgk_manager.get_kgk())
+        sync_manager.accepts_delta = False
+        self.manager.sync_manager = sync_manager
+        push = sync_manager.push
+        changed_in_time = []
+
+        def push_while_changing(data):
+            thread = threading.Thread(target=self.manager.set_setting, args=(PasswordSetting('during.push'),))
+            thread.start()
+            thread.join(5)
+            changed_in_time.append(not thread.is_alive())
+            return push(data)
+        sync_manager.push = push_while_changing
+        self.manager.set_setting(PasswordSetting('abc.de'))
+        self.manager.store_settings(kgk_manager)
+        self.assertEqual([True], changed_in_time)
+        self.assertTrue(self.manager.find_setting('abc.de').is_synced())
+        self.assertFalse(self.manager.find_setting('during.push').is_synced())
+        self.assertTrue(self.manager.update_remote)
+
+    def test_delta_sync(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.get_kgk_crypter(b'xyz', kgk_manager.get_kgk_crypter_salt())
+        kgk_manager.store_local_kgk_block()
+        sync_manager = MockSyncManager(kgk_manager.get_kgk())
+        self.manager.sync_manager = sync_manager
+        self.manager.load_settings(kgk_manager, 'xyz')
+        self.assertIsNotNone(self.manager.remote_version)
+        self.assertEqual([], self.manager.get_dirty_domains())
+        setting = self.manager.get_setting('unit.test')
+        setting.set_notes('changed')
+        setting.set_modification_date()
+        self.manager.set_setting(setting)
+        self.manager.delete_setting(self.manager.get_setting('some.domain'))
+        self.assertEqual(['unit.test'], self.manager.get_dirty_domains())
+        self.manager.update_sync_server_if_necessary(kgk_manager)
+        self.assertEqual([], sync_manager.pushed_data)
+        base_version, delta = sync_manager.pushed_deltas[0]
+        blob = b64decode(delta)
+        delta_kgk_manager = KgkManager()
+        delta_kgk_manager.decrypt_kgk(blob[33:145], kgk_manager.kgk_crypter)
+        delta_data = self.manager.decrypt_export_data(delta_kgk_manager, blob)
+        self.assertEqual(base_version, delta_data['base'])
+        self.assertEqual(['some.domain', 'unit.test'], sorted(delta_data['settings'].keys()))
+        self.assertEqual('changed', delta_data['settings']['unit.test']['notes'])
+        self.assertTrue(delta_data['settings']['some.domain']['deleted'])
+        self.assertEqual(PasswordSettingsManager.get_version(delta), self.manager.remote_version)
+        self.assertEqual([], self.manager.get_dirty_domains())
+        self.assertFalse(self.manager.update_remote)
+        sync_manager.accepts_delta = False
+        self.manager.set_setting(PasswordSetting('new.com'))
+        self.manager.update_sync_server_if_necessary(kgk_manager)
+        self.assertEqual(1, len(sync_manager.pushed_deltas))
+        blob = b64decode(sync_manager.pushed_data[0])
+        delta_kgk_manager.decrypt_kgk(blob[33:145], kgk_manager.kgk_crypter)
+        full_data = self.manager.decrypt_export_data(delta_kgk_manager, blob)
+        self.assertTrue(full_data['some.domain']['deleted'])
+        self.assertIn('new.com', full_data)
+        self.assertEqual('changed', full_data['unit.test']['notes'])
+        directory = tempfile.TemporaryDirectory()
+        other_preference_manager = PreferenceManager(os.path.join(directory.name, 'ctSESAM.pws'))
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.kgk = kgk_manager.get_kgk()
+        other_kgk_manager.salt = kgk_manager.get_kgk_crypter_salt()
+        other_kgk_manager.kgk_crypter = kgk_manager.kgk_crypter
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.sync_manager = MockSyncManager(kgk_manager.get_kgk())
+        other_manager.sync_manager.deltas = [delta]
+        other_manager.load_settings(other_kgk_manager, 'xyz')
+        self.assertEqual('changed', other_manager.get_setting('unit.test').get_notes())
+        self.assertNotIn('some.domain', other_manager.get_domain_list())
+        self.assertEqual(PasswordSettingsManager.get_version(delta), other_manager.remote_version)
+        directory.cleanup()
+
+    def test_delta_sync_template_change(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.get_kgk_crypter(b'xyz', kgk_manager.get_kgk_crypter_salt())
+        kgk_manager.store_local_kgk_block()
+        sync_manager = MockSyncManager(kgk_manager.get_kgk())
+        self.manager.sync_manager = sync_manager
+        self.manager.load_settings(kgk_manager, 'xyz')
+        setting = self.manager.get_setting('unit.test')
+        self.assertTrue(setting.is_synced())
+        setting.set_template('xxxxxxAnxx')
+        self.manager.set_setting(setting)
+        self.assertEqual(['unit.test'], self.manager.get_dirty_domains())
+        self.manager.update_sync_server_if_necessary(kgk_manager)
+        base_version, delta = sync_manager.pushed_deltas[0]
+        blob = b64decode(delta)
+        delta_kgk_manager = KgkManager()
+        delta_kgk_manager.decrypt_kgk(blob[33:145], kgk_manager.kgk_crypter)
+        delta_data = self.manager.decrypt_export_data(delta_kgk_manager, blob)
+        self.assertEqual(['unit.test'], list(delta_data['settings'].keys()))
+        self.assertEqual('xxxxxxAnxx', delta_data['settings']['unit.test']['passwordTemplate'])
+
     def test_update_from_sync(self):
         settings = {
             'settings': {
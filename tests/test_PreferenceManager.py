@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from preference_manager import PreferenceManager
+from unittest.mock import patch
+import tempfile
+import os
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class TestPreferenceManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings_file = os.path.join(self.directory.name, 'ct', 'ctSESAM.pws')
+        self.preference_manager = PreferenceManager(self.settings_file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.settings_file, 'rb') as f:
+            return f.read()
+
+    def test_store(self):
+        self.preference_manager.store_settings_data(b'settings')
+        self.assertEqual(b'\x00' * 144 + b'settings', self.read())
+        self.preference_manager.store_kgk_block(b'\x02' * 112)
+        self.preference_manager.store_salt(b'\x01' * 32)
+        self.assertEqual(b'\x01' * 32 + b'\x02' * 112 + b'settings', self.read())
+        self.preference_manager.store_settings_data(b'new')
+        self.assertEqual(b'\x01' * 32 + b'\x02' * 112 + b'new', self.read())
+        self.assertEqual([], [name for name in os.listdir(os.path.dirname(self.settings_file))
+                              if name.endswith('.tmp')])
+        loaded_manager = PreferenceManager(self.settings_file)
+        self.assertEqual(b'\x01' * 32, loaded_manager.get_salt())
+        self.assertEqual(b'\x02' * 112, loaded_manager.get_kgk_block())
+        self.assertEqual(b'new', loaded_manager.get_settings_data())
+        self.assertRaises(ValueError, self.preference_manager.store_salt, b'short')
+        self.assertRaises(TypeError, self.preference_manager.store_settings_data, 'str')
+
+    def test_transaction(self):
+        with patch('preference_manager.os.replace', wraps=os.replace) as replace:
+            with self.preference_manager.transaction():
+                self.preference_manager.store_settings_data(b'settings')
+                with self.preference_manager.transaction():
+                    self.preference_manager.store_kgk_block(b'\x02' * 112)
+                self.preference_manager.store_salt(b'\x01' * 32)
+                self.assertFalse(os.path.exists(self.settings_file))
+            self.assertEqual(1, replace.call_count)
+            self.preference_manager.store_salt(b'\x01' * 32)
+            self.assertEqual(1, replace.call_count)
+        self.assertEqual(b'\x01' * 32 + b'\x02' * 112 + b'settings', self.read())
+
+    def test_transaction_rollback(self):
+        self.preference_manager.store_settings_data(b'settings')
+        with self.assertRaises(RuntimeError):
+            with self.preference_manager.transaction():
+                self.preference_manager.store_settings_data(b'changed')
+                raise RuntimeError()
+        self.assertEqual(b'settings', self.preference_manager.get_settings_data())
+        self.assertEqual(b'\x00' * 144 + b'settings', self.read())
+
+    def test_failed_write_keeps_file(self):
+        self.preference_manager.store_settings_data(b'settings')
+        with patch('preference_manager.os.replace', side_effect=OSError()):
+            self.assertRaises(OSError, self.preference_manager.store_settings_data, b'changed')
+        self.assertEqual(b'\x00' * 144 + b'settings', self.read())
+        self.assertEqual([], [name for name in os.listdir(os.path.dirname(self.settings_file))
+                              if name.endswith('.tmp')])
+
+    def test_lazy(self):
+        self.preference_manager.store_kgk_block(b'\x02' * 112)
+        self.preference_manager.store_salt(b'\x01' * 32)
+        self.preference_manager.store_settings_data(b'settings' * 1000)
+        lazy_manager = PreferenceManager(self.settings_file, lazy=True)
+        self.assertIsNone(lazy_manager.mapping)
+        salt_view = lazy_manager.get_salt_view()
+        self.assertIs(lazy_manager.mapping, salt_view.obj)
+        self.assertEqual(b'\x01' * 32, salt_view)
+        self.assertEqual(b'\x02' * 112, lazy_manager.get_kgk_block_view())
+        self.assertEqual(b'\x01' * 32, lazy_manager.get_salt())
+        lazy_manager.store_salt(b'\x03' * 32)
+        self.assertEqual(b'\x01' * 32, salt_view)
+        salt_view.release()
+        self.assertEqual(b'\x03' * 32 + b'\x02' * 112 + b'settings' * 1000, self.read())
+        self.assertEqual(b'settings' * 1000, lazy_manager.get_settings_data())
+        self.preference_manager.read_file()
+        self.assertEqual(b'\x03' * 32, self.preference_manager.get_salt())
+        empty_manager = PreferenceManager(os.path.join(self.directory.name, 'missing.pws'), lazy=True)
+        self.assertEqual(b'', empty_manager.get_settings_data())
+
+    @unittest.skipIf(fcntl is None, "File locks need fcntl.")
+    def test_lock(self):
+        with self.preference_manager.lock():
+            with self.preference_manager.lock():
+                with open(self.settings_file + '.lock', 'rb') as f:
+                    self.assertRaises(BlockingIOError, fcntl.flock, f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            with open(self.settings_file + '.lock', 'rb') as f:
+                self.assertRaises(BlockingIOError, fcntl.flock, f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with open(self.settings_file + '.lock', 'rb') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def test_change_detection(self):
+        self.preference_manager.store_settings_data(b'settings')
+        self.assertFalse(self.preference_manager.has_changed())
+        self.assertFalse(self.preference_manager.reload_if_changed())
+        other_manager = PreferenceManager(self.settings_file)
+        other_manager.store_settings_data(b'other settings')
+        self.assertTrue(self.preference_manager.has_changed())
+        self.assertTrue(self.preference_manager.reload_if_changed())
+        self.assertEqual(b'other settings', self.preference_manager.get_settings_data())
+        self.assertFalse(self.preference_manager.has_changed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from settings_collection import SettingsCollection
+from password_setting import PasswordSetting
+
+
+class TestSettingsCollection(unittest.TestCase):
+    def test_order(self):
+        collection = SettingsCollection([PasswordSetting('a.de'), PasswordSetting('b.de'), PasswordSetting('c.de')])
+        self.assertEqual(['a.de', 'b.de', 'c.de'], collection.get_domains())
+        replacement = PasswordSetting('a.de')
+        collection.add(replacement)
+        self.assertEqual(['b.de', 'c.de', 'a.de'], [setting.get_domain() for setting in collection])
+        self.assertIs(replacement, collection.find('a.de'))
+        self.assertEqual(3, len(collection))
+
+    def test_find_and_remove(self):
+        collection = SettingsCollection()
+        self.assertIsNone(collection.find('a.de'))
+        self.assertEqual(0, len(collection))
+        setting = PasswordSetting('a.de')
+        collection.add(setting)
+        self.assertIn('a.de', collection)
+        self.assertIs(setting, collection.remove('a.de'))
+        self.assertIsNone(collection.remove('a.de'))
+        self.assertNotIn('a.de', collection)
+
+    def test_remove_while_iterating(self):
+        collection = SettingsCollection([PasswordSetting('a.de'), PasswordSetting('b.de')])
+        for setting in collection:
+            collection.remove(setting.get_domain())
+        self.assertEqual([], collection.get_domains())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from settings_merger import SettingsMerger
+from settings_collection import SettingsCollection
+from password_setting import PasswordSetting
+
+
+class TestSettingsMerger(unittest.TestCase):
+    def setUp(self):
+        self.settings = SettingsCollection()
+        for domain, m_date in [('old.de', '2014-01-01T00:00:00'), ('new.de', '2016-01-01T00:00:00'),
+                               ('same.de', '2015-01-01T00:00:00'), ('gone.de', '2014-01-01T00:00:00'),
+                               ('local.de', '2015-01-01T00:00:00')]:
+            setting = PasswordSetting(domain)
+            setting.set_creation_date('2013-01-01T00:00:00')
+            setting.set_modification_date(m_date)
+            self.settings.add(setting)
+
+    def test_merge(self):
+        data_sets = {
+            'old.de': {'domain': 'old.de', 'notes': 'remote', 'cDate': '2013-01-01T00:00:00',
+                       'mDate': '2015-01-01T00:00:00'},
+            'new.de': {'domain': 'new.de', 'notes': 'remote', 'cDate': '2013-01-01T00:00:00',
+                       'mDate': '2015-01-01T00:00:00'},
+            'same.de': {'domain': 'same.de', 'notes': 'remote', 'cDate': '2013-01-01T00:00:00',
+                        'mDate': '2015-01-01T00:00:00'},
+            'gone.de': {'mDate': '2015-01-01T00:00:00', 'deleted': True},
+            'unknown.de': {'mDate': '2015-01-01T00:00:00', 'deleted': True},
+            'added.de': {'domain': 'added.de', 'notes': 'remote', 'cDate': '2013-01-01T00:00:00'}
+        }
+        result = SettingsMerger.merge(self.settings, data_sets, {'old.de'})
+        self.assertEqual(['added.de'], result.added)
+        self.assertEqual(['old.de'], result.updated)
+        self.assertEqual(['gone.de'], result.deleted)
+        self.assertEqual(['new.de'], result.kept)
+        self.assertEqual(['local.de'], result.local_only)
+        self.assertTrue(result.has_changes())
+        self.assertTrue(result.has_local_changes())
+        self.assertEqual(['old.de', 'new.de', 'same.de', 'local.de', 'added.de'], self.settings.get_domains())
+        self.assertEqual('remote', self.settings.find('old.de').get_notes())
+        self.assertTrue(self.settings.find('old.de').is_synced())
+        self.assertEqual('', self.settings.find('new.de').get_notes())
+        self.assertEqual('', self.settings.find('same.de').get_notes())
+        self.assertFalse(self.settings.find('added.de').is_synced())
+
+    def test_merge_all_synced(self):
+        data_sets = {'old.de': {'domain': 'old.de', 'cDate': '2013-01-01T00:00:00', 'mDate': '2015-01-01T00:00:00'}}
+        result = SettingsMerger.merge(self.settings, data_sets)
+        self.assertTrue(self.settings.find('old.de').is_synced())
+        self.assertEqual(['new.de', 'same.de', 'gone.de', 'local.de'], result.local_only)
+
+    def test_merge_locally_deleted(self):
+        data_sets = {
+            'removed.de': {'domain': 'removed.de', 'cDate': '2013-01-01T00:00:00', 'mDate': '2015-01-01T00:00:00'},
+            'revived.de': {'domain': 'revived.de', 'cDate': '2013-01-01T00:00:00', 'mDate': '2016-01-01T00:00:00'}
+        }
+        deleted_domains = {'removed.de': '2015-06-01T00:00:00', 'revived.de': '2015-06-01T00:00:00'}
+        result = SettingsMerger.merge(self.settings, data_sets, deleted_domains=deleted_domains)
+        self.assertEqual(['revived.de'], result.added)
+        self.assertEqual(['removed.de'], result.kept)
+        self.assertIsNone(self.settings.find('removed.de'))
+
+    def test_merge_nothing(self):
+        result = SettingsMerger.merge(SettingsCollection(), {})
+        self.assertFalse(result.has_changes())
+        self.assertFalse(result.has_local_changes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from sqlite_store import SqliteSettingsStore
+from kgk_manager import KgkManager
+from preference_manager import PreferenceManager
+from password_settings_manager import PasswordSettingsManager
+from password_setting import PasswordSetting
+from crypter import Crypter
+import tempfile
+import os
+
+
+class TestSqliteSettingsStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_file = os.path.join(self.directory.name, 'ctSESAM.sqlite')
+        self.store = SqliteSettingsStore(self.database_file)
+        self.kgk_crypter = Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3))
+        self.kgk_manager = KgkManager()
+        self.kgk_manager.set_preference_manager(self.store)
+        self.kgk_manager.create_new_kgk()
+        self.kgk_manager.create_and_save_new_kgk_block(self.kgk_crypter)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_set_and_find(self):
+        self.assertRaises(PermissionError, self.store.find_setting, 'abc.de')
+        self.assertRaises(PermissionError, self.store.get_sync_settings)
+        self.assertRaises(PermissionError, self.store.store_sync_settings, b'')
+        self.store.unlock(self.kgk_manager)
+        setting = PasswordSetting('abc.de')
+        setting.set_creation_date('2016-01-01T10:00:00.123')
+        setting.set_modification_date('2016-02-01T10:00:00.456')
+        setting.set_notes('secret note')
+        setting.set_synced(True)
+        self.store.set_setting(setting)
+        self.store.set_setting(PasswordSetting('other.com'))
+        self.assertIsNone(self.store.find_setting('missing.com'))
+        found_setting = self.store.find_setting('abc.de')
+        self.assertEqual(setting.to_dict(), found_setting.to_dict())
+        self.assertTrue(found_setting.is_synced())
+        self.assertEqual(2, self.store.get_setting_count())
+        self.assertEqual(['abc.de', 'other.com'], sorted(self.store.get_domain_list()))
+        self.assertTrue(self.store.delete_setting('other.com'))
+        self.assertFalse(self.store.delete_setting('other.com'))
+        self.assertEqual(1, self.store.get_setting_count())
+        self.store.close()
+        with open(self.database_file, 'rb') as f:
+            data = f.read()
+        self.assertNotIn(b'abc.de', data)
+        self.assertNotIn(b'secret note', data)
+
+    def test_reopen(self):
+        self.store.unlock(self.kgk_manager)
+        self.store.set_setting(PasswordSetting('abc.de'))
+        self.store.close()
+        self.store = SqliteSettingsStore(self.database_file)
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.store)
+        kgk_manager.decrypt_kgk(self.store.get_kgk_block(), self.kgk_crypter)
+        self.store.unlock(kgk_manager)
+        self.assertEqual('abc.de', self.store.find_setting('abc.de').get_domain())
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.create_new_kgk()
+        self.assertRaises(PermissionError, self.store.unlock, other_kgk_manager)
+
+    def test_lookup(self):
+        self.store.unlock(self.kgk_manager)
+        for domain in ['abc.de', 'abd.de', 'other.com']:
+            self.store.set_setting(PasswordSetting(domain))
+        self.assertTrue(self.store.has_setting('abd.de'))
+        self.assertFalse(self.store.has_setting('ab'))
+        self.assertEqual(['abc.de', 'abd.de'], self.store.complete('ab'))
+        self.assertEqual(['abc.de'], self.store.complete('ab', 1))
+        self.assertEqual('abc.de', self.store.get_setting('abc.de').get_domain())
+        self.assertEqual('new.org', self.store.get_setting('new.org').get_domain())
+        self.assertFalse(self.store.has_setting('new.org'))
+        self.assertIsNone(self.store.hash_cache)
+
+    def test_single_row_write(self):
+        self.store.unlock(self.kgk_manager)
+        for i in range(20):
+            self.store.set_setting(PasswordSetting('domain' + str(i) + '.com'))
+        rows = dict(self.store.connection.execute("SELECT domain_hash, data FROM settings").fetchall())
+        self.store.set_setting(PasswordSetting('domain7.com'))
+        changed_rows = dict(self.store.connection.execute("SELECT domain_hash, data FROM settings").fetchall())
+        self.assertEqual([self.store.get_domain_hash('domain7.com')],
+                         [domain_hash for domain_hash in rows if rows[domain_hash] != changed_rows[domain_hash]])
+
+    def test_tampered_row(self):
+        self.store.unlock(self.kgk_manager)
+        self.store.set_setting(PasswordSetting('abc.de'))
+        self.store.set_setting(PasswordSetting('other.com'))
+        self.store.connection.execute("UPDATE settings SET domain_hash = ? WHERE domain_hash = ?",
+                                      (b'swapped', self.store.get_domain_hash('other.com')))
+        self.store.connection.execute("UPDATE settings SET domain_hash = ? WHERE domain_hash = ?",
+                                      (self.store.get_domain_hash('other.com'),
+                                       self.store.get_domain_hash('abc.de')))
+        self.assertRaises(ValueError, self.store.find_setting, 'other.com')
+
+    def test_transaction_rollback(self):
+        self.store.unlock(self.kgk_manager)
+        with self.assertRaises(RuntimeError):
+            with self.store.transaction():
+                self.store.set_setting(PasswordSetting('abc.de'))
+                raise RuntimeError()
+        self.assertEqual(0, self.store.get_setting_count())
+
+    def test_import_and_export(self):
+        preference_manager = PreferenceManager(os.path.join(self.directory.name, 'ctSESAM.pws'))
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(self.kgk_crypter)
+        settings_manager = PasswordSettingsManager(preference_manager)
+        setting = PasswordSetting('abc.de')
+        setting.set_username('hugo')
+        settings_manager.set_setting(setting)
+        settings_manager.set_setting(PasswordSetting('other.com'))
+        settings_manager.store_local_settings(kgk_manager)
+        database_file = os.path.join(self.directory.name, 'imported.sqlite')
+        store = SqliteSettingsStore(database_file)
+        store.import_settings(settings_manager, kgk_manager)
+        store.close()
+        store = SqliteSettingsStore(database_file)
+        store_kgk_manager = KgkManager()
+        store_kgk_manager.set_preference_manager(store)
+        store_kgk_manager.decrypt_kgk(store.get_kgk_block(), self.kgk_crypter)
+        store.unlock(store_kgk_manager)
+        self.assertEqual('hugo', store.find_setting('abc.de').get_username())
+        store.set_setting(PasswordSetting('new.org'))
+        exported_preference_manager = PreferenceManager(os.path.join(self.directory.name, 'exported.pws'))
+        exported_manager = PasswordSettingsManager(exported_preference_manager)
+        store.export_settings(exported_manager, store_kgk_manager)
+        store.close()
+        loaded_manager = PasswordSettingsManager(PreferenceManager(exported_preference_manager.settings_file))
+        loaded_manager.load_local_settings(store_kgk_manager)
+        self.assertEqual(['abc.de', 'new.org', 'other.com'], sorted(loaded_manager.get_domain_list()))
+        self.assertEqual('hugo', loaded_manager.get_setting('abc.de').get_username())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,6 +53,77 @@ def mock_requests_post(url, data, headers, verify):
     return MockResponse(str(b64encode(b'Test'), encoding='utf-8'))
 
 
+def mock_requests_post_deltas(url, data, headers, verify):
+    """
+    Returns a response with data and deltas like a server which accepts deltas.
+
+    :param url:
+    :param data:
+    :param headers:
+    :param verify:
+    :return:
+    :rtype: MockResponse
+    """
+    response = MockResponse()
+    response.text = json.dumps({
+        "status": "ok",
+        "result": str(b64encode(b'Test'), encoding='utf-8'),
+        "deltas": [str(b64encode(b'Delta'), encoding='utf-8')]
+    })
+    return response
+
+
+def mock_requests_post_not_found(url, data, headers, verify):
+    """
+    Returns a response like a server without the requested file.
+
+    :param url:
+    :param data:
+    :param headers:
+    :param verify:
+    :return:
+    :rtype: MockResponse
+    """
+    response = MockResponse()
+    response.status_code = 404
+    return response
+
+
+def mock_requests_post_rejected(url, data, headers, verify):
+    """
+    Returns a response like a server which rejects a delta because it is based on outdated data.
+
+    :param url:
+    :param data:
+    :param headers:
+    :param verify:
+    :return:
+    :rtype: MockResponse
+    """
+    response = MockResponse()
+    response.text = json.dumps({
+        "status": False,
+        "message": "The base version is outdated."
+    })
+    return response
+
+
+def mock_requests_post_html(url, data, headers, verify):
+    """
+    Returns a HTML page like a server which answers unknown files with an error page.
+
+    :param url:
+    :param data:
+    :param headers:
+    :param verify:
+    :return:
+    :rtype: MockResponse
+    """
+    response = MockResponse()
+    response.text = '<html><body>Not here</body></html>'
+    return response
+
+
 class TestSync(unittest.TestCase):
     @patch('requests.post', mock_requests_post_empty)
     def test_pull_empty_request(self):
@@ -73,6 +144,48 @@ class TestSync(unittest.TestCase):
         sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
         self.assertTrue(sync.push(str(b64encode(b'Test'), encoding='utf-8')))
 
+    @patch('requests.post', mock_requests_post_deltas)
+    def test_pull_deltas(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        status, blob = sync.pull()
+        self.assertTrue(status)
+        self.assertEqual(str(b64encode(b'Test'), encoding='utf-8'), blob)
+        self.assertEqual([str(b64encode(b'Delta'), encoding='utf-8')], sync.deltas)
+        self.assertTrue(sync.supports_delta)
+
+    @patch('requests.post', mock_requests_post)
+    def test_pull_without_deltas(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        self.assertFalse(sync.supports_delta)
+        sync.pull()
+        self.assertFalse(sync.supports_delta)
+
+    @patch('requests.post', mock_requests_post)
+    def test_push_delta(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        self.assertTrue(sync.push_delta('version', str(b64encode(b'Delta'), encoding='utf-8')))
+        self.assertTrue(sync.supports_delta)
+
+    @patch('requests.post', mock_requests_post_not_found)
+    def test_push_delta_unsupported(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        self.assertFalse(sync.push_delta('version', str(b64encode(b'Delta'), encoding='utf-8')))
+        self.assertFalse(sync.supports_delta)
+
+    @patch('requests.post', mock_requests_post_rejected)
+    def test_push_delta_rejected(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        sync.supports_delta = True
+        self.assertFalse(sync.push_delta('version', str(b64encode(b'Delta'), encoding='utf-8')))
+        self.assertTrue(sync.supports_delta)
+
+    @patch('requests.post', mock_requests_post_html)
+    def test_push_delta_no_json(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        sync.supports_delta = True
+        self.assertFalse(sync.push_delta('version', str(b64encode(b'Delta'), encoding='utf-8')))
+        self.assertFalse(sync.supports_delta)
+
 
 if __name__ == '__main__':
     unittest.main()